@@ -0,0 +1,141 @@
+import csv
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.urls import reverse
+from rest_framework.utils.encoders import JSONEncoder
+
+from app.models import Dataset
+from .fast_serializers import DatasetValuesSerializer
+
+
+# Whole-catalog exports for aggregators, streamed a chunk of datasets at a
+# time: rows come from a server-side cursor (.iterator), and each chunk's
+# topics and resources are loaded with one query each, so memory use does
+# not grow with the catalog and the first bytes are sent right away.
+
+DCAT_SCHEMA = 'https://project-open-data.cio.gov/v1.1/schema'
+CSV_COLUMNS = [
+    'id', 'title', 'slug', 'landing_page', 'description', 'organisation', 'topics', 'license', 'author_name',
+    'maintainer_name', 'maintainer_email', 'resource_count', 'formats', 'created', 'updated', 'published_date',
+]
+
+
+def published_datasets(request, chunk_size=None):
+    """Published datasets as the API represents them, in id order"""
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'EKAN_EXPORT_CHUNK_SIZE', 500)
+    serializer = DatasetValuesSerializer({'request': request})
+    queryset = serializer.values(Dataset.objects.filter(is_published=True).order_by('id'))
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from serializer.serialize(chunk)
+
+
+def landing_page(request, dataset):
+    return request.build_absolute_uri(reverse('app:dataset', kwargs={'slug': dataset['slug']}))
+
+
+def dumps(data):
+    # Encoded the way the API's JSONRenderer encodes it
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def ndjson(request):
+    """One API dataset representation per line"""
+    for dataset in published_datasets(request):
+        yield dumps(dataset) + '\n'
+
+
+class Echo:
+    """A file-like object csv.writer writes to, returning each line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_rows(request):
+    """One row per dataset, with organisation, topics and license by title"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for dataset in published_datasets(request):
+        terms = dataset['license_details']
+        formats = {resource['format_details']['title'] for resource in dataset['resources']
+                   if resource['format_details']}
+        yield writer.writerow([
+            dataset['id'], dataset['title'], dataset['slug'], landing_page(request, dataset), dataset['description'],
+            dataset['organisation_details']['title'],
+            '; '.join(topic['title'] for topic in dataset['topics_details']),
+            terms['title'] if terms else '',
+            dataset['author_name'], dataset['maintainer_name'], dataset['maintainer_email'],
+            dataset['resource_count'], '; '.join(sorted(formats)),
+            dataset['created'], dataset['updated'], dataset['published_date'] or '',
+        ])
+
+
+def dcat_dataset(request, dataset):
+    """A DCAT-US (Project Open Data v1.1) dataset entry"""
+    url = landing_page(request, dataset)
+    organisation = dataset['organisation_details']
+    terms = dataset['license_details']
+    themes = [topic['title'] for topic in dataset['topics_details']]
+    contact = {'@type': 'vcard:Contact', 'fn': dataset['maintainer_name'] or dataset['author_name']
+               or organisation['title']}
+    if dataset['maintainer_email']:
+        contact['hasEmail'] = f"mailto:{dataset['maintainer_email']}"
+
+    entry = {
+        '@type': 'dcat:Dataset',
+        'identifier': url,
+        'title': dataset['title'],
+        'description': dataset['description'],
+        'keyword': themes or [organisation['title']],
+        'modified': dataset['updated'],
+        'issued': dataset['published_date'] or dataset['created'],
+        'publisher': {'@type': 'org:Organization', 'name': organisation['title']},
+        'contactPoint': contact,
+        'accessLevel': 'public',
+        'landingPage': url,
+        'theme': themes,
+        'distribution': [dcat_distribution(resource) for resource in dataset['resources']],
+    }
+    if terms and terms['url']:
+        entry['license'] = terms['url']
+    return entry
+
+
+def dcat_distribution(resource):
+    file_format = resource['format_details']
+    distribution = {
+        '@type': 'dcat:Distribution',
+        'title': resource['title'],
+        'downloadURL': resource['download_url'],
+        'mediaType': resource['mimetype'] or (file_format and file_format['mime_type']) or 'application/octet-stream',
+    }
+    if resource['description']:
+        distribution['description'] = resource['description']
+    if file_format:
+        distribution['format'] = file_format['title']
+    return distribution
+
+
+def data_json(request):
+    """The catalog as a DCAT-US data.json document"""
+    catalog = {
+        '@context': f'{DCAT_SCHEMA}/catalog.jsonld',
+        '@id': request.build_absolute_uri(),
+        '@type': 'dcat:Catalog',
+        'conformsTo': DCAT_SCHEMA,
+        'describedBy': f'{DCAT_SCHEMA}/catalog.json',
+    }
+    # The catalog object is written up to its dataset array, which is streamed
+    yield dumps(catalog)[:-1] + ',"dataset":['
+    separator = ''
+    for dataset in published_datasets(request):
+        yield separator + dumps(dcat_dataset(request, dataset))
+        separator = ','
+    yield ']}'
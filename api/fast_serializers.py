@@ -0,0 +1,179 @@
+from collections import defaultdict
+
+from django.urls import reverse
+from rest_framework import serializers
+
+from app.models import Dataset, Organisation, Resource, Topic, human_file_size
+from .serializers import FormatSerializer, LicenseSerializer, TopicSerializer
+
+
+# DRF's own datetime formatting, so output matches the ModelSerializers exactly
+DATETIME = serializers.DateTimeField()
+
+
+def related(row, prefix, fields):
+    """The columns of a joined row fetched as prefix__field, or None if there is no row"""
+    if row[f'{prefix}__id'] is None:
+        return None
+    return {field: row[f'{prefix}__{field}'] for field in fields}
+
+
+def full_name(first_name, last_name):
+    """User.get_full_name() from the two columns"""
+    return f'{first_name} {last_name}'.strip()
+
+
+class ValuesSerializer:
+    """
+    Read-only list serializer building dicts straight from `.values()` rows.
+
+    Subclasses mirror a ModelSerializer field for field, in the same order
+    and with the same formatting, so the rendered bytes are identical; see
+    the tests in api/tests.py, which compare both. `values()` replaces the
+    queryset's joins and prefetches with the columns in `columns`, and
+    `serialize()` loads anything one-to-many for the whole page at once.
+    """
+    columns = ()
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.request = self.context.get('request')
+
+    def values(self, queryset):
+        return queryset.select_related(None).prefetch_related(None).values(*self.columns)
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+    def to_representation(self, row):
+        raise NotImplementedError
+
+    def absolute_url(self, url):
+        return self.request.build_absolute_uri(url) if self.request else url
+
+    def file_url(self, field, name):
+        """FileField.to_representation for a stored file name"""
+        if not name:
+            return None
+        return self.absolute_url(field.storage.url(name))
+
+
+class ResourceValuesSerializer(ValuesSerializer):
+    """ResourceSerializer from values() rows"""
+    format_fields = FormatSerializer.Meta.fields
+    columns = (
+        'id', 'title', 'slug', 'description', 'file', 'url', 'size', 'mimetype', 'encoding',
+        'is_preview_available', 'download_count', 'created', 'updated',
+        *[f'format__{field}' for field in format_fields],
+    )
+    file_field = Resource._meta.get_field('file')
+
+    def to_representation(self, row):
+        file, url = row['file'], row['url']
+        return {
+            'id': row['id'],
+            'title': row['title'],
+            'slug': row['slug'],
+            'description': row['description'],
+            'file': self.file_url(self.file_field, file),
+            'url': url,
+            'size': row['size'],
+            'file_size_human': human_file_size(row['size']),
+            'mimetype': row['mimetype'],
+            'encoding': row['encoding'],
+            'format_details': related(row, 'format', self.format_fields),
+            'is_preview_available': row['is_preview_available'],
+            'download_count': row['download_count'],
+            'is_file_upload': bool(file),
+            'is_external_url': bool(url and not file),
+            'download_url': self.download_url(row['slug']),
+            'created': DATETIME.to_representation(row['created']),
+            'updated': DATETIME.to_representation(row['updated']),
+        }
+
+    def download_url(self, slug):
+        if self.request is None:
+            return None
+        return self.request.build_absolute_uri(reverse('app:resource_download', kwargs={'slug': slug}))
+
+
+class DatasetValuesSerializer(ValuesSerializer):
+    """DatasetSerializer from values() rows, with topics and resources loaded per page"""
+    organisation_fields = ('id', 'title', 'slug', 'description', 'url', 'logo', 'is_active', 'created', 'updated',
+                           'dataset_count')
+    license_fields = LicenseSerializer.Meta.fields
+    topic_fields = TopicSerializer.Meta.fields
+    columns = (
+        'id', 'title', 'slug', 'description', 'notes', 'organisation', 'license',
+        'author__first_name', 'author__last_name', 'maintainer_name', 'maintainer_email',
+        'is_published', 'is_featured', 'resource_count', 'created', 'updated', 'published_date',
+        *[f'organisation__{field}' for field in organisation_fields],
+        'organisation__manager', 'organisation__manager__first_name', 'organisation__manager__last_name',
+        *[f'license__{field}' for field in license_fields],
+    )
+    logo_field = Organisation._meta.get_field('logo')
+
+    def serialize(self, rows):
+        rows = list(rows)
+        ids = [row['id'] for row in rows]
+
+        # One query each, in the order the prefetches of DatasetSerializer return them
+        self.topics = defaultdict(list)
+        through = Dataset.topics.through.objects.filter(dataset_id__in=ids).order_by(*[
+            f'topic__{field}' for field in Topic._meta.ordering
+        ])
+        for row in through.values('dataset_id', *[f'topic__{field}' for field in self.topic_fields]):
+            self.topics[row['dataset_id']].append(row)
+
+        self.resources = defaultdict(list)
+        resource_serializer = ResourceValuesSerializer(self.context)
+        resources = Resource.objects.filter(dataset_id__in=ids)
+        for row in resources.values('dataset_id', *resource_serializer.columns):
+            self.resources[row['dataset_id']].append(resource_serializer.to_representation(row))
+
+        return super().serialize(rows)
+
+    def to_representation(self, row):
+        topics = self.topics[row['id']]
+        return {
+            'id': row['id'],
+            'title': row['title'],
+            'slug': row['slug'],
+            'description': row['description'],
+            'notes': row['notes'],
+            'organisation': row['organisation'],
+            'organisation_details': self.organisation(row),
+            'topics': [topic['topic__id'] for topic in topics],
+            'topics_details': [related(topic, 'topic', self.topic_fields) for topic in topics],
+            'license': row['license'],
+            'license_details': related(row, 'license', self.license_fields),
+            'author_name': full_name(row['author__first_name'], row['author__last_name']),
+            'maintainer_name': row['maintainer_name'],
+            'maintainer_email': row['maintainer_email'],
+            'is_published': row['is_published'],
+            'is_featured': row['is_featured'],
+            'resource_count': row['resource_count'],
+            'resources': self.resources[row['id']],
+            'created': DATETIME.to_representation(row['created']),
+            'updated': DATETIME.to_representation(row['updated']),
+            'published_date': DATETIME.to_representation(row['published_date']),
+        }
+
+    def organisation(self, row):
+        """OrganisationSerializer, in its field order"""
+        manager = None
+        if row['organisation__manager'] is not None:
+            manager = full_name(row['organisation__manager__first_name'], row['organisation__manager__last_name'])
+        return {
+            'id': row['organisation__id'],
+            'title': row['organisation__title'],
+            'slug': row['organisation__slug'],
+            'description': row['organisation__description'],
+            'url': row['organisation__url'],
+            'logo': self.file_url(self.logo_field, row['organisation__logo']),
+            'manager_name': manager,
+            'is_active': row['organisation__is_active'],
+            'created': DATETIME.to_representation(row['organisation__created']),
+            'updated': DATETIME.to_representation(row['organisation__updated']),
+            'dataset_count': row['organisation__dataset_count'],
+        }
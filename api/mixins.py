@@ -0,0 +1,261 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+from app import metrics
+from app.cache import cache, catalog_version
+from app.conditional import Validators
+
+
+class QueryPlan:
+    """Relations to join or prefetch to serialize a queryset"""
+
+    def __init__(self):
+        self.select = set()
+        self.prefetch = {}
+
+    def add_prefetch(self, path, lookup=None):
+        # A Prefetch with a custom queryset wins over a plain lookup on the same path
+        if lookup is not None or path not in self.prefetch:
+            self.prefetch[path] = lookup
+
+    @property
+    def is_flat(self):
+        """True if everything can be fetched with joins in the parent query"""
+        return not self.prefetch
+
+    def apply(self, queryset):
+        if self.select:
+            queryset = queryset.select_related(*sorted(self.select))
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*[
+                lookup or path for path, lookup in sorted(self.prefetch.items())
+            ])
+        return queryset
+
+
+def get_relation(model, name):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    return field if field.is_relation else None
+
+
+def build_plan(serializer, model):
+    """Walk a serializer's fields and work out how to fetch everything they read"""
+    plan = QueryPlan()
+    hints = getattr(getattr(serializer, 'Meta', None), 'method_field_relations', {})
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        if isinstance(field, serializers.SerializerMethodField):
+            for path in hints.get(name, []):
+                add_path(plan, model, path.split('__'))
+            continue
+
+        if field.source == '*':
+            continue
+
+        attrs = field.source_attrs
+        relation = get_relation(model, attrs[0])
+        if relation is None:
+            continue
+
+        if isinstance(field, (serializers.ListSerializer, serializers.BaseSerializer)):
+            child = field.child if isinstance(field, serializers.ListSerializer) else field
+            child_plan = build_plan(child, relation.related_model)
+            if relation.many_to_one or relation.one_to_one:
+                if child_plan.is_flat:
+                    plan.select.add(attrs[0])
+                    plan.select.update(f'{attrs[0]}__{path}' for path in child_plan.select)
+                else:
+                    plan.add_prefetch(attrs[0], Prefetch(attrs[0], queryset=nested_queryset(relation, child_plan)))
+            else:
+                plan.add_prefetch(attrs[0], Prefetch(attrs[0], queryset=nested_queryset(relation, child_plan)))
+            continue
+
+        if isinstance(field, serializers.ManyRelatedField):
+            plan.add_prefetch(attrs[0])
+            continue
+
+        if isinstance(field, serializers.RelatedField) and len(attrs) == 1:
+            # Primary keys come straight from the foreign key column
+            continue
+
+        add_path(plan, model, attrs)
+
+    return plan
+
+
+def add_path(plan, model, attrs):
+    """Join (or prefetch) the relations along a dotted source such as author.username"""
+    path = []
+    for attr in attrs:
+        relation = get_relation(model, attr)
+        if relation is None:
+            return
+        path.append(attr)
+        if relation.many_to_many or relation.one_to_many:
+            plan.add_prefetch('__'.join(path))
+            return
+        plan.select.add('__'.join(path))
+        model = relation.related_model
+
+
+def nested_queryset(relation, plan):
+    return plan.apply(relation.related_model._default_manager.all())
+
+
+def optimise_queryset(queryset, serializer):
+    return build_plan(serializer, queryset.model).apply(queryset)
+
+
+class OptimisedQuerysetMixin:
+    """
+    Fetch everything the serializer reads in a fixed number of queries.
+
+    Nested serializers and dotted sources become select_related joins or
+    prefetches, and SerializerMethodFields declare the relations they read
+    in Meta.method_field_relations. Counts are stored on the models.
+    """
+
+    def get_queryset(self):
+        return optimise_queryset(super().get_queryset(), self.get_serializer())
+
+
+class FastListMixin:
+    """
+    Serve list actions from `.values()` rows through `fast_serializer_class`
+    (see api.fast_serializers) instead of model instances and the
+    ModelSerializer, producing the same bytes at a fraction of the CPU.
+    Requests using ?fields= or ?expand= take the regular path, as does
+    everything when EKAN_FAST_SERIALIZERS is off.
+    """
+    fast_serializer_class = None
+
+    def use_fast_serializer(self, request):
+        return (
+            self.fast_serializer_class is not None
+            and getattr(settings, 'EKAN_FAST_SERIALIZERS', False)
+            and 'fields' not in request.query_params
+            and 'expand' not in request.query_params
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_serializer(request):
+            return super().list(request, *args, **kwargs)
+
+        serializer = self.fast_serializer_class(self.get_serializer_context())
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(queryset))
+
+
+class ConditionalRetrieveMixin:
+    """
+    Answer repeat detail requests with 304 Not Modified.
+
+    The validators (see app.conditional) come from one small query on
+    `validators`, checked before the object is loaded and serialized. List
+    it before CachedResponseMixin, which then keys detail entries by the
+    current ETag, so a cached body never outlives its validators.
+    """
+    validators = {}
+    validators_etag = ''
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            validators = Validators.fetch(
+                self.get_queryset().filter(**{self.lookup_field: lookup}), self.validators,
+                # ?fields= and ?expand= change the body
+                variant=(request.accepted_renderer.format, sorted(request.query_params.lists())),
+            )
+        except (TypeError, ValueError, ValidationError):
+            # A lookup of the wrong type, answered as DRF's get_object_or_404 does
+            raise NotFound
+        if validators is None:
+            return super().retrieve(request, *args, **kwargs)
+        self.validators_etag = validators.etag
+        response = validators.not_modified(request) or super().retrieve(request, *args, **kwargs)
+        return validators.apply(response)
+
+
+class CachedResponseMixin:
+    """
+    Serve repeated list and detail requests from cached response bytes.
+
+    Keys cover the route, the normalised (sorted) query string, the host
+    (links in responses are absolute), the rendered format, whether the user
+    is staff (DatasetViewSet shows staff unpublished datasets) and the catalog
+    version, so any catalog change invalidates every entry. Detail entries
+    are keyed by the ETag ConditionalRetrieveMixin found too, as download
+    counts change without a new catalog version. Hits skip the
+    queryset, serializer and renderer entirely. The browsable API is not
+    cached, as its pages show the signed-in user. Enabled with
+    EKAN_API_CACHE.
+    """
+    cached_actions = ('list', 'retrieve')
+    stored_headers = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Vary', 'Allow')
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
+
+    def cached(self, action, request, *args, **kwargs):
+        if not getattr(settings, 'EKAN_API_CACHE', False) or request.accepted_renderer.format == 'api':
+            return action(request, *args, **kwargs)
+
+        key = self.get_cache_key(request)
+        entry = cache.get(key)
+        metrics.cache_lookup('api', entry is not None)
+        if entry is not None:
+            status, headers, content = entry
+            response = HttpResponse(content, status=status)
+            for header, value in headers.items():
+                response[header] = value
+            response['X-Cache'] = 'HIT'
+            if 'ETag' in response:
+                last_modified = parse_http_date_safe(response.get('Last-Modified'))
+                response = get_conditional_response(request, response['ETag'], last_modified, response) or response
+            return response
+
+        response = action(request, *args, **kwargs)
+        if response.status_code == 200:
+            # Stored once rendered, with the headers DRF adds when finalising the response
+            timeout = getattr(settings, 'EKAN_API_CACHE_TIMEOUT', 300)
+            response.add_post_render_callback(lambda rendered: cache.set(key, (
+                rendered.status_code,
+                {header: rendered[header] for header in self.stored_headers if header in rendered},
+                rendered.content,
+            ), timeout))
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def get_cache_key(self, request):
+        query = urlencode(sorted(
+            (name, value) for name, values in request.query_params.lists() for value in values
+        ))
+        audience = 'staff' if request.user.is_staff else 'public'
+        route = f'{self.basename}:{self.action}:{self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, "")}'
+        etag = getattr(self, 'validators_etag', '')
+        digest = hashlib.md5(
+            f'{request.scheme}://{request.get_host()}|{route}|{query}|{request.accepted_media_type}|{etag}'.encode('utf-8')
+        ).hexdigest()
+        return f'api:v{catalog_version()}:{audience}:{digest}'
@@ -0,0 +1,74 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from app.pagination import KeysetPaginator, InvalidCursor
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (ordering field, id) for API list endpoints.
+
+    The ordering chosen by OrderingFilter (or the view default) selects the
+    keyset. Requests that still pass ?page= are served by page-number
+    pagination so existing clients keep working.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    legacy_pagination_class = PageNumberPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.legacy = None
+        if 'page' in request.query_params:
+            self.legacy = self.legacy_pagination_class()
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        self.paginator = KeysetPaginator(queryset, self.page_size, ordering=self.get_ordering(queryset))
+        try:
+            self.page = self.paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor.')
+        return list(self.page)
+
+    def get_ordering(self, queryset):
+        order_by = queryset.query.order_by or queryset.model._meta.ordering
+        field = order_by[0] if order_by and isinstance(order_by[0], str) else '-id'
+        pk = '-id' if field.startswith('-') else 'id'
+        if field.lstrip('-') in ('pk', 'id'):
+            return (pk,)
+        return (field, pk)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self.get_link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self.get_link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        return Response({
+            'count': self.paginator.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True, 'example': 123},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -1,7 +1,49 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from app.models import Dataset, Organisation, Topic, Resource, License, Format
 
 
+def query_list(request, name):
+    """Comma-separated values of a query parameter, or None if it is absent"""
+    if request is None or name not in request.query_params:
+        return None
+    return {value.strip() for value in request.query_params.get(name).split(',') if value.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Let API clients choose the fields of a response.
+
+    `?fields=id,title` keeps only the listed fields, and `?expand=` opts in
+    to the nested objects in Meta.expandable_fields (by field name, or by
+    the name without its `_details` suffix). Without either parameter the
+    full representation is returned, so existing clients are unaffected.
+    Writes always validate and save every field. Only the top-level
+    serializer is trimmed; OptimisedQuerysetMixin then
+    plans joins and prefetches for the remaining fields only.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self._context.get('request')
+        if request is not None and request.method not in SAFE_METHODS:
+            return
+        fields = query_list(request, 'fields')
+        expand = query_list(request, 'expand')
+        if fields is None and expand is None:
+            return
+
+        expandable = set(getattr(self.Meta, 'expandable_fields', ()))
+        expand = {name if name in expandable else f'{name}_details' for name in expand or ()}
+        if fields is None:
+            keep = (set(self.fields) - expandable) | (expand & expandable)
+        else:
+            keep = fields | (expand & expandable)
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+
 class LicenseSerializer(serializers.ModelSerializer):
     class Meta:
         model = License
@@ -14,34 +56,27 @@ class FormatSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'slug', 'description', 'icon', 'mime_type', 'is_data_format']
 
 
-class TopicSerializer(serializers.ModelSerializer):
-    dataset_count = serializers.SerializerMethodField()
-    
+class TopicSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Topic
         fields = ['id', 'title', 'slug', 'description', 'icon', 'color', 'is_featured', 'dataset_count']
-    
-    def get_dataset_count(self, obj):
-        return obj.datasets.filter(is_published=True).count()
 
 
-class OrganisationSerializer(serializers.ModelSerializer):
-    dataset_count = serializers.SerializerMethodField()
+class OrganisationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     manager_name = serializers.SerializerMethodField()
     
     class Meta:
         model = Organisation
         fields = ['id', 'title', 'slug', 'description', 'url', 'logo', 'manager_name', 
                  'is_active', 'created', 'updated', 'dataset_count']
-    
-    def get_dataset_count(self, obj):
-        return obj.datasets.filter(is_published=True).count()
+        # Relations read by method fields, for OptimisedQuerysetMixin
+        method_field_relations = {'manager_name': ['manager']}
     
     def get_manager_name(self, obj):
         return obj.manager.get_full_name() if obj.manager else None
 
 
-class ResourceSerializer(serializers.ModelSerializer):
+class ResourceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     format_details = FormatSerializer(source='format', read_only=True)
     file_size_human = serializers.ReadOnlyField()
     is_file_upload = serializers.ReadOnlyField()
@@ -54,6 +89,7 @@ class ResourceSerializer(serializers.ModelSerializer):
                  'file_size_human', 'mimetype', 'encoding', 'format_details',
                  'is_preview_available', 'download_count', 'is_file_upload', 
                  'is_external_url', 'download_url', 'created', 'updated']
+        expandable_fields = ['format_details']
     
     def get_download_url(self, obj):
         request = self.context.get('request')
@@ -65,12 +101,11 @@ class ResourceSerializer(serializers.ModelSerializer):
         return None
 
 
-class DatasetSerializer(serializers.ModelSerializer):
+class DatasetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     organisation_details = OrganisationSerializer(source='organisation', read_only=True)
     topics_details = TopicSerializer(source='topics', many=True, read_only=True)
     license_details = LicenseSerializer(source='license', read_only=True)
     resources = ResourceSerializer(many=True, read_only=True)
-    resource_count = serializers.ReadOnlyField()
     author_name = serializers.SerializerMethodField()
     
     class Meta:
@@ -80,6 +115,8 @@ class DatasetSerializer(serializers.ModelSerializer):
                  'license_details', 'author_name', 'maintainer_name', 'maintainer_email',
                  'is_published', 'is_featured', 'resource_count', 'resources',
                  'created', 'updated', 'published_date']
+        method_field_relations = {'author_name': ['author']}
+        expandable_fields = ['organisation_details', 'topics_details', 'license_details', 'resources']
     
     def get_author_name(self, obj):
         return obj.author.get_full_name() if obj.author else obj.author.username
\ No newline at end of file
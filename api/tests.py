@@ -1,3 +1,285 @@
-from django.test import TestCase
+import csv
+import io
+import json
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from api import views
+from app import suggest
+from app.cache import cache
+from app.models import Dataset, Organisation, Resource
+from app.search_index import process_queue
+from app.tests import QueryBudgetTestCase
+
+
+class APIQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_dataset_list(self):
+        self.assertQueryBudget(4, '/api/v1/datasets/')
+
+    def test_dataset_list_filtered(self):
+        self.assertQueryBudget(4, f'/api/v1/datasets/?topic={self.topic.slug}&ordering=title')
+
+    def test_dataset_detail(self):
+        self.assertQueryBudget(4, f'/api/v1/datasets/{self.dataset.pk}/')
+
+    def test_dataset_list_sparse(self):
+        # Only the page and its count: no joins or prefetches for fields left out
+        self.assertQueryBudget(2, '/api/v1/datasets/?fields=id,title,organisation')
+
+    def test_dataset_list_expanded(self):
+        self.assertQueryBudget(3, '/api/v1/datasets/?fields=id,title&expand=organisation,resources')
+
+    def test_organisation_list(self):
+        self.assertQueryBudget(2, '/api/v1/organisations/')
+
+    def test_organisation_detail(self):
+        self.assertQueryBudget(2, f'/api/v1/organisations/{self.organisation.pk}/')
+
+    def test_topic_list(self):
+        self.assertQueryBudget(2, '/api/v1/topics/')
+
+    def test_topic_detail(self):
+        self.assertQueryBudget(2, f'/api/v1/topics/{self.topic.pk}/')
+
+    def test_resource_list(self):
+        self.assertQueryBudget(2, '/api/v1/resources/')
+
+    def test_resource_detail(self):
+        self.assertQueryBudget(2, f'/api/v1/resources/{self.resource.pk}/')
+
+    # Sync the in-process index on every request so each one reads the table
+    @override_settings(EKAN_SUGGEST_SYNC_INTERVAL=0)
+    def test_suggest(self):
+        self.assertQueryBudget(1, '/api/v1/suggest?q=hea')
+
+
+class APIConditionalTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unchanged_detail_is_not_modified(self):
+        path = f'/api/v1/datasets/{self.dataset.pk}/'
+        etag = self.client.get(path)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_download_changes_etag(self):
+        path = f'/api/v1/datasets/{self.dataset.pk}/'
+        etag = self.client.get(path)['ETag']
+        self.resource.download_count += 1
+        self.resource.save(update_fields=['download_count'])
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['resources'][0]['download_count'], self.resource.download_count)
+
+    def test_malformed_lookup_is_not_found(self):
+        for path in ('/api/v1/topics/abc/', '/api/v1/datasets/1.5/', '/api/v1/resources/%C2%B2/'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 404, path)
+            self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_cached_detail_keeps_validators(self):
+        path = f'/api/v1/datasets/{self.dataset.pk}/'
+        first = self.client.get(path)
+        second = self.client.get(path)
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+
+class APICacheTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeat_request_is_served_from_cache(self):
+        self.assertEqual(self.client.get(f'/api/v1/datasets/?ordering=title&topic={self.topic.slug}')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/v1/datasets/?topic={self.topic.slug}&ordering=title')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()['results'][0]['title'], self.dataset.title)
+
+    def test_staff_and_public_are_cached_separately(self):
+        self.client.get('/api/v1/datasets/')
+        self.client.force_login(self.users[0])
+        self.users[0].is_staff = True
+        self.users[0].save()
+        self.assertEqual(self.client.get('/api/v1/datasets/')['X-Cache'], 'MISS')
+
+    def test_catalog_change_invalidates(self):
+        path = f'/api/v1/datasets/{self.dataset.pk}/'
+        self.client.get(path)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dataset.title = 'Renamed dataset'
+            self.dataset.save()
+        response = self.client.get(path)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['title'], 'Renamed dataset')
+
+
+class SparseFieldsTests(QueryBudgetTestCase):
+
+    def get_dataset(self, query):
+        return self.client.get(f'/api/v1/datasets/{self.dataset.pk}/?{query}').json()
+
+    def test_fields_selects_fields(self):
+        self.assertEqual(set(self.get_dataset('fields=id,title')), {'id', 'title'})
+
+    def test_writes_keep_every_field(self):
+        staff = self.users[0]
+        type(staff).objects.filter(pk=staff.pk).update(is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.post('/api/v1/datasets/?fields=id', {
+            'title': 'Posted dataset', 'slug': 'posted-dataset', 'description': 'Created through the API',
+            'organisation': self.organisation.pk, 'topics': [self.topic.pk],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        dataset = Dataset.objects.get(slug='posted-dataset')
+        self.assertEqual((dataset.organisation, dataset.author), (self.organisation, staff))
+
+        response = self.client.patch(f'/api/v1/datasets/{dataset.pk}/?fields=id', {'notes': 'Patched'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.notes, 'Patched')
+
+    def test_expand_opts_in_to_nested_objects(self):
+        data = self.get_dataset('expand=organisation')
+        self.assertIn('organisation_details', data)
+        self.assertNotIn('resources', data)
+        self.assertNotIn('topics_details', data)
+        self.assertIn('organisation', data)
+
+    def test_default_representation_is_unchanged(self):
+        data = self.get_dataset('')
+        for name in ('organisation_details', 'topics_details', 'license_details', 'resources'):
+            self.assertIn(name, data)
+
+
+@override_settings(EKAN_API_CACHE=False)
+class FastSerializerTests(QueryBudgetTestCase):
+    """The values() list path must render exactly what the ModelSerializers do"""
+
+    def setUp(self):
+        self.grow(4)  # More than a page of datasets
+        # Rows exercising the optional fields: no license, manager, file or format
+        Dataset.objects.filter(pk=self.dataset.pk).update(license=None)
+        Organisation.objects.filter(pk=self.organisation.pk).update(manager=None)
+        Resource.objects.create(title='External link', dataset=self.dataset, url='https://example.com/data.csv',
+                                size=123456)
+
+    def assertSameContent(self, path):
+        fast = self.client.get(path)
+        with override_settings(EKAN_FAST_SERIALIZERS=False):
+            regular = self.client.get(path)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, regular.content)
+        return fast
+
+    def test_dataset_list(self):
+        response = self.assertSameContent('/api/v1/datasets/?ordering=title')
+        self.assertIsNotNone(response.json()['next'])
+        next_page = urlsplit(response.json()['next'])
+        self.assertSameContent(f'{next_page.path}?{next_page.query}')
+
+    def test_dataset_list_filtered(self):
+        self.assertSameContent(f'/api/v1/datasets/?topic={self.topic.slug}&ordering=-created')
+
+    def test_dataset_list_page_number(self):
+        self.assertSameContent('/api/v1/datasets/?page=1')
+
+    def test_resource_list(self):
+        self.assertSameContent(f'/api/v1/resources/?dataset={self.dataset.pk}')
+        self.assertSameContent('/api/v1/resources/?ordering=title&page=1')
+
+
+class CatalogExportTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        self.grow(1)
+        self.published = set(Dataset.objects.filter(is_published=True).values_list('id', flat=True))
+
+    def stream(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson_matches_api(self):
+        lines = [json.loads(line) for line in self.stream('/api/v1/export/datasets.ndjson').splitlines()]
+        self.assertEqual({dataset['id'] for dataset in lines}, self.published)
+        detail = self.client.get(f'/api/v1/datasets/{self.dataset.pk}/').json()
+        self.assertIn(detail, lines)
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.stream('/api/v1/export/datasets.csv'))))
+        self.assertEqual({int(row['id']) for row in rows}, self.published)
+        row = next(row for row in rows if int(row['id']) == self.dataset.pk)
+        self.assertEqual(row['organisation'], self.organisation.title)
+        self.assertIn(self.topic.title, row['topics'])
+
+    def test_data_json(self):
+        catalog = json.loads(self.stream('/data.json'))
+        self.assertEqual(catalog['conformsTo'], 'https://project-open-data.cio.gov/v1.1/schema')
+        self.assertEqual(len(catalog['dataset']), len(self.published))
+        entry = next(entry for entry in catalog['dataset'] if entry['title'] == self.dataset.title)
+        self.assertEqual(entry['publisher']['name'], self.organisation.title)
+        self.assertIn(f'/resources/{self.resource.slug}/download/',
+                      ' '.join(distribution['downloadURL'] for distribution in entry['distribution']))
+
+    @override_settings(EKAN_EXPORT_CHUNK_SIZE=4)
+    def test_queries_per_chunk(self):
+        # The rows, then topics and resources for each chunk of datasets
+        with CaptureQueriesContext(connection) as context:
+            self.stream('/api/v1/export/datasets.ndjson')
+        chunks = -(-len(self.published) // 4)
+        self.assertEqual(len(context.captured_queries), 1 + 2 * chunks)
+
+
+@override_settings(EKAN_SUGGEST_SYNC_INTERVAL=0)
+class SuggestTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        process_queue()
+        # A fresh in-process index, loaded from this test's search entries
+        patcher = mock.patch.object(suggest, 'index', suggest.PrefixIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def suggest(self, query, **params):
+        response = self.client.get('/api/v1/suggest', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_suggests_titles_by_prefix(self):
+        results = self.suggest(self.dataset.title[:4])
+        self.assertIn({'type': 'dataset', 'title': self.dataset.title, 'slug': self.dataset.slug,
+                       'url': self.dataset.get_absolute_url()}, results)
+        self.assertIn(self.topic.title, [result['title'] for result in self.suggest(self.topic.title)])
+
+    def test_limit_is_clamped(self):
+        self.grow(4)
+        process_queue()
+        self.assertEqual(len(self.suggest('a', limit=1)), 1)
+        self.assertLessEqual(len(self.suggest('a', limit=1000)), views.SuggestView.max_limit)
+        self.assertLessEqual(len(self.suggest('a', limit='many')), 10)
+
+    def test_sees_changes_after_sync(self):
+        self.assertTrue(self.suggest(self.dataset.title))
+        self.dataset.is_published = False
+        self.dataset.save()
+        process_queue()
+        self.assertNotIn(self.dataset.slug, [result['slug'] for result in self.suggest(self.dataset.title)])
+
+    def test_empty_query(self):
+        self.assertEqual(self.suggest(''), [])
@@ -1,4 +1,4 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from . import views
 
@@ -11,5 +11,10 @@ router.register(r'resources', views.ResourceViewSet)
 
 # The API URLs are now determined automatically by the router.
 urlpatterns = [
+    re_path(r'^v1/suggest/?$', views.SuggestView.as_view(), name='suggest'),
+    path('v1/export/datasets.ndjson', views.CatalogExportView.as_view(), {'export_format': 'ndjson'},
+         name='export_ndjson'),
+    path('v1/export/datasets.csv', views.CatalogExportView.as_view(), {'export_format': 'csv'}, name='export_csv'),
+    path('v1/export/data.json', views.CatalogExportView.as_view(), {'export_format': 'dcat'}, name='export_dcat'),
     path('v1/', include(router.urls)),
 ]
\ No newline at end of file
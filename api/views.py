@@ -1,11 +1,24 @@
 from rest_framework import viewsets, filters
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, AllowAny
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.http import StreamingHttpResponse
+from django.views import View
 from django_filters.rest_framework import DjangoFilterBackend
+from . import export
+from .fast_serializers import DatasetValuesSerializer, ResourceValuesSerializer
+from .mixins import CachedResponseMixin, ConditionalRetrieveMixin, FastListMixin, OptimisedQuerysetMixin
 from .serializers import DatasetSerializer, OrganisationSerializer, TopicSerializer, ResourceSerializer
 from app.models import Dataset, Organisation, Topic, Resource
+from app.filters import DatasetAPIFilterSet
+from app import suggest
+from app.conditional import (
+    DATASET_API_VALIDATORS, ORGANISATION_VALIDATORS, RESOURCE_VALIDATORS, TOPIC_VALIDATORS
+)
 
 
-class DatasetViewSet(viewsets.ModelViewSet):
+class DatasetViewSet(ConditionalRetrieveMixin, CachedResponseMixin, FastListMixin, OptimisedQuerysetMixin,
+                     viewsets.ModelViewSet):
     """
     API endpoint for datasets.
     Only published datasets are visible to anonymous users.
@@ -13,13 +26,18 @@ class DatasetViewSet(viewsets.ModelViewSet):
     """
     queryset = Dataset.objects.all()
     serializer_class = DatasetSerializer
+    fast_serializer_class = DatasetValuesSerializer
+    validators = DATASET_API_VALIDATORS
     permission_classes = [IsAuthenticatedOrReadOnly]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['organisation', 'topics', 'license', 'is_featured']
+    filterset_class = DatasetAPIFilterSet
     search_fields = ['title', 'description', 'notes']
     ordering_fields = ['created', 'updated', 'title']
     ordering = ['-updated']
     
+    def perform_create(self, serializer):
+        serializer.save(author=self.request.user)
+
     def get_queryset(self):
         queryset = super().get_queryset()
         if not self.request.user.is_staff:
@@ -27,33 +45,36 @@ class DatasetViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class OrganisationViewSet(viewsets.ReadOnlyModelViewSet):
+class OrganisationViewSet(ConditionalRetrieveMixin, CachedResponseMixin, OptimisedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for organisations.
     Read-only for all users.
     """
     queryset = Organisation.objects.filter(is_active=True)
     serializer_class = OrganisationSerializer
+    validators = ORGANISATION_VALIDATORS
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'description']
     ordering_fields = ['title', 'created']
     ordering = ['title']
 
 
-class TopicViewSet(viewsets.ReadOnlyModelViewSet):
+class TopicViewSet(ConditionalRetrieveMixin, CachedResponseMixin, OptimisedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for topics.
     Read-only for all users.
     """
     queryset = Topic.objects.all()
     serializer_class = TopicSerializer
+    validators = TOPIC_VALIDATORS
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'description']
     ordering_fields = ['title']
     ordering = ['title']
 
 
-class ResourceViewSet(viewsets.ReadOnlyModelViewSet):
+class ResourceViewSet(ConditionalRetrieveMixin, CachedResponseMixin, FastListMixin, OptimisedQuerysetMixin,
+                      viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for resources.
     Read-only for all users.
@@ -61,8 +82,48 @@ class ResourceViewSet(viewsets.ReadOnlyModelViewSet):
     """
     queryset = Resource.objects.filter(dataset__is_published=True)
     serializer_class = ResourceSerializer
+    fast_serializer_class = ResourceValuesSerializer
+    validators = RESOURCE_VALIDATORS
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['dataset', 'format']
     search_fields = ['title', 'description']
     ordering_fields = ['created', 'updated', 'title']
     ordering = ['-updated']
+
+
+class SuggestView(APIView):
+    """
+    Typeahead suggestions for dataset, organisation and topic titles.
+    Served from an in-process prefix index over the search index table.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    max_limit = 25
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), self.max_limit)
+        except ValueError:
+            limit = 10
+        return Response({'query': query, 'results': suggest.index.search(query, limit)})
+
+
+class CatalogExportView(View):
+    """
+    The whole published catalog in one streamed response, for aggregators
+    that would otherwise page through the dataset API: NDJSON (one API
+    dataset per line), CSV, or a DCAT-US data.json.
+    """
+    formats = {
+        'ndjson': (export.ndjson, 'application/x-ndjson; charset=utf-8', 'datasets.ndjson'),
+        'csv': (export.csv_rows, 'text/csv; charset=utf-8', 'datasets.csv'),
+        'dcat': (export.data_json, 'application/json', None),
+    }
+
+    def get(self, request, export_format):
+        stream, content_type, filename = self.formats[export_format]
+        response = StreamingHttpResponse(stream(request), content_type=content_type)
+        if filename:
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Organisation, OrganisationMember, License, Topic, Dataset, Format, Resource
+from .models import Organisation, OrganisationMember, License, Topic, Dataset, Format, Resource, SlowQuery
 
 
 class OrganisationMemberInline(admin.TabularInline):
@@ -48,10 +48,6 @@ class OrganisationAdmin(admin.ModelAdmin):
         )
     status_badge.short_description = 'Status'
     
-    def dataset_count(self, obj):
-        return obj.datasets.count() if hasattr(obj, 'datasets') else 0
-    dataset_count.short_description = 'Datasets'
-    
     def member_count(self, obj):
         return obj.members.count() if hasattr(obj, 'members') else 0
     member_count.short_description = 'Members'
@@ -132,10 +128,6 @@ class TopicAdmin(admin.ModelAdmin):
             obj.color
         )
     color_display.short_description = 'Color'
-    
-    def dataset_count(self, obj):
-        return obj.datasets.count() if hasattr(obj, 'datasets') else 0
-    dataset_count.short_description = 'Datasets'
 
 
 @admin.register(Format)
@@ -184,10 +176,6 @@ class DatasetAdmin(admin.ModelAdmin):
         if not change:  # Creating new object
             obj.author = request.user
         super().save_model(request, obj, form, change)
-    
-    def resource_count(self, obj):
-        return obj.resources.count() if hasattr(obj, 'resources') else 0
-    resource_count.short_description = 'Resources'
 
 
 @admin.register(Resource)
@@ -209,3 +197,41 @@ class ResourceAdmin(admin.ModelAdmin):
             'classes': ['collapse']
         }),
     )
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ['short_fingerprint', 'count', 'total', 'mean', 'p95', 'slowest', 'site', 'last_seen']
+    search_fields = ['fingerprint', 'site']
+    readonly_fields = ['fingerprint', 'site', 'count', 'total', 'mean', 'p95', 'slowest', 'sql', 'plan',
+                       'first_seen', 'last_seen']
+    fields = readonly_fields
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def short_fingerprint(self, obj):
+        return obj.fingerprint[:100]
+    short_fingerprint.short_description = 'Query'
+    
+    def total(self, obj):
+        return f"{obj.total_ms:,.0f} ms"
+    total.admin_order_field = 'total_ms'
+    
+    def mean(self, obj):
+        return f"{obj.mean_ms:,.1f} ms"
+    
+    def p95(self, obj):
+        return f"{obj.p95_ms:,.1f} ms"
+    p95.short_description = 'p95'
+    
+    def slowest(self, obj):
+        return f"{obj.max_ms:,.1f} ms"
+    slowest.admin_order_field = 'max_ms'
+    
+    def plan(self, obj):
+        return format_html('<pre>{}</pre>', obj.explain or 'Not captured')
+    plan.short_description = 'EXPLAIN'
@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.utils.connection import ConnectionProxy
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Catalog-derived values, pages, fragments and API responses are served from process memory
+# when possible (settings.CACHES); the `default` alias stays a plain shared cache
+cache = ConnectionProxy(caches, 'tiered')
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def initial_version():
+    """Milliseconds since the epoch, so a version is never reused if the counter is evicted"""
+    return int(time.time() * 1000)
+
+
+def catalog_version():
+    """Current catalog version; bumped whenever catalog data changes"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, initial_version(), None)
+        version = cache.get(CATALOG_VERSION_KEY) or initial_version()
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate everything cached under the catalog version, once the current transaction commits"""
+    transaction.on_commit(_bump)
+
+
+def _bump():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # Evicted or never set: start from a value no earlier version used
+        cache.set(CATALOG_VERSION_KEY, initial_version(), None)
+
+
+# Within a process, concurrent misses on the same key wait on the same lock
+# (re-entrant, as a computation may read other cached values)
+_locks = [threading.RLock() for _ in range(64)]
+
+
+def _local_lock(key):
+    return _locks[hash(key) % len(_locks)]
+
+
+def get_or_compute(key, compute, timeout, name='catalog'):
+    """
+    Return the cached value for key, computing and caching it on a miss.
+
+    Concurrent misses are coalesced: threads of one process queue on a lock,
+    and across processes the first to `cache.add` a lock key computes while
+    the others poll for its result (up to EKAN_CACHE_LOCK_TIMEOUT seconds,
+    after which they compute it themselves).
+    """
+    value = cache.get(key)
+    metrics.cache_lookup(name, value is not None)
+    if value is not None:
+        return value
+    return _single_flight(key, compute, timeout)
+
+
+def _single_flight(key, compute, timeout):
+    with _local_lock(key):
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+        lock_key = f'{key}:lock'
+        lock_timeout = getattr(settings, 'EKAN_CACHE_LOCK_TIMEOUT', 10)
+        token = uuid.uuid4().hex
+        if not cache.add(lock_key, token, lock_timeout):
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = cache.get(key)
+                if value is not None:
+                    return value
+
+        try:
+            value = compute()
+            cache.set(key, value, timeout)
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+        return value
+
+
+def get_or_refresh(key, compute, timeout, stale_timeout=None, beta=1.0, name='aggregates'):
+    """
+    Cache an expensive value for `timeout` seconds without recomputing it in
+    every worker at once when it expires.
+
+    After expiry the old value is still returned, for up to `stale_timeout`
+    more seconds, while exactly one caller (the one that takes the refresh
+    lock) recomputes it, in a background thread unless
+    EKAN_CACHE_BACKGROUND_REFRESH is off. Before expiry, callers may start
+    that refresh early, with a probability that grows as expiry nears and
+    with how long the value took to compute ("XFetch", Vattani et al.,
+    scaled by `beta`). Only a missing value makes callers wait, coalesced as
+    in get_or_compute.
+    """
+    if stale_timeout is None:
+        stale_timeout = getattr(settings, 'EKAN_CACHE_STALE_TIMEOUT', 300)
+    entry = cache.get(key)
+    metrics.cache_lookup(name, entry is not None)
+    if entry is None:
+        entry = _single_flight(key, lambda: _computed(compute, timeout), timeout + stale_timeout)
+    elif time.time() - entry['delta'] * beta * math.log(1 - random.random()) >= entry['expires']:
+        _refresh(key, compute, timeout, stale_timeout)
+    return entry['value']
+
+
+def _computed(compute, timeout):
+    """The value with when it expires and how many seconds it took to compute"""
+    start = time.time()
+    value = compute()
+    delta = time.time() - start
+    return {'value': value, 'delta': delta, 'expires': time.time() + timeout}
+
+
+def _refresh(key, compute, timeout, stale_timeout):
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, getattr(settings, 'EKAN_CACHE_LOCK_TIMEOUT', 10)):
+        return  # Another caller is already refreshing it
+
+    def refresh():
+        try:
+            cache.set(key, _computed(compute, timeout), timeout + stale_timeout)
+        except Exception:
+            logger.exception('Could not refresh cached value %s', key)
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    if getattr(settings, 'EKAN_CACHE_BACKGROUND_REFRESH', True):
+        def run():
+            try:
+                refresh()
+            finally:
+                connections.close_all()
+        threading.Thread(target=run, name=f'refresh {key}', daemon=True).start()
+    else:
+        refresh()
+
+
+def get_catalog(name, compute, timeout=None):
+    """Cache a value derived from catalog data until the catalog next changes (or timeout passes)"""
+    if timeout is None:
+        timeout = getattr(settings, 'EKAN_CATALOG_CACHE_TIMEOUT', 300)
+    return get_or_compute(f'{name}:v{catalog_version()}', compute, timeout, name=name)
+
+
+def fragment_key(kind, *parts):
+    """Cache key for a rendered fragment, from the values its content depends on"""
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'fragment:{kind}:{digest}'
+
+
+def get_fragments(keys, render, name='fragments', timeout=None):
+    """
+    Return the cached fragment for each key, in order, fetched with one
+    `get_many`. `render(indexes)` is called once with the positions of all
+    misses and returns their HTML, which is cached for next time.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'EKAN_FRAGMENT_CACHE_TIMEOUT', 3600)
+    found = cache.get_many(keys)
+    for key in keys:
+        metrics.cache_lookup(name, key in found)
+
+    missing = [index for index, key in enumerate(keys) if key not in found]
+    if missing:
+        rendered = dict(zip((keys[index] for index in missing), render(missing)))
+        cache.set_many(rendered, timeout)
+        found.update(rendered)
+    return [found[key] for key in keys]
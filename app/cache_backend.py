@@ -0,0 +1,186 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import metrics
+
+
+class TieredCache(BaseCache):
+    """
+    A bounded in-process LRU in front of a shared cache backend.
+
+    Reads are served from process memory when possible and fall back to the
+    shared backend (the cache alias named by the SHARED option), keeping a
+    local copy for at most LOCAL_TIMEOUT seconds. Writes go to both tiers.
+    The local tier holds at most MAX_ENTRIES values and MAX_BYTES of pickled
+    data, evicting the least recently used.
+
+    Other processes' writes are only seen once a local copy expires, so keys
+    that change in place and must be current everywhere (version counters,
+    locks) are listed in SHARED_ONLY (shell-style patterns) and always read
+    from the shared backend. Everything keyed by such a version, like the
+    catalog caches, is then invalidated across processes as soon as the
+    version changes, while still being served from memory.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED', 'default')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 30)
+        self.max_bytes = options.get('MAX_BYTES', 32 * 1024 * 1024)
+        self.shared_only = list(options.get('SHARED_ONLY', []))
+        # key -> (expiry, pickled value); most recently used last
+        self._local = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def is_shared_only(self, key):
+        return any(fnmatchcase(key, pattern) for pattern in self.shared_only)
+
+    # Local tier
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expiry, pickled = entry
+            if expiry is not None and expiry <= time.time():
+                self._local_discard(key)
+                return None
+            self._local.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def _local_set(self, key, value, timeout):
+        expiry = self.get_backend_timeout(timeout)
+        if expiry is not None and expiry <= time.time():
+            self._local_delete(key)
+            return
+        if self.local_timeout is not None:
+            local_expiry = time.time() + self.local_timeout
+            expiry = local_expiry if expiry is None else min(expiry, local_expiry)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local_discard(key)
+            if len(pickled) > self.max_bytes:
+                return
+            self._local[key] = (expiry, pickled)
+            self._bytes += len(pickled)
+            while len(self._local) > self._max_entries or self._bytes > self.max_bytes:
+                self._local_discard(next(iter(self._local)))
+
+    def _local_discard(self, key):
+        # Caller holds the lock
+        entry = self._local.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def _local_delete(self, key):
+        with self._lock:
+            self._local_discard(key)
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version)
+        if self.is_shared_only(key):
+            return self.shared.get(key, default, version)
+        value = self._local_get(local_key)
+        metrics.cache_lookup('local', value is not None)
+        if value is not None:
+            return value
+        missing = object()
+        value = self.shared.get(key, missing, version)
+        if value is missing:
+            return default
+        self._local_set(local_key, value, None)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version)
+        self.shared.set(key, value, timeout, version)
+        if not self.is_shared_only(key):
+            self._local_set(local_key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Decided by the shared backend, as add is used for cross-process locks
+        local_key = self.make_and_validate_key(key, version)
+        added = self.shared.add(key, value, timeout, version)
+        if added and not self.is_shared_only(key):
+            self._local_set(local_key, value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._local_delete(self.make_and_validate_key(key, version))
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self._local_delete(self.make_and_validate_key(key, version))
+        return self.shared.delete(key, version)
+
+    def has_key(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version)
+        if not self.is_shared_only(key) and self._local_get(local_key) is not None:
+            return True
+        return self.shared.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete(self.make_and_validate_key(key, version))
+        return self.shared.incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        self._local_delete(self.make_and_validate_key(key, version))
+        return self.shared.decr(key, delta, version)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote = []
+        for key in keys:
+            local_key = self.make_and_validate_key(key, version)
+            value = None if self.is_shared_only(key) else self._local_get(local_key)
+            if value is None:
+                remote.append(key)
+            else:
+                found[key] = value
+        if remote:
+            fetched = self.shared.get_many(remote, version)
+            for key, value in fetched.items():
+                if not self.is_shared_only(key):
+                    self._local_set(self.make_and_validate_key(key, version), value, None)
+            found.update(fetched)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        for key, value in data.items():
+            if key not in failed and not self.is_shared_only(key):
+                self._local_set(self.make_and_validate_key(key, version), value, timeout)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local_delete(self.make_and_validate_key(key, version))
+        self.shared.delete_many(keys, version)
+
+    def clear(self):
+        self.clear_local()
+        self.shared.clear()
+
+    def clear_local(self):
+        """Empty this process's tier only"""
+        with self._lock:
+            self._local.clear()
+            self._bytes = 0
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
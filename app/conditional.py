@@ -0,0 +1,74 @@
+import hashlib
+from datetime import datetime
+
+from django.db.models import Count, F, Max, Sum
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+# What each detail page shows, as expressions evaluated in one query: the
+# object's own `updated`, the newest `updated` of what it lists, and the
+# counters that change without touching any timestamp
+DATASET_VALIDATORS = {
+    'updated': F('updated'),
+    'organisation': F('organisation__updated'),
+    'resources': Max('resources__updated'),
+    'resource_count': F('resource_count'),
+    'topics': Max('topics__updated'),
+    'topic_count': Count('topics', distinct=True),
+}
+# The API nests resources, including their download counts, in datasets
+DATASET_API_VALIDATORS = {**DATASET_VALIDATORS, 'downloads': Sum('resources__download_count')}
+ORGANISATION_VALIDATORS = {
+    'updated': F('updated'),
+    'datasets': Max('datasets__updated'),
+    'dataset_count': F('dataset_count'),
+    'resource_count': F('resource_count'),
+}
+RESOURCE_VALIDATORS = {
+    'updated': F('updated'),
+    'download_count': F('download_count'),
+}
+TOPIC_VALIDATORS = {
+    'updated': F('updated'),
+    'dataset_count': F('dataset_count'),
+}
+
+
+class Validators:
+    """An ETag and Last-Modified date for one object, from one query"""
+
+    def __init__(self, values, variant=''):
+        self.last_modified = max(
+            (value for value in values.values() if isinstance(value, datetime)), default=None
+        )
+        state = repr(sorted(values.items())) + repr(variant)
+        self.etag = '"%s"' % hashlib.md5(state.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def fetch(cls, queryset, expressions, variant=''):
+        """Validators for the single object in queryset, or None if there is none"""
+        names = {f'validator_{name}': expression for name, expression in expressions.items()}
+        queryset = queryset.select_related(None).prefetch_related(None).order_by()
+        values = queryset.annotate(**names).values(*names).first()
+        return None if values is None else cls(values, variant)
+
+    def not_modified(self, request):
+        """A 304 response if the client's copy is current, else None"""
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        timestamp = int(self.last_modified.timestamp()) if self.last_modified else None
+        return get_conditional_response(request, etag=self.etag, last_modified=timestamp)
+
+    def apply(self, response, private=False):
+        """Add the validators to a response (full or 304), asking caches to revalidate before reuse"""
+        if response.status_code not in (200, 304):
+            return response
+        response['ETag'] = self.etag
+        if self.last_modified:
+            response['Last-Modified'] = http_date(self.last_modified.timestamp())
+        if private:
+            patch_cache_control(response, no_cache=True, private=True)
+        else:
+            patch_cache_control(response, no_cache=True)
+        return response
@@ -0,0 +1,114 @@
+from django.db.models import F, Func, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Dataset, Organisation, Resource, Topic
+
+
+# Fields whose old values decide which counters a save has to move
+TRACKED_FIELDS = {
+    Dataset: ['is_published', 'organisation_id'],
+    Resource: ['dataset_id'],
+}
+
+
+def count_subquery(queryset):
+    """Correlated COUNT(*) of a queryset filtered on OuterRef('pk')"""
+    count = queryset.order_by().annotate(
+        count=Func(F('pk'), function='COUNT', output_field=IntegerField())
+    ).values('count')
+    return Coalesce(Subquery(count), 0)
+
+
+# What each counter column should hold, as an expression on its own table
+COUNTERS = [
+    (Organisation, 'dataset_count',
+     count_subquery(Dataset.objects.filter(organisation=OuterRef('pk'), is_published=True))),
+    (Organisation, 'resource_count',
+     count_subquery(Resource.objects.filter(dataset__organisation=OuterRef('pk'), dataset__is_published=True))),
+    (Topic, 'dataset_count',
+     count_subquery(Dataset.objects.filter(topics=OuterRef('pk'), is_published=True))),
+    (Dataset, 'resource_count',
+     count_subquery(Resource.objects.filter(dataset=OuterRef('pk')))),
+]
+
+
+def track(instance):
+    """Remember the values counters depend on, to compare against on the next save"""
+    # Read __dict__ directly so deferred fields are skipped rather than loaded
+    instance._counted = {
+        name: instance.__dict__[name] for name in TRACKED_FIELDS[type(instance)] if name in instance.__dict__
+    }
+
+
+def adjust(model, ids, **deltas):
+    """Add deltas to counter columns with an UPDATE, so concurrent changes do not overwrite each other"""
+    ids = [pk for pk in ids if pk is not None]
+    if ids and any(deltas.values()):
+        model.objects.filter(pk__in=ids).update(**{
+            field: F(field) + delta for field, delta in deltas.items() if delta
+        })
+
+
+def dataset_resources(dataset_id):
+    return Dataset.objects.filter(pk=dataset_id).values_list('resource_count', flat=True).first() or 0
+
+
+def dataset_saved(dataset, created):
+    old = getattr(dataset, '_counted', {})
+    was_published = False if created else old.get('is_published', dataset.is_published)
+    old_organisation = None if created else old.get('organisation_id', dataset.organisation_id)
+
+    if (was_published, old_organisation) != (dataset.is_published, dataset.organisation_id):
+        resources = dataset_resources(dataset.pk)
+        if was_published:
+            adjust(Organisation, [old_organisation], dataset_count=-1, resource_count=-resources)
+        if dataset.is_published:
+            adjust(Organisation, [dataset.organisation_id], dataset_count=1, resource_count=resources)
+    if was_published != dataset.is_published and not created:
+        topics = Dataset.topics.through.objects.filter(dataset=dataset.pk).values_list('topic_id', flat=True)
+        adjust(Topic, list(topics), dataset_count=1 if dataset.is_published else -1)
+    track(dataset)
+
+
+def dataset_deleted(dataset):
+    """Called before the delete, while the dataset's topic links still exist"""
+    if not Dataset.objects.filter(pk=dataset.pk, is_published=True).exists():
+        return
+    # Resources are deleted one by one with the dataset and subtract themselves
+    adjust(Organisation, [dataset.organisation_id], dataset_count=-1)
+    topics = Dataset.topics.through.objects.filter(dataset=dataset.pk).values_list('topic_id', flat=True)
+    adjust(Topic, list(topics), dataset_count=-1)
+
+
+def resource_moved(dataset_id, delta):
+    """Count a resource in (delta=1) or out of (delta=-1) a dataset and its organisation"""
+    adjust(Dataset, [dataset_id], resource_count=delta)
+    organisation = Dataset.objects.filter(pk=dataset_id, is_published=True).values_list('organisation_id', flat=True)
+    adjust(Organisation, list(organisation), resource_count=delta)
+
+
+def resource_saved(resource, created):
+    old_dataset = None if created else getattr(resource, '_counted', {}).get('dataset_id', resource.dataset_id)
+    if old_dataset != resource.dataset_id:
+        if old_dataset is not None:
+            resource_moved(old_dataset, -1)
+        resource_moved(resource.dataset_id, 1)
+    track(resource)
+
+
+def topics_changed(dataset_ids, topic_ids, delta):
+    """Topic links were added (delta=1) or removed (delta=-1) between these datasets and topics"""
+    published = Dataset.objects.filter(pk__in=dataset_ids, is_published=True).count()
+    adjust(Topic, topic_ids, dataset_count=delta * published)
+
+
+def recount():
+    """Recompute every counter from scratch; returns the number of rows that had drifted"""
+    fixed = {}
+    for model, field, expression in COUNTERS:
+        drifted = model.objects.annotate(actual=expression).exclude(**{field: F('actual')})
+        ids = list(drifted.values_list('pk', flat=True))
+        if ids:
+            model.objects.filter(pk__in=ids).update(**{field: expression})
+        fixed[f'{model.__name__}.{field}'] = len(ids)
+    return fixed
@@ -0,0 +1,66 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, F, Value
+
+from .cache import catalog_version, get_or_compute
+from .models import Dataset, Resource
+
+
+FACETS = ['organisations', 'topics', 'licenses', 'formats']
+
+# Query parameters that change the page or order of results but not the result set
+IGNORED_PARAMS = ['page', 'cursor', 'sort']
+
+
+def normalise_query(params):
+    """Return a canonical string for a query dict, independent of parameter order"""
+    items = []
+    for key in sorted(params.keys()):
+        if key in IGNORED_PARAMS:
+            continue
+        values = params.getlist(key) if hasattr(params, 'getlist') else [params[key]]
+        values = sorted({' '.join(str(v).lower().split()) for v in values if v})
+        for value in values:
+            items.append(f'{key}={value}')
+    return '&'.join(items)
+
+
+def get_facet_counts(queryset, params=None):
+    """
+    Count datasets per organisation, topic, license and format for a queryset.
+
+    All four facets are computed in a single UNION ALL of grouped aggregates,
+    so the cost does not grow with the number of facet values. Results are
+    cached per normalised query string and catalog version.
+    """
+    if params is None:
+        return compute_facet_counts(queryset)
+    # Keyed by the catalog version too, so counts change as soon as datasets do
+    digest = hashlib.md5(normalise_query(params).encode('utf-8')).hexdigest()
+    return get_or_compute(
+        f'facets:v{catalog_version()}:{digest}', lambda: compute_facet_counts(queryset),
+        getattr(settings, 'EKAN_FACET_CACHE_TIMEOUT', 60), name='facets',
+    )
+
+
+def compute_facet_counts(queryset):
+    datasets = queryset.order_by().values('pk')
+
+    organisations = Dataset.objects.filter(pk__in=datasets).order_by().values(
+        facet=Value('organisations'), value=F('organisation__slug')
+    ).annotate(count=Count('pk'))
+    licenses = Dataset.objects.filter(pk__in=datasets, license__isnull=False).order_by().values(
+        facet=Value('licenses'), value=F('license__slug')
+    ).annotate(count=Count('pk'))
+    topics = Dataset.topics.through.objects.filter(dataset__in=datasets).order_by().values(
+        facet=Value('topics'), value=F('topic__slug')
+    ).annotate(count=Count('dataset'))
+    formats = Resource.objects.filter(dataset__in=datasets, format__isnull=False).order_by().values(
+        facet=Value('formats'), value=F('format__slug')
+    ).annotate(count=Count('dataset', distinct=True))
+
+    counts = {facet: {} for facet in FACETS}
+    for row in organisations.union(licenses, topics, formats, all=True).order_by():
+        counts[row['facet']][row['value']] = row['count']
+    return counts
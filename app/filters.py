@@ -0,0 +1,144 @@
+import django_filters
+from django import forms
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Dataset, Resource
+
+
+OPERATOR_CHOICES = [
+    ('or', 'Match any'),
+    ('and', 'Match all'),
+]
+
+
+class MultipleValueWidget(forms.TextInput):
+    """Read every value of a repeated query parameter (?topic=a&topic=b)"""
+
+    def value_from_datadict(self, data, files, name):
+        if hasattr(data, 'getlist'):
+            return data.getlist(name)
+        return data.get(name)
+
+
+class MultipleValueField(forms.Field):
+    """List of identifiers given as repeated or comma-separated parameters"""
+    widget = MultipleValueWidget
+
+    def to_python(self, value):
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = [value]
+        values = []
+        for item in value:
+            values.extend(part.strip() for part in str(item).split(',') if part.strip())
+        return list(dict.fromkeys(values))
+
+
+class MultipleValueFilter(django_filters.Filter):
+    field_class = MultipleValueField
+
+
+# Largest primary key (BigAutoField); larger numbers cannot match and would overflow the query
+MAX_ID = 2 ** 63 - 1
+
+
+def is_identifier(value):
+    # isdigit() alone accepts other scripts' digits and superscripts, which int() rejects
+    return value.isascii() and value.isdigit() and int(value) <= MAX_ID
+
+
+def split_identifiers(values):
+    """Split identifiers into primary keys and slugs, so both ?topic=3 and ?topic=health work"""
+    ids = [int(value) for value in values if is_identifier(value)]
+    slugs = [value for value in values if not is_identifier(value)]
+    return ids, slugs
+
+
+def identifier_q(field, values):
+    """Q object matching a related object by primary key or slug"""
+    ids, slugs = split_identifiers(values)
+    q = Q()
+    if ids:
+        q |= Q(**{f'{field}_id__in': ids})
+    if slugs:
+        q |= Q(**{f'{field}__slug__in': slugs})
+    return q
+
+
+class DatasetFilterSet(django_filters.FilterSet):
+    """
+    Dataset filtering shared by the HTML listing and the REST API.
+
+    Every filter accepts several values (?topic=a&topic=b or ?topic=a,b) given
+    as slugs or primary keys. Values of one filter are OR-ed unless
+    `topic_op`/`format_op` is `and`; different filters are always AND-ed.
+    Relations that fan out (topics, resources) are matched with EXISTS
+    subqueries, so the result never needs DISTINCT.
+    """
+    q = django_filters.CharFilter(method='filter_search')
+    organisation = MultipleValueFilter(method='filter_organisation')
+    topic = MultipleValueFilter(method='filter_topic')
+    topics = MultipleValueFilter(method='filter_topic')
+    license = MultipleValueFilter(method='filter_license')
+    format = MultipleValueFilter(method='filter_format')
+    resource_format = MultipleValueFilter(method='filter_format')
+    topic_op = django_filters.ChoiceFilter(choices=OPERATOR_CHOICES, method='filter_operator')
+    format_op = django_filters.ChoiceFilter(choices=OPERATOR_CHOICES, method='filter_operator')
+
+    class Meta:
+        model = Dataset
+        fields = ['is_featured']
+
+    def get_operator(self, name):
+        return self.form.cleaned_data.get(name) or 'or'
+
+    def filter_operator(self, queryset, name, value):
+        # Operators only change how the filters above combine their values
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        topics = Dataset.topics.through.objects.filter(
+            dataset=OuterRef('pk'), topic__title__icontains=value
+        )
+        resources = Resource.objects.filter(dataset=OuterRef('pk')).filter(
+            Q(title__icontains=value) | Q(description__icontains=value)
+        )
+        return queryset.filter(
+            Q(title__icontains=value) |
+            Q(description__icontains=value) |
+            Q(notes__icontains=value) |
+            Q(organisation__title__icontains=value) |
+            Exists(topics) |
+            Exists(resources)
+        )
+
+    def filter_organisation(self, queryset, name, value):
+        return queryset.filter(identifier_q('organisation', value))
+
+    def filter_license(self, queryset, name, value):
+        return queryset.filter(identifier_q('license', value))
+
+    def filter_topic(self, queryset, name, value):
+        through = Dataset.topics.through.objects.filter(dataset=OuterRef('pk'))
+        if self.get_operator('topic_op') == 'and':
+            for item in value:
+                queryset = queryset.filter(Exists(through.filter(identifier_q('topic', [item]))))
+            return queryset
+        return queryset.filter(Exists(through.filter(identifier_q('topic', value))))
+
+    def filter_format(self, queryset, name, value):
+        resources = Resource.objects.filter(dataset=OuterRef('pk'))
+        if self.get_operator('format_op') == 'and':
+            for item in value:
+                queryset = queryset.filter(Exists(resources.filter(identifier_q('format', [item]))))
+            return queryset
+        return queryset.filter(Exists(resources.filter(identifier_q('format', value))))
+
+
+class DatasetAPIFilterSet(DatasetFilterSet):
+    """
+    The REST API reserves ?format= for choosing a renderer, so API clients
+    filter by file format with ?resource_format= instead.
+    """
+    format = None
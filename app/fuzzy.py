@@ -0,0 +1,256 @@
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import CharField, F, Q, Value
+
+
+WORD = re.compile(r'[a-z0-9]+')
+
+
+def normalise(text):
+    """Lowercase, strip accents and collapse whitespace"""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+def words(text):
+    return WORD.findall(normalise(text))
+
+
+def word_trigrams(word):
+    """Trigrams of one word, padded the way pg_trgm pads them"""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigrams(text):
+    grams = set()
+    for word in words(text):
+        grams |= word_trigrams(word)
+    return grams
+
+
+def similarity(a, b):
+    """Share of trigrams two sets have in common, as pg_trgm's similarity()"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def word_similarity(query, title_words):
+    """
+    Best similarity between the query and any run of consecutive title
+    words, a close match for pg_trgm's word_similarity().
+    """
+    grams = [word_trigrams(word) for word in title_words]
+    best = 0.0
+    for start in range(len(grams)):
+        extent = set()
+        for end in range(start, len(grams)):
+            extent |= grams[end]
+            best = max(best, similarity(query, extent))
+    return best
+
+
+class TrigramIndex:
+    """
+    Portable n-gram index over catalog titles and their words.
+
+    Posting lists map each trigram to the titles (and vocabulary words) that
+    contain it, so a lookup only scores entries sharing enough trigrams with
+    the query. The vocabulary covers all searchable text, so corrections
+    point at words a search can actually match. It is maintained alongside
+    the typeahead index in suggest.py.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.titles = {}
+        self.postings = defaultdict(set)
+        self.vocabulary = Counter()
+        self.word_postings = defaultdict(set)
+
+    def add(self, key, entry, text=''):
+        """Index an entry's title; the vocabulary also takes words from its searchable text"""
+        vocabulary = set(words(text or entry['title']))
+        self.titles[key] = (entry, words(entry['title']), text, vocabulary)
+        for gram in trigrams(entry['title']):
+            self.postings[gram].add(key)
+        for word in vocabulary:
+            if not self.vocabulary[word]:
+                for gram in word_trigrams(word):
+                    self.word_postings[gram].add(word)
+            self.vocabulary[word] += 1
+
+    def remove(self, key):
+        item = self.titles.pop(key, None)
+        if item is None:
+            return
+        entry, title_words, text, vocabulary = item
+        for gram in trigrams(entry['title']):
+            self.postings[gram].discard(key)
+            if not self.postings[gram]:
+                del self.postings[gram]
+        for word in vocabulary:
+            self.vocabulary[word] -= 1
+            if self.vocabulary[word] <= 0:
+                del self.vocabulary[word]
+                for gram in word_trigrams(word):
+                    self.word_postings[gram].discard(word)
+                    if not self.word_postings[gram]:
+                        del self.word_postings[gram]
+
+    def text(self, key):
+        item = self.titles.get(key)
+        return item[2] if item else None
+
+    def candidates(self, grams, postings, threshold):
+        """Items sharing enough trigrams with the query to possibly reach the threshold"""
+        hits = Counter()
+        for gram in grams:
+            hits.update(postings.get(gram, ()))
+        return [item for item, count in hits.items() if count / len(grams) >= threshold]
+
+    def similar(self, query, limit=5, threshold=0.4):
+        """Catalog entries whose titles are closest to the query, best first"""
+        grams = trigrams(query)
+        if not grams:
+            return []
+        scored = []
+        for key in self.candidates(grams, self.postings, threshold):
+            entry, title_words = self.titles[key][:2]
+            score = word_similarity(grams, title_words)
+            if score >= threshold:
+                scored.append((-score, len(entry['title']), entry['title'], entry))
+        scored.sort(key=lambda match: match[:3])
+        return [match[3] for match in scored[:limit]]
+
+    def correct(self, word, threshold=0.4):
+        """Closest vocabulary word to a misspelled one, or None"""
+        if word in self.vocabulary:
+            return word
+        candidates = self.candidates(word_trigrams(word), self.word_postings, threshold)
+        return closest_word(word, {candidate: self.vocabulary[candidate] for candidate in candidates}, threshold)
+
+
+def closest_word(word, vocabulary, threshold=0.4):
+    """
+    The word of a vocabulary (word -> number of uses) most similar to the
+    given one, the more used on ties; None if none reaches the threshold.
+    """
+    if word in vocabulary:
+        return word
+    grams = word_trigrams(word)
+    best = None
+    for candidate, uses in vocabulary.items():
+        score = similarity(grams, word_trigrams(candidate))
+        rank = (score, uses)
+        if score >= threshold and (best is None or rank > best[0]):
+            best = (rank, candidate)
+    return best[1] if best else None
+
+
+def get_threshold():
+    return getattr(settings, 'EKAN_FUZZY_THRESHOLD', 0.4)
+
+
+def listed_titles():
+    """Querysets and kinds of everything whose title can be suggested"""
+    from .models import Dataset, Organisation, Topic
+
+    return [
+        (Topic.objects.all(), 'topic'),
+        (Organisation.objects.filter(is_active=True, status=Organisation.STATUS_APPROVED), 'organisation'),
+        (Dataset.objects.filter(is_published=True), 'dataset'),
+    ]
+
+
+@contextmanager
+def word_similarity_threshold():
+    """pg_trgm's word similarity threshold for the queries run in the block, in one transaction"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Local to the transaction, so connections reused by later requests keep the default
+        cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", [str(get_threshold())])
+        yield
+
+
+def similar_titles(query, limit=5):
+    """
+    Datasets, organisations and topics with titles similar to the query.
+
+    On PostgreSQL this is a single pg_trgm word-similarity query served by
+    the GIN trigram indexes; elsewhere it uses the in-process n-gram index.
+    """
+    from . import suggest
+
+    if connection.vendor != 'postgresql':
+        suggest.index.sync()
+        return suggest.index.trigrams.similar(query, limit, get_threshold())
+
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    parts = [
+        queryset.filter(title__trigram_word_similar=query).values(
+            kind=Value(kind, output_field=CharField()), name=F('title'), identifier=F('slug'),
+            score=TrigramWordSimilarity(query, 'title'),
+        )
+        for queryset, kind in listed_titles()
+    ]
+    with word_similarity_threshold():
+        rows = list(parts[0].union(*parts[1:], all=True).order_by('-score', 'name')[:limit])
+    return [suggest.make_entry(row['kind'], row['name'], row['identifier']) for row in rows]
+
+
+def similar_title_words(query_words, limit=200):
+    """
+    Words of the titles pg_trgm finds similar to any of the query words,
+    with how often each is used: one query on the GIN trigram indexes.
+    """
+    parts = []
+    for queryset, kind in listed_titles():
+        condition = Q()
+        for word in query_words:
+            condition |= Q(title__trigram_word_similar=word)
+        parts.append(queryset.filter(condition).values_list('title', flat=True))
+    with word_similarity_threshold():
+        titles = list(parts[0].union(*parts[1:], all=True)[:limit])
+    return Counter(word for title in titles for word in words(title))
+
+
+def corrected_query(query):
+    """
+    The query with unknown words replaced by the closest catalog words, or
+    None. On PostgreSQL the candidates are the words of titles found with
+    the trigram indexes; elsewhere, the in-process index's vocabulary,
+    which also has words from descriptions and resources.
+    """
+    from . import suggest
+
+    original = words(query)
+    if not original:
+        return None
+    if connection.vendor == 'postgresql':
+        vocabulary = similar_title_words(original)
+        corrected = [closest_word(word, vocabulary, get_threshold()) or word for word in original]
+    else:
+        suggest.index.sync()
+        corrected = [suggest.index.trigrams.correct(word, get_threshold()) or word for word in original]
+    if corrected == original:
+        return None
+    return ' '.join(corrected)
+
+
+def did_you_mean(query, limit=5):
+    """Alternative query and close title matches for a search that found nothing"""
+    suggestion = corrected_query(query)
+    matches = similar_titles(query, limit)
+    if not suggestion and not matches:
+        return None
+    return {'query': suggestion, 'matches': matches}
@@ -0,0 +1,55 @@
+# Request-scoped identity map. Instances loaded while handling a request are
+# registered on the request by primary key and slug, so views, meta mixins and
+# template tags that need the same object share one instance instead of
+# querying for it again. Related objects already loaded with select_related
+# are registered too.
+ATTRIBUTE = '_ekan_identity_map'
+LOOKUP_FIELDS = ('pk', 'slug')
+
+
+def get_map(request):
+    if request is None:
+        return {}
+    store = getattr(request, ATTRIBUTE, None)
+    if store is None:
+        store = {}
+        setattr(request, ATTRIBUTE, store)
+    return store
+
+
+def make_key(model, field, value):
+    return (model._meta.label_lower, field, value)
+
+
+def remember(request, instance, _seen=None):
+    """Register an instance, and the related instances it has already loaded"""
+    if request is None or instance is None:
+        return instance
+    seen = _seen if _seen is not None else set()
+    if id(instance) in seen:
+        return instance
+    seen.add(id(instance))
+
+    store = get_map(request)
+    for field in LOOKUP_FIELDS:
+        value = getattr(instance, field, None)
+        if value is not None:
+            store[make_key(type(instance), field, value)] = instance
+    for field in instance._meta.concrete_fields:
+        if field.is_relation and field.is_cached(instance):
+            remember(request, field.get_cached_value(instance), seen)
+    return instance
+
+
+def get(request, model, **lookup):
+    """The registered instance for a single pk= or slug= lookup, or None"""
+    (field, value), = lookup.items()
+    return get_map(request).get(make_key(model, field, value))
+
+
+def get_or_load(request, model, load, **lookup):
+    """Return the registered instance, or call load() and register what it returns"""
+    instance = get(request, model, **lookup)
+    if instance is None:
+        instance = remember(request, load())
+    return instance
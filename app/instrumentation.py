@@ -0,0 +1,158 @@
+import os
+import re
+import sys
+import time
+from contextlib import ExitStack
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+
+# Literals and parameter lists that vary between otherwise identical queries
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+PARAM_LISTS = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+SPACES = re.compile(r'\s+')
+
+# Shapes of the lookups an unprefetched relation runs once per row
+FIRST_TABLE = re.compile(r'\bFROM\s+"?(\w+)"?', re.IGNORECASE)
+ROW_LOOKUP = re.compile(r'\bWHERE\s+(?:\(\s*)?"?(\w+)"?\."?(\w+)"?\s*=\s*(?:%s|\?)', re.IGNORECASE)
+
+
+def fingerprint(sql):
+    """Normalise a statement so queries differing only in their values group together"""
+    sql = STRINGS.sub('?', sql)
+    sql = NUMBERS.sub('?', sql)
+    sql = PARAM_LISTS.sub('(...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+# Modules of execute wrappers, never the call site of the queries they wrap
+WRAPPER_FILES = {os.path.abspath(__file__)}
+
+
+def skip_call_sites_in(filename):
+    """Register a module holding an execute wrapper, so call_site looks past it"""
+    WRAPPER_FILES.add(os.path.abspath(filename))
+
+
+def is_project_file(filename):
+    filename = os.path.abspath(filename)
+    return (
+        filename.startswith(str(settings.BASE_DIR))
+        and os.sep + 'site-packages' + os.sep not in filename
+        and filename not in WRAPPER_FILES
+    )
+
+
+def call_site(frame=None):
+    """
+    Where a query came from: the innermost template tag or variable being
+    rendered, otherwise the innermost line of project code.
+    """
+    frame = frame or sys._getframe(1)
+    code_site = None
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        # type() rather than isinstance(): isinstance would evaluate a lazy object such as request.user
+        if issubclass(type(node), Node) and getattr(node, 'origin', None) is not None:
+            token = getattr(node, 'token', None)
+            line = token.lineno if token is not None else '?'
+            return f'{node.origin.template_name or node.origin.name}:{line}'
+        if code_site is None and is_project_file(frame.f_code.co_filename):
+            filename = os.path.relpath(frame.f_code.co_filename, settings.BASE_DIR)
+            code_site = f'{filename}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return code_site or 'unknown'
+
+
+class QueryRecorder:
+    """
+    Record every query run on any database connection while active.
+
+    Each entry is a dict with the SQL and its parameters, its duration in
+    seconds, the connection alias and, if `sites` is set, the call site of
+    the query.
+    """
+
+    def __init__(self, sites=False):
+        self.sites = sites
+        self.queries = []
+        self.stack = None
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self.wrapper(connection.alias)))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+    def wrapper(self, alias):
+        def record(execute, sql, params, many, context):
+            site = call_site(sys._getframe(1)) if self.sites else None
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                self.queries.append({
+                    'sql': sql,
+                    'params': params,
+                    'duration': time.perf_counter() - start,
+                    'alias': alias,
+                    'site': site,
+                })
+        return record
+
+
+def model_for_table(table):
+    for model in apps.get_models(include_auto_created=True):
+        if model._meta.db_table == table:
+            return model
+    return None
+
+
+def suggest_fix(sql):
+    """Guess the select_related/prefetch_related that would batch a repeated query"""
+    table = FIRST_TABLE.search(sql)
+    lookup = ROW_LOOKUP.search(sql)
+    if table is None or lookup is None:
+        return None
+    model = model_for_table(table.group(1))
+    filter_model = model_for_table(lookup.group(1))
+    if model is None or filter_model is None:
+        return None
+    column = lookup.group(2)
+
+    # Link table of a many-to-many field: dataset.topics.all()
+    if filter_model._meta.auto_created:
+        for related in apps.get_models():
+            for field in related._meta.local_many_to_many:
+                if field.remote_field.through is not filter_model:
+                    continue
+                if column == field.m2m_column_name():
+                    return f"{related.__name__}: prefetch_related('{field.name}')"
+                return f"{field.related_model.__name__}: prefetch_related('{field.remote_field.get_accessor_name()}')"
+        return None
+
+    if filter_model is not model:
+        return None
+
+    # Primary key lookup: a forward foreign key followed per row
+    if column == model._meta.pk.column:
+        fields = [
+            f"{related.__name__}: select_related('{field.name}')"
+            for related in apps.get_models()
+            for field in related._meta.concrete_fields
+            if field.many_to_one and field.related_model is model
+        ]
+        return ' or '.join(sorted(fields)) or None
+
+    # Foreign key lookup: a reverse relation such as dataset.resources.all()
+    for field in model._meta.concrete_fields:
+        if field.many_to_one and field.column == column:
+            return f"{field.related_model.__name__}: prefetch_related('{field.remote_field.get_accessor_name()}')"
+    return None
@@ -0,0 +1,200 @@
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from app.instrumentation import QueryRecorder, fingerprint, model_for_table
+from app.models import Dataset, Organisation, Resource, Topic
+
+
+# Plan lines that mean a table is read in full or results are sorted after reading
+PROBLEMS = [
+    re.compile(r'\bSCAN (\w+)(?! USING (?:COVERING )?INDEX)'),   # SQLite
+    re.compile(r'Seq Scan on (\w+)'),                            # PostgreSQL
+]
+SORTS = [
+    re.compile(r'USE TEMP B-TREE FOR (?:ORDER BY|RIGHT PART OF ORDER BY)'),
+    re.compile(r'^\s*(?:->\s*)?(?:Incremental )?Sort\b', re.MULTILINE),
+]
+CLAUSE_END = re.compile(r'\s(?:GROUP BY|ORDER BY|LIMIT|OFFSET|HAVING)\s')
+
+
+def hot_paths():
+    """The public pages and API endpoints that carry most traffic, with real slugs"""
+    dataset = Dataset.objects.filter(is_published=True).first()
+    resource = Resource.objects.filter(dataset__is_published=True).first()
+    organisation = Organisation.objects.filter(is_active=True, status=Organisation.STATUS_APPROVED).first()
+    topic = Topic.objects.first()
+    word = dataset.title.split()[0] if dataset else 'data'
+
+    paths = ['/', '/datasets/', '/datasets/?sort=title', f'/datasets/?q={word}', '/organisations/', '/topics/',
+             '/about/', '/api/v1/datasets/', '/api/v1/datasets/?ordering=title', '/api/v1/organisations/',
+             '/api/v1/topics/', '/api/v1/resources/']
+    if dataset:
+        paths += [dataset.get_absolute_url(), f'/api/v1/datasets/{dataset.pk}/']
+    if resource:
+        paths.append(resource.get_absolute_url())
+    if organisation:
+        paths.append(organisation.get_absolute_url())
+    if topic:
+        paths += [topic.get_absolute_url(), f'/datasets/?topic={topic.slug}']
+    return paths
+
+
+def field_names(model, columns):
+    by_column = {field.column: field for field in model._meta.concrete_fields}
+    return [(by_column[column], prefix) for prefix, column in columns if column in by_column]
+
+
+def where_clause(sql):
+    start = sql.find(' WHERE ')
+    if start < 0:
+        return ''
+    end = CLAUSE_END.search(sql, start)
+    return sql[start:end.start() if end else len(sql)]
+
+
+def propose(sql, model):
+    """Equality filters followed by the sort order on the query's main table"""
+    table = re.escape(model._meta.db_table)
+    where = where_clause(sql)
+    equal = re.findall(rf'"{table}"\."(\w+)" = (?:%s|\?)', where)
+    flags = re.findall(rf'"{table}"\."(\w+)"(?=\s*(?:\)|AND\b|OR\b|$))', where)
+    order_by = sql[sql.find(' ORDER BY '):] if ' ORDER BY ' in sql else ''
+    order = re.findall(rf'"{table}"\."(\w+)" (ASC|DESC)', order_by)
+
+    filters = field_names(model, [('', column) for column in equal])
+    booleans = [
+        field for field, prefix in field_names(model, [('', column) for column in flags])
+        if field.get_internal_type() == 'BooleanField'
+    ]
+    sort = field_names(model, [('-' if direction == 'DESC' else '', column) for column, direction in order])
+
+    fields = []
+    for field, prefix in filters + [(field, '') for field in booleans] + sort:
+        name = prefix + field.name
+        if field.name not in [existing.lstrip('-') for existing in fields]:
+            fields.append(name)
+    if not fields:
+        return None
+    # Filters on flags can become the condition of a smaller, partial index
+    partial = None
+    if booleans and len(fields) > len(booleans):
+        partial = ([name for name in fields if name.lstrip('-') not in {field.name for field in booleans}],
+                   {field.name: True for field in booleans})
+    return fields, partial
+
+
+def covered(model, fields):
+    wanted = [name.lstrip('-') for name in fields]
+    candidates = [[name.lstrip('-') for name in index.fields] for index in model._meta.indexes]
+    candidates += [[field.name] for field in model._meta.concrete_fields if field.db_index or field.unique]
+    return any(candidate[:len(wanted)] == wanted for candidate in candidates)
+
+
+def index_name(model, fields):
+    """Django limits index names to 30 characters"""
+    words = '_'.join(name.lstrip('-').removeprefix('is_') for name in fields)
+    return f'{model._meta.model_name}_{words}'[:26].rstrip('_') + '_idx'
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+
+def timing(sql, params, repeat):
+    runs = []
+    with connection.cursor() as cursor:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            runs.append((time.perf_counter() - start) * 1000)
+    return statistics.median(runs)
+
+
+class Command(BaseCommand):
+    help = 'Replay the hot pages and API endpoints, EXPLAIN their queries and propose indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query when timing (median is reported)')
+        parser.add_argument('--plans', action='store_true', help='Print the plan of every query')
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help='Ignore tables smaller than this, where a scan is as cheap as an index')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('🔎 Replaying hot pages and API endpoints...'))
+        queries = {}
+        # No caching, so every query a cold request runs is seen; no per-request instrumentation noise
+        with override_settings(
+            CACHES={alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'} for alias in ('default', 'tiered')},
+            EKAN_PROFILING=False, EKAN_NPLUSONE_DETECTION=False, EKAN_METRICS=False,
+        ):
+            client = Client(HTTP_HOST='localhost')
+            for path in hot_paths():
+                with QueryRecorder() as recorder:
+                    status = client.get(path).status_code
+                self.stdout.write(f'   {path} → {status}, {len(recorder.queries)} queries')
+                for query in recorder.queries:
+                    if query['sql'].lstrip().upper().startswith('SELECT'):
+                        queries.setdefault(fingerprint(query['sql']), (query['sql'], query['params'], path))
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'📋 Explaining {len(queries)} distinct queries...'))
+        proposals = {}
+        rows = {}
+        total_ms = 0
+        for sql, params, path in queries.values():
+            plan = explain(sql, params)
+            elapsed = timing(sql, params, options['repeat'])
+            total_ms += elapsed
+            scans = {table for pattern in PROBLEMS for table in pattern.findall(plan)}
+            sorts = any(pattern.search(plan) for pattern in SORTS)
+            if options['plans']:
+                self.stdout.write(f'\n   {elapsed:.2f} ms  {path}\n   {sql}')
+                for line in plan.splitlines():
+                    self.stdout.write(f'   │ {line}')
+            if not scans and not sorts:
+                continue
+            match = re.search(r'\bFROM "?(\w+)"?', sql)
+            model = model_for_table(match.group(1)) if match else None
+            if model is None or model._meta.auto_created:
+                continue
+            if model not in rows:
+                rows[model] = model._default_manager.count()
+            if rows[model] < options['min_rows']:
+                continue
+            proposal = propose(sql, model)
+            if proposal is None or covered(model, proposal[0]):
+                continue
+            key = (model.__name__, tuple(proposal[0]))
+            entry = proposals.setdefault(key, {'model': model, 'proposal': proposal, 'paths': set(), 'ms': 0})
+            entry['paths'].add(path)
+            entry['ms'] += elapsed
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'⏱️  Total median time of all distinct queries: {total_ms:.2f} ms'))
+        if not proposals:
+            self.stdout.write(self.style.SUCCESS('✅ No scans or sorts that an index would avoid'))
+            return
+
+        self.stdout.write(self.style.WARNING(f'💡 {len(proposals)} index suggestions (largest time first):'))
+        for entry in sorted(proposals.values(), key=lambda entry: entry['ms'], reverse=True):
+            model = entry['model']
+            fields, partial = entry['proposal']
+            name = index_name(model, fields)
+            self.stdout.write('')
+            self.stdout.write(f"   {model.__name__}: {entry['ms']:.2f} ms across {', '.join(sorted(entry['paths']))}")
+            self.stdout.write(f"      models.Index(fields={fields!r}, name='{name}')")
+            if partial:
+                condition = ', '.join(f'{field}={value}' for field, value in partial[1].items())
+                self.stdout.write(
+                    f"      or partial: models.Index(fields={partial[0]!r}, condition=Q({condition}), "
+                    f"name='{index_name(model, partial[0])}')"
+                )
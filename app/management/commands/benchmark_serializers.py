@@ -0,0 +1,65 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from api.fast_serializers import DatasetValuesSerializer, ResourceValuesSerializer
+from api.mixins import optimise_queryset
+from api.serializers import DatasetSerializer, ResourceSerializer
+from app.models import Dataset, Resource
+
+
+def timed(function, repeat):
+    """Median seconds per call, after a warm-up call"""
+    function()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs)
+
+
+class Command(BaseCommand):
+    help = 'Compare the cost per object of the API list serializers with the values() fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100, help='Objects serialized per run')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per serializer (median is reported)')
+
+    def handle(self, *args, **options):
+        limit, repeat = options['limit'], options['repeat']
+        request = Request(RequestFactory(HTTP_HOST='localhost').get('/api/v1/'))
+        context = {'request': request}
+        endpoints = [
+            ('datasets', Dataset.objects.filter(is_published=True), DatasetSerializer, DatasetValuesSerializer),
+            ('resources', Resource.objects.filter(dataset__is_published=True), ResourceSerializer,
+             ResourceValuesSerializer),
+        ]
+
+        self.stdout.write(self.style.SUCCESS(f'⏱️  Serializing {limit} objects, median of {repeat} runs '
+                                             '(queries included)...'))
+        for name, queryset, serializer_class, fast_class in endpoints:
+            count = min(queryset.count(), limit)
+            if not count:
+                self.stdout.write(self.style.WARNING(f'   {name}: nothing to serialize, skipped'))
+                continue
+
+            def regular():
+                objects = optimise_queryset(queryset, serializer_class(context=context))[:limit]
+                return serializer_class(objects, many=True, context=context).data
+
+            def fast():
+                serializer = fast_class(context)
+                return serializer.serialize(serializer.values(queryset)[:limit])
+
+            if regular() != fast():
+                self.stdout.write(self.style.ERROR(f'   {name}: fast path output differs from {serializer_class.__name__}'))
+            regular_us = timed(regular, repeat) / count * 1e6
+            fast_us = timed(fast, repeat) / count * 1e6
+            self.stdout.write(
+                f'   {name}: {serializer_class.__name__} {regular_us:.1f} µs/object, '
+                f'{fast_class.__name__} {fast_us:.1f} µs/object ({regular_us / fast_us:.1f}x faster)'
+            )
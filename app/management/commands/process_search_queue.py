@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from app import slow_queries
+from app.models import SearchIndexChange
+from app.search_index import process_queue
+
+
+class Command(BaseCommand):
+    help = 'Apply queued search index changes in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Queued changes to apply per transaction (default: 500)'
+        )
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Keep running and poll for new changes'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between polls with --watch (default: 2)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('🔄 Processing search index queue...'))
+        self.stdout.write(f'   Pending changes: {SearchIndexChange.objects.count()}')
+
+        total = 0
+        try:
+            while True:
+                processed = process_queue(options['batch_size'])
+                total += processed
+                # No request finishes here to write the slow query log
+                slow_queries.flush()
+                if processed:
+                    self.stdout.write(f'   ✅ Applied {processed} changes')
+                    continue
+                if not options['watch']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('')
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Search index up to date ({total} changes applied)'))
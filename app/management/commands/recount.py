@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.counters import recount
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored dataset and resource counters and repair any drift'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('🔢 Recounting datasets and resources...'))
+
+        with transaction.atomic():
+            fixed = recount()
+
+        for counter, rows in fixed.items():
+            status = f'⚠️  {rows} repaired' if rows else '✅ consistent'
+            self.stdout.write(f'   {counter}: {status}')
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'✅ Done ({sum(fixed.values())} rows repaired)'))
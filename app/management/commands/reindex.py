@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max
+from app import slow_queries
+from app.models import SearchEntry, SearchIndexChange
+from app.search_index import KINDS, build_entries, write_entries
+
+
+def build_chunk(kind, ids):
+    try:
+        # Slow queries go back with the entries, for the main thread to write
+        return kind, build_entries(kind, ids), slow_queries.take()
+    finally:
+        # Worker threads open their own connections; close them before the thread is reused
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index from scratch in parallel chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Threads building index entries; 1 builds them on the main thread (default: 4)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Objects per chunk (default: 500)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('🔎 Rebuilding search index...'))
+        started = time.monotonic()
+        # Changes queued from here on are applied by the worker as usual
+        last_change = SearchIndexChange.objects.aggregate(last=Max('id'))['last']
+
+        chunks = []
+        for model, kind in KINDS.items():
+            # Existing entries are included so deleted objects are deactivated
+            ids = set(model.objects.values_list('pk', flat=True))
+            ids |= set(SearchEntry.objects.filter(kind=kind).values_list('object_id', flat=True))
+            ids = sorted(ids)
+            self.stdout.write(f'   {kind.capitalize()}: {len(ids)} objects')
+            size = options['chunk_size']
+            chunks.extend((kind, ids[i:i + size]) for i in range(0, len(ids), size))
+
+        written = 0
+        for kind, entries in self.build(chunks, options['workers']):
+            # Writes stay on this thread, so SQLite never sees concurrent writers
+            write_entries(entries)
+            slow_queries.flush()
+            written += len(entries)
+            self.stdout.write(f'   ✅ {kind}: {len(entries)} entries')
+
+        if last_change is not None:
+            SearchIndexChange.objects.filter(id__lte=last_change).delete()
+
+        active = SearchEntry.objects.filter(is_active=True).count()
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Indexed {written} objects in {len(chunks)} chunks ({active} searchable) '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
+
+    def build(self, chunks, workers):
+        """Entries for each chunk, built in worker threads (or on this thread with one worker)"""
+        if workers <= 1:
+            for kind, ids in chunks:
+                yield kind, build_entries(kind, ids)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(build_chunk, kind, ids) for kind, ids in chunks]
+            for future in as_completed(futures):
+                kind, entries, runs = future.result()
+                slow_queries.extend(runs)
+                yield kind, entries
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from app.models import SlowQuery
+
+
+SORTS = {
+    'total': lambda entry: entry.total_ms,
+    'p95': lambda entry: entry.p95_ms,
+    'max': lambda entry: entry.max_ms,
+    'mean': lambda entry: entry.mean_ms,
+    'count': lambda entry: entry.count,
+}
+
+
+class Command(BaseCommand):
+    help = 'Show the slowest queries recorded by the slow query log, grouped by fingerprint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help='Number of fingerprints to show')
+        parser.add_argument('--sort', choices=SORTS, default='total', help='Order by total, p95, max, mean time or count')
+        parser.add_argument('--explain', action='store_true', help='Show the query plan captured for each entry')
+        parser.add_argument('--reset', action='store_true', help='Delete all recorded slow queries')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'🗑️  Deleted {deleted} slow query entries'))
+            return
+
+        entries = sorted(SlowQuery.objects.all(), key=SORTS[options['sort']], reverse=True)[:options['limit']]
+        if not entries:
+            self.stdout.write(self.style.SUCCESS('✅ No slow queries recorded'))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f'🐢 Slowest queries by {options["sort"]}'))
+        for rank, entry in enumerate(entries, start=1):
+            self.stdout.write('')
+            self.stdout.write(self.style.WARNING(
+                f'{rank}. {entry.count} runs, total {entry.total_ms:,.0f} ms, mean {entry.mean_ms:,.1f} ms, '
+                f'p95 {entry.p95_ms:,.1f} ms, max {entry.max_ms:,.1f} ms'
+            ))
+            self.stdout.write(f'   📍 {entry.site or "unknown"}')
+            self.stdout.write(f'   {entry.fingerprint}')
+            if options['explain']:
+                for line in (entry.explain or 'No plan captured').splitlines():
+                    self.stdout.write(f'   │ {line}')
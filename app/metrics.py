@@ -0,0 +1,203 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+
+# Metric name -> (type, help, histogram buckets)
+METRICS = {
+    'ekan_requests_total': ('counter', 'Requests served, by URL name, method and status class', None),
+    'ekan_request_duration_seconds': (
+        'histogram', 'Request latency by URL name',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'ekan_db_queries_total': ('counter', 'Database queries run while serving requests, by URL name', None),
+    'ekan_db_query_seconds_total': ('counter', 'Time spent in database queries while serving requests, by URL name', None),
+    'ekan_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss)', None),
+    'ekan_preview_duration_seconds': (
+        'histogram', 'Resource preview generation time by format',
+        (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    ),
+    'ekan_downloads_total': ('counter', 'Resource downloads served, by format', None),
+    'ekan_download_bytes_total': ('counter', 'Bytes of resource files served, by format', None),
+}
+
+
+class Registry:
+    """
+    Counters and histograms for this process.
+
+    Updates only touch an in-memory dict under a lock held for a few
+    dictionary operations. With EKAN_METRICS_DIR set, each process writes
+    its values to its own JSON file there (at most every
+    EKAN_METRICS_FLUSH_INTERVAL seconds), and /metrics adds up all the
+    files, so the numbers cover every gunicorn worker.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.flushed = 0
+        # Start time keeps a reused pid from overwriting an earlier process's totals
+        self.filename = f'{os.getpid()}-{int(time.time() * 1000)}.json'
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One count per bucket, then +Inf, sum and count
+                counts = self.values[key] = [0] * (len(buckets) + 3)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(buckets)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                [name, list(labels), list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self.values.items()
+            ]
+
+    def flush(self, force=False):
+        directory = getattr(settings, 'EKAN_METRICS_DIR', '')
+        now = time.monotonic()
+        if not directory or (not force and now - self.flushed < getattr(settings, 'EKAN_METRICS_FLUSH_INTERVAL', 5)):
+            return
+        self.flushed = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename)
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, path)
+
+
+registry = Registry()
+atexit.register(lambda: registry.flush(force=True))
+
+
+def inc(name, amount=1, **labels):
+    registry.inc(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def cache_lookup(cache_name, hit):
+    registry.inc('ekan_cache_requests_total', cache=cache_name, result='hit' if hit else 'miss')
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the duration of a block in a histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start, **labels)
+
+
+def collect():
+    """Totals across all processes: {(name, labels): value}"""
+    directory = getattr(settings, 'EKAN_METRICS_DIR', '')
+    if not directory:
+        snapshots = [registry.snapshot()]
+    else:
+        registry.flush(force=True)
+        snapshots = []
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed or being replaced by its process; counted on the next scrape
+                continue
+
+    totals = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot:
+            if name not in METRICS:
+                continue
+            key = (name, tuple(tuple(label) for label in labels))
+            if isinstance(value, list):
+                total = totals.setdefault(key, [0] * len(value))
+                totals[key] = [a + b for a, b in zip(total, value)]
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def gauges():
+    """Values read at scrape time rather than counted"""
+    from .models import SearchIndexChange
+
+    oldest = SearchIndexChange.objects.order_by('created').values_list('created', flat=True).first()
+    age = (timezone.now() - oldest).total_seconds() if oldest else 0
+    return [
+        ('ekan_search_queue_depth', 'Search index changes waiting to be processed',
+         SearchIndexChange.objects.count()),
+        ('ekan_search_queue_age_seconds', 'Age of the oldest waiting search index change', age),
+    ]
+
+
+def format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Everything in the Prometheus text exposition format"""
+    totals = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in totals.items() if metric == name)
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind == 'histogram':
+                cumulative = 0
+                for bound, count in zip(list(buckets) + [math.inf], value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels, [("le", format_value(bound))])} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {format_value(value[-2])}')
+                lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+            else:
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+    for name, help_text, value in gauges():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,241 @@
+import cProfile
+import hashlib
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from django.utils.text import slugify
+
+from . import metrics, profiling
+from .cache import cache, catalog_version
+from .instrumentation import QueryRecorder, fingerprint, suggest_fix
+
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware:
+    """
+    Count requests, their latency and database queries per URL name for
+    /metrics. Enabled with EKAN_METRICS.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'EKAN_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        # URL names rather than paths keep the number of series bounded
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        metrics.inc('ekan_requests_total', view=view, method=request.method, status=f'{response.status_code // 100}xx')
+        metrics.observe('ekan_request_duration_seconds', duration, view=view)
+        metrics.inc('ekan_db_queries_total', len(recorder.queries), view=view)
+        metrics.inc('ekan_db_query_seconds_total', sum(query['duration'] for query in recorder.queries), view=view)
+        metrics.registry.flush()
+        return response
+
+
+class PageCacheMiddleware:
+    """
+    Serve anonymous GET requests for public catalog pages from the cache.
+
+    Pages are keyed by absolute URL and catalog version, so any change
+    to datasets, resources, organisations or topics invalidates them all at
+    once. Signed-in users, requests with pending messages and responses that
+    set cookies (a CSRF token, session changes) are never cached. Responses
+    carry an X-Cache header of HIT or MISS, and cached pages keep the view's
+    ETag and Last-Modified, so revalidating clients get 304 Not Modified.
+    Enabled with EKAN_PAGE_CACHE for the URL names in EKAN_PAGE_CACHE_VIEWS.
+    """
+    stored_headers = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Vary')
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'EKAN_PAGE_CACHE', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.views = set(getattr(settings, 'EKAN_PAGE_CACHE_VIEWS', ()))
+        self.timeout = getattr(settings, 'EKAN_PAGE_CACHE_TIMEOUT', 300)
+
+    def __call__(self, request):
+        if not self.cacheable(request):
+            return self.get_response(request)
+
+        key = self.cache_key(request)
+        entry = cache.get(key)
+        metrics.cache_lookup('page', entry is not None)
+        if entry is not None:
+            status, headers, content = entry
+            response = HttpResponse(content, status=status)
+            for header, value in headers.items():
+                response[header] = value
+            response['X-Cache'] = 'HIT'
+            # Validators set by the view stay valid as long as the entry, which is keyed by catalog version
+            if 'ETag' in response:
+                last_modified = parse_http_date_safe(response.get('Last-Modified'))
+                response = get_conditional_response(request, response['ETag'], last_modified, response) or response
+            return response
+
+        response = self.get_response(request)
+        if self.storable(request, response):
+            headers = {header: response[header] for header in self.stored_headers if header in response}
+            cache.set(key, (response.status_code, headers, response.content), self.timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def cacheable(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return False
+        # Resolved here rather than in process_view so hits skip the view machinery
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return False
+        if match.view_name not in self.views:
+            return False
+        # Lets MetricsMiddleware label hits with the URL name too
+        request.resolver_match = match
+        return not len(get_messages(request))
+
+    def storable(self, request, response):
+        session = getattr(request, 'session', None)
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+            and not (session is not None and session.modified)
+            and 'private' not in response.get('Cache-Control', '')
+        )
+
+    def cache_key(self, request):
+        # HEAD shares GET's entry: the body is dropped by the server. Scheme and host are part
+        # of the key because templates may build absolute URLs from the request (og:url, og:image)
+        location = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+        return f'page:v{catalog_version()}:{location}'
+
+
+class NPlusOneMiddleware:
+    """
+    Warn about queries repeated per row within a request.
+
+    Queries are grouped by normalised fingerprint and call site (template
+    line or project code line). A group that runs more than
+    EKAN_NPLUSONE_THRESHOLD times is logged with the likely fix. Enabled
+    with EKAN_NPLUSONE_DETECTION, meant for development and staging.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'EKAN_NPLUSONE_DETECTION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'EKAN_NPLUSONE_THRESHOLD', 5)
+
+    def __call__(self, request):
+        with QueryRecorder(sites=True) as recorder:
+            response = self.get_response(request)
+            # Templates render lazily for streaming and template responses
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                response.render()
+
+        groups = defaultdict(list)
+        for query in recorder.queries:
+            groups[(fingerprint(query['sql']), query['site'])].append(query)
+
+        for (shape, site), queries in groups.items():
+            if len(queries) > self.threshold:
+                fix = suggest_fix(queries[0]['sql'])
+                logger.warning(
+                    'Possible N+1 on %s %s: %d queries from %s: %s%s',
+                    request.method, request.path, len(queries), site, shape,
+                    f' (try {fix})' if fix else '',
+                )
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Break down where a request's time went.
+
+    Adds a Server-Timing header with the time spent in SQL (and the query
+    count), template rendering, resource previews and file storage, and
+    logs the same numbers. Staff can send `X-Profile: 1` to also write a
+    cProfile dump of the request to EKAN_PROFILE_DIR, for pstats or
+    snakeviz. Enabled with EKAN_PROFILING.
+    """
+    header = 'X-Profile'
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'EKAN_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = None
+        user = getattr(request, 'user', None)
+        if request.headers.get(self.header) and user is not None and user.is_staff:
+            profiler = cProfile.Profile()
+
+        start = time.perf_counter()
+        with profiling.profile_request() as profile, QueryRecorder() as recorder:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        total = time.perf_counter() - start
+
+        timings = [('db', sum(query['duration'] for query in recorder.queries), f'{len(recorder.queries)} queries')]
+        timings += [(name, seconds, None) for name, (seconds, count) in sorted(profile.timings.items())]
+        timings.append(('total', total, None))
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={seconds * 1000:.1f}' + (f';desc="{desc}"' if desc else '')
+            for name, seconds, desc in timings
+        )
+
+        if profiler is not None:
+            response['X-Profile-File'] = self.dump(profiler, request)
+
+        fields = {f'{name}_ms': round(seconds * 1000, 1) for name, seconds, desc in timings}
+        fields['queries'] = len(recorder.queries)
+        logger.info(
+            '%s %s %s %s', request.method, request.path, response.status_code,
+            ' '.join(f'{key}={value}' for key, value in fields.items()),
+            extra={'profile': fields},
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # Called just before a TemplateResponse renders; time it up to the end of rendering
+        profile = profiling.current()
+        if profile is not None:
+            start = time.perf_counter()
+            response.add_post_render_callback(lambda response: profile.add('template', time.perf_counter() - start))
+        return response
+
+    def dump(self, profiler, request):
+        directory = settings.EKAN_PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{slugify(request.path) or 'home'}-{uuid.uuid4().hex[:6]}.prof"
+        profiler.dump_stats(os.path.join(directory, name))
+        return name
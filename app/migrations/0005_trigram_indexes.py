@@ -0,0 +1,36 @@
+# Trigram indexes for fuzzy title search. They only apply on PostgreSQL;
+# other databases fall back to the in-process n-gram index in app/fuzzy.py.
+
+from django.db import migrations
+
+
+TRIGRAM_MODELS = ['dataset', 'organisation', 'topic']
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for model_name in TRIGRAM_MODELS:
+        table = apps.get_model('app', model_name)._meta.db_table
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {model_name}_title_trgm_idx ON {table} USING gin (title gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name in TRIGRAM_MODELS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {model_name}_title_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
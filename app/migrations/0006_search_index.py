@@ -0,0 +1,94 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:23
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalise(text):
+    """app.fuzzy.normalise as of this migration: lowercase, strip accents and collapse whitespace"""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+def backfill_search_entries(apps, schema_editor):
+    """
+    Index the existing catalog, as suggestions and "did you mean" only read
+    SearchEntry. Mirrors app.search_index.listed() and document() with the
+    historical models; later changes reach the index through the queue.
+    """
+    Dataset = apps.get_model('app', 'Dataset')
+    Organisation = apps.get_model('app', 'Organisation')
+    Topic = apps.get_model('app', 'Topic')
+    SearchEntry = apps.get_model('app', 'SearchEntry')
+
+    def text(*parts):
+        return normalise(' '.join(part for part in parts if part))
+
+    def entries():
+        for topic in Topic.objects.iterator(chunk_size=500):
+            yield SearchEntry(kind='topic', object_id=topic.pk, title=topic.title, slug=topic.slug,
+                              text=text(topic.title, topic.description))
+        organisations = Organisation.objects.filter(is_active=True, status='approved')
+        for organisation in organisations.iterator(chunk_size=500):
+            yield SearchEntry(kind='organisation', object_id=organisation.pk, title=organisation.title,
+                              slug=organisation.slug, text=text(organisation.title, organisation.description))
+        datasets = Dataset.objects.filter(is_published=True).select_related('organisation').prefetch_related(
+            'topics', 'resources'
+        )
+        for dataset in datasets.iterator(chunk_size=500):
+            parts = [dataset.title, dataset.description, dataset.notes, dataset.organisation.title]
+            parts.extend(topic.title for topic in dataset.topics.all())
+            for resource in dataset.resources.all():
+                parts.extend([resource.title, resource.description])
+            yield SearchEntry(kind='dataset', object_id=dataset.pk, title=dataset.title, slug=dataset.slug,
+                              text=text(*parts))
+
+    batch = []
+    for entry in entries():
+        batch.append(entry)
+        if len(batch) == 500:
+            SearchEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    SearchEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('dataset', 'Dataset'), ('organisation', 'Organisation'), ('topic', 'Topic')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('dataset', 'Dataset'), ('organisation', 'Organisation'), ('topic', 'Topic')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('title', models.CharField(max_length=200)),
+                ('slug', models.SlugField(max_length=200)),
+                ('text', models.TextField(blank=True, help_text='Normalised searchable text')),
+                ('is_active', models.BooleanField(default=True, help_text='Inactive entries are unpublished or deleted objects')),
+                ('updated', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'verbose_name_plural': 'search entries',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='search_entry_object_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_search_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:27
+
+from django.db import migrations, models
+from django.db.models import F, Func, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset):
+    count = queryset.order_by().annotate(
+        count=Func(F('pk'), function='COUNT', output_field=IntegerField())
+    ).values('count')
+    return Coalesce(Subquery(count), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Dataset = apps.get_model('app', 'Dataset')
+    Organisation = apps.get_model('app', 'Organisation')
+    Resource = apps.get_model('app', 'Resource')
+    Topic = apps.get_model('app', 'Topic')
+
+    Dataset.objects.update(resource_count=count_subquery(Resource.objects.filter(dataset=OuterRef('pk'))))
+    Organisation.objects.update(
+        dataset_count=count_subquery(Dataset.objects.filter(organisation=OuterRef('pk'), is_published=True)),
+        resource_count=count_subquery(
+            Resource.objects.filter(dataset__organisation=OuterRef('pk'), dataset__is_published=True)
+        ),
+    )
+    Topic.objects.update(
+        dataset_count=count_subquery(Dataset.objects.filter(topics=OuterRef('pk'), is_published=True))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='resource_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='organisation',
+            name='dataset_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of published datasets'),
+        ),
+        migrations.AddField(
+            model_name='organisation',
+            name='resource_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of resources in published datasets'),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='dataset_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of published datasets'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
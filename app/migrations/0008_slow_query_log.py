@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_denormalised_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(help_text='MD5 of the fingerprint', max_length=32, unique=True)),
+                ('fingerprint', models.TextField(help_text='Statement with literals and parameters normalised away')),
+                ('sql', models.TextField(help_text='SQL of the slowest run, with placeholders')),
+                ('site', models.CharField(blank=True, help_text='Template line or code that ran the slowest run', max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('samples', models.JSONField(default=list, help_text='Most recent durations in milliseconds')),
+                ('explain', models.TextField(blank=True, help_text='Query plan of the slowest run')),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'slow queries',
+                'ordering': ['-total_ms'],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_slow_query_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['is_published', '-updated', '-id'], name='dataset_published_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['is_published', 'title', 'id'], name='dataset_published_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['is_published', '-created'], name='dataset_published_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['organisation', 'is_published', '-updated'], name='dataset_org_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(condition=models.Q(('is_featured', True), ('is_published', True)), fields=['-updated'], name='dataset_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='organisation',
+            index=models.Index(condition=models.Q(('is_active', True), ('status', 'approved')), fields=['title'], name='organisation_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resource',
+            index=models.Index(fields=['dataset', 'created'], name='resource_dataset_created_idx'),
+        ),
+    ]
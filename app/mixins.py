@@ -1,5 +1,59 @@
+from django.contrib.messages import get_messages
+from django.utils.cache import patch_vary_headers
 from meta.views import MetadataMixin
 
+from . import identity
+from .cache import catalog_version
+from .conditional import Validators
+
+
+class SharedObjectMixin:
+    """
+    Load a detail view's object once per request.
+
+    The object goes through the request's identity map (see identity.py),
+    so calling get_object() again, or looking the object up from a template
+    tag such as smart_breadcrumbs, reuses the loaded instance.
+    """
+    
+    def get_object(self, queryset=None):
+        slug = self.kwargs.get(self.slug_url_kwarg)
+        return identity.get_or_load(
+            self.request, self.model, lambda: super(SharedObjectMixin, self).get_object(queryset), slug=slug
+        )
+
+
+class ConditionalDetailMixin:
+    """
+    Answer repeat requests for a detail page with 304 Not Modified.
+
+    The validators come from one small query on `validators` (expressions
+    over the object and what the page lists) and are checked before
+    get_object() and the page's context are built. The ETag also covers
+    the session, as the header shows who is signed in and carries a CSRF
+    token (both change at every sign-in), and the catalog version, for the
+    footer's catalog stats. Requests with pending messages always get the
+    full page, so the messages are shown.
+    """
+    validators = {}
+
+    def get_validator_queryset(self):
+        return self.get_queryset().filter(**{self.slug_field: self.kwargs[self.slug_url_kwarg]})
+
+    def get(self, request, *args, **kwargs):
+        user = request.user
+        session = request.session.session_key if user.is_authenticated else ''
+        validators = Validators.fetch(
+            self.get_validator_queryset(), self.validators, variant=(session, catalog_version()),
+        )
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+        response = None if len(get_messages(request)) else validators.not_modified(request)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        patch_vary_headers(response, ['Cookie'])
+        return validators.apply(response, private=user.is_authenticated)
+
 
 class EKANMetaMixin(MetadataMixin):
     """Base mixin for EKAN meta tags"""
@@ -1,12 +1,47 @@
 import uuid
-from django.db import models
+from django.db import DatabaseError, models, router, transaction
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils.text import slugify
 from django.utils import timezone
 
+from . import metrics
+from .profiling import timed
 
-class Organisation(models.Model):
+
+class CounterFieldsMixin:
+    """
+    Keep stored counters out of ordinary saves.
+
+    Counters are changed only by the signal handlers in signals.py and the
+    `recount` command, so saving an instance loaded earlier must not write
+    back its (possibly stale) counter values. A save() without
+    update_fields on an existing row saves every other field; if the row
+    has gone, it is inserted (counters included) as a plain save() would.
+    New instances and fixtures, which bypass save(), are written as given.
+    """
+    counter_fields = []
+
+    def save(self, *args, **kwargs):
+        if (args or self._state.adding or self.pk is None
+                or kwargs.get('update_fields') is not None or kwargs.get('force_insert')):
+            return super().save(*args, **kwargs)
+        kwargs['update_fields'] = [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.name not in self.counter_fields
+        ]
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        try:
+            # In a savepoint, so the transaction stays usable if the UPDATE finds no row
+            with transaction.atomic(using=using):
+                super().save(**kwargs)
+        except DatabaseError:
+            if type(self)._base_manager.using(using).filter(pk=self.pk).exists():
+                raise
+            super().save(using=using, force_insert=True)
+
+
+class Organisation(CounterFieldsMixin, models.Model):
     """Government entities that publish datasets"""
     
     # Status choices for approval workflow
@@ -41,9 +76,22 @@ class Organisation(models.Model):
     is_active = models.BooleanField(default=True)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    
+    # Denormalised counters, see signals.py
+    dataset_count = models.PositiveIntegerField(default=0, editable=False,
+                                                help_text="Number of published datasets")
+    resource_count = models.PositiveIntegerField(default=0, editable=False,
+                                                 help_text="Number of resources in published datasets")
+    
+    counter_fields = ['dataset_count', 'resource_count']
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            # Public listings only show approved, active organisations
+            models.Index(fields=['title'], condition=models.Q(is_active=True, status='approved'),
+                         name='organisation_approved_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -83,16 +131,6 @@ class Organisation(models.Model):
             self.slug = slugify(self.title)
         super().save(*args, **kwargs)
     
-    @property
-    def dataset_count(self):
-        """Get total number of published datasets"""
-        return self.datasets.filter(is_published=True).count()
-    
-    @property
-    def resource_count(self):
-        """Get total number of resources across all datasets"""
-        return sum(dataset.resource_count for dataset in self.datasets.filter(is_published=True))
-    
     @property
     def active_members(self):
         """Get active organization members"""
@@ -166,7 +204,7 @@ class License(models.Model):
         return self.title
 
 
-class Topic(models.Model):
+class Topic(CounterFieldsMixin, models.Model):
     """Thematic classification for datasets (e.g., education, transport, health)"""
     title = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
@@ -175,6 +213,11 @@ class Topic(models.Model):
     color = models.CharField(max_length=7, default="#007bff", 
                            help_text="Hex color code for display")
     is_featured = models.BooleanField(default=False)
+    dataset_count = models.PositiveIntegerField(default=0, editable=False,
+                                                help_text="Number of published datasets")
+    updated = models.DateTimeField(auto_now=True)
+    
+    counter_fields = ['dataset_count']
 
     class Meta:
         ordering = ['title']
@@ -186,7 +229,7 @@ class Topic(models.Model):
         return reverse('app:topic', kwargs={'slug': self.slug})
 
 
-class Dataset(models.Model):
+class Dataset(CounterFieldsMixin, models.Model):
     """Collection of related resources from an organisation"""
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True, max_length=200)
@@ -212,9 +255,25 @@ class Dataset(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     published_date = models.DateTimeField(null=True, blank=True)
+    
+    resource_count = models.PositiveIntegerField(default=0, editable=False)
+    
+    counter_fields = ['resource_count']
 
     class Meta:
         ordering = ['-updated']
+        indexes = [
+            # Keyset pagination on (updated, id) and (title, id)
+            models.Index(fields=['-updated', '-id'], name='dataset_updated_id_idx'),
+            models.Index(fields=['title', 'id'], name='dataset_title_id_idx'),
+            # The same orderings restricted to published datasets, as every public page is
+            models.Index(fields=['is_published', '-updated', '-id'], name='dataset_published_updated_idx'),
+            models.Index(fields=['is_published', 'title', 'id'], name='dataset_published_title_idx'),
+            models.Index(fields=['is_published', '-created'], name='dataset_published_created_idx'),
+            models.Index(fields=['organisation', 'is_published', '-updated'], name='dataset_org_published_idx'),
+            models.Index(fields=['-updated'], condition=models.Q(is_published=True, is_featured=True),
+                         name='dataset_featured_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -225,11 +284,9 @@ class Dataset(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
-        super().save(*args, **kwargs)
-    
-    @property
-    def resource_count(self):
-        return self.resources.count()
+        # Counter updates in post_save commit together with the change
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 
 class Format(models.Model):
@@ -249,6 +306,18 @@ class Format(models.Model):
         return self.title.upper()
 
 
+def human_file_size(size):
+    """A size in bytes as text, such as "1.5 MB" ("Unknown" without a size)"""
+    if not size:
+        return "Unknown"
+
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} PB"
+
+
 class Resource(models.Model):
     """Individual files or URLs within a dataset"""
     title = models.CharField(max_length=200)
@@ -278,6 +347,13 @@ class Resource(models.Model):
 
     class Meta:
         ordering = ['created']
+        indexes = [
+            # Keyset pagination on (updated, id) and (title, id)
+            models.Index(fields=['-updated', '-id'], name='resource_updated_id_idx'),
+            models.Index(fields=['title', 'id'], name='resource_title_id_idx'),
+            # A dataset's resources in their default order
+            models.Index(fields=['dataset', 'created'], name='resource_dataset_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -302,12 +378,15 @@ class Resource(models.Model):
         
         # Auto-detect file size and mimetype
         if self.file and hasattr(self.file, 'size'):
-            self.size = self.file.size
+            with timed('storage'):
+                self.size = self.file.size
         
         # Set preview availability based on format
         self.is_preview_available = self.can_preview()
         
-        super().save(*args, **kwargs)
+        # Counter updates in post_save commit together with the change
+        with transaction.atomic():
+            super().save(*args, **kwargs)
     
     def can_preview(self):
         """Check if this resource can be previewed"""
@@ -319,6 +398,11 @@ class Resource(models.Model):
     
     def get_preview_data(self, max_rows=100):
         """Get preview data for supported file types"""
+        format_name = self.format.title.upper() if self.format else 'none'
+        with timed('preview'), metrics.timer('ekan_preview_duration_seconds', format=format_name):
+            return self.build_preview_data(max_rows)
+
+    def build_preview_data(self, max_rows=100):
         import pandas as pd
         import json
         
@@ -449,14 +533,7 @@ class Resource(models.Model):
     @property
     def file_size_human(self):
         """Return human-readable file size"""
-        if not self.size:
-            return "Unknown"
-        
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if self.size < 1024.0:
-                return f"{self.size:.1f} {unit}"
-            self.size /= 1024.0
-        return f"{self.size:.1f} PB"
+        return human_file_size(self.size)
     
     @property
     def is_file_upload(self):
@@ -465,3 +542,84 @@ class Resource(models.Model):
     @property
     def is_external_url(self):
         return bool(self.url and not self.file)
+
+
+class SearchEntry(models.Model):
+    """Denormalised search document for a dataset, organisation or topic"""
+    
+    KIND_DATASET = 'dataset'
+    KIND_ORGANISATION = 'organisation'
+    KIND_TOPIC = 'topic'
+    
+    KIND_CHOICES = [
+        (KIND_DATASET, 'Dataset'),
+        (KIND_ORGANISATION, 'Organisation'),
+        (KIND_TOPIC, 'Topic'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    title = models.CharField(max_length=200)
+    slug = models.SlugField(max_length=200)
+    text = models.TextField(blank=True, help_text="Normalised searchable text")
+    is_active = models.BooleanField(default=True, help_text="Inactive entries are unpublished or deleted objects")
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'search entries'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='search_entry_object_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}: {self.title}"
+
+
+class SearchIndexChange(models.Model):
+    """Queued change to apply to the search index, written in the same transaction as the change"""
+    kind = models.CharField(max_length=20, choices=SearchEntry.KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id}"
+
+
+class SlowQuery(models.Model):
+    """Queries slower than EKAN_SLOW_QUERY_MS, aggregated by fingerprint (see slow_queries.py)"""
+    
+    # Durations kept per fingerprint for the p95
+    MAX_SAMPLES = 200
+    
+    digest = models.CharField(max_length=32, unique=True, help_text="MD5 of the fingerprint")
+    fingerprint = models.TextField(help_text="Statement with literals and parameters normalised away")
+    sql = models.TextField(help_text="SQL of the slowest run, with placeholders")
+    site = models.CharField(max_length=255, blank=True, help_text="Template line or code that ran the slowest run")
+    count = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    samples = models.JSONField(default=list, help_text="Most recent durations in milliseconds")
+    explain = models.TextField(blank=True, help_text="Query plan of the slowest run")
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['-total_ms']
+        verbose_name_plural = 'slow queries'
+
+    def __str__(self):
+        return self.fingerprint[:80]
+    
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.count if self.count else 0
+    
+    @property
+    def p95_ms(self):
+        if not self.samples:
+            return 0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
@@ -0,0 +1,199 @@
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import DateTimeField, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from . import metrics
+from .cache import cache
+
+
+# Sort keys accepted from clients, mapped to a unique (field, pk) ordering
+ORDERINGS = {
+    '-updated': ('-updated', '-id'),
+    'updated': ('updated', 'id'),
+    '-created': ('-created', '-id'),
+    'created': ('created', 'id'),
+    'title': ('title', 'id'),
+    '-title': ('-title', '-id'),
+}
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values, reverse=False):
+    payload = json.dumps({'v': values, 'r': reverse}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        values, reverse = payload['v'], bool(payload.get('r'))
+        if not isinstance(values, list) or len(values) != 2:
+            raise ValueError
+        # Primary keys are integers (bool is an int subclass, but not a key)
+        if not isinstance(values[1], int) or isinstance(values[1], bool) or abs(values[1]) >= 2 ** 63:
+            raise ValueError
+        return values, reverse
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise InvalidCursor(cursor)
+
+
+def estimate_count(queryset):
+    """Row estimate from the query planner (PostgreSQL), or None if unavailable"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination keyed on a (field, pk) pair instead of OFFSET.
+
+    Each page is a range scan starting right after the last row of the
+    previous one, so deep pages cost the same as the first. `count_mode`
+    controls the total: 'exact' runs COUNT(*), 'cached' caches it per query,
+    'estimated' asks the query planner (falling back to 'cached'), and
+    'none' skips it altogether.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-updated', '-id'), count_mode=None):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.count_mode = count_mode or getattr(settings, 'EKAN_PAGINATION_COUNT', 'exact')
+
+    @property
+    def field(self):
+        return self.ordering[0].lstrip('-')
+
+    @property
+    def descending(self):
+        return self.ordering[0].startswith('-')
+
+    def get_value(self, obj):
+        # Rows may be model instances or dicts from .values()
+        value = obj[self.field] if isinstance(obj, dict) else getattr(obj, self.field)
+        return value.isoformat() if hasattr(value, 'isoformat') else value
+
+    def get_pk(self, obj):
+        return obj['id'] if isinstance(obj, dict) else obj.pk
+
+    def parse_value(self, value):
+        """The cursor's sort value as the field's type; InvalidCursor if it is not one"""
+        model_field = self.queryset.model._meta.get_field(self.field)
+        try:
+            if isinstance(model_field, DateTimeField):
+                parsed = parse_datetime(value) if isinstance(value, str) else None
+            elif isinstance(value, (dict, list, bool)) or value is None:
+                parsed = None
+            else:
+                parsed = model_field.to_python(value)
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidCursor(value)
+        if parsed is None:
+            raise InvalidCursor(value)
+        return parsed
+
+    def seek(self, values, forward):
+        """Rows strictly after (forward) or before the given key"""
+        value, pk = self.parse_value(values[0]), values[1]
+        after = forward == self.descending
+        lookup = 'lt' if after else 'gt'
+        return Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'pk__{lookup}': pk})
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        reverse = False
+        if cursor:
+            values, reverse = decode_cursor(cursor)
+            if reverse:
+                flipped = [f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering]
+                queryset = self.queryset.order_by(*flipped)
+            queryset = queryset.filter(self.seek(values, forward=not reverse))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            return KeysetPage(rows, self, has_next=True, has_previous=has_more)
+        return KeysetPage(rows, self, has_next=has_more, has_previous=bool(cursor))
+
+    @cached_property
+    def count(self):
+        if self.count_mode == 'none':
+            return None
+        if self.count_mode == 'exact':
+            return self.queryset.count()
+        if self.count_mode == 'estimated':
+            estimate = estimate_count(self.queryset)
+            if estimate is not None:
+                return estimate
+        sql, params = self.queryset.query.sql_with_params()
+        digest = hashlib.md5(f'{sql}{params!r}'.encode('utf-8')).hexdigest()
+        key = f'count:{digest}'
+        count = cache.get(key)
+        metrics.cache_lookup('pagination_count', count is not None)
+        if count is None:
+            count = self.queryset.count()
+            cache.set(key, count, getattr(settings, 'EKAN_PAGINATION_COUNT_TIMEOUT', 60))
+        return count
+
+
+class KeysetPage:
+    """A page of results, shaped like Django's Page where templates need it"""
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        last = self.object_list[-1]
+        return encode_cursor([self.paginator.get_value(last), self.paginator.get_pk(last)])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        first = self.object_list[0]
+        return encode_cursor([self.paginator.get_value(first), self.paginator.get_pk(first)], reverse=True)
@@ -0,0 +1,50 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_current = ContextVar('ekan_profile', default=None)
+
+
+class RequestProfile:
+    """Time spent per category (template, preview, storage, ...) during one request"""
+
+    def __init__(self):
+        self.timings = {}
+
+    def add(self, name, seconds):
+        total, count = self.timings.get(name, (0.0, 0))
+        self.timings[name] = (total + seconds, count + 1)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def profile_request():
+    """Collect `timed` blocks run in this context into a new RequestProfile"""
+    profile = RequestProfile()
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in a block to the current request's profile.
+
+    Also works as a decorator. Outside a profiled request it does nothing.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
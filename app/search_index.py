@@ -0,0 +1,113 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .fuzzy import normalise
+from .models import Dataset, Organisation, Resource, SearchEntry, SearchIndexChange, Topic
+
+
+KINDS = {
+    Dataset: SearchEntry.KIND_DATASET,
+    Organisation: SearchEntry.KIND_ORGANISATION,
+    Topic: SearchEntry.KIND_TOPIC,
+}
+
+
+def enqueue(kind, ids):
+    """
+    Record that objects need reindexing.
+
+    The queue rows are written in the caller's transaction, so a change and
+    its index update commit (or roll back) together. The index itself is
+    updated later by the `process_search_queue` worker, or right after
+    commit when EKAN_SEARCH_INDEX_EAGER is set.
+    """
+    ids = {pk for pk in ids if pk is not None}
+    if not ids:
+        return
+    SearchIndexChange.objects.bulk_create([SearchIndexChange(kind=kind, object_id=pk) for pk in ids])
+    if getattr(settings, 'EKAN_SEARCH_INDEX_EAGER', False):
+        transaction.on_commit(process_queue)
+
+
+def listed(kind):
+    """Objects of a kind that appear in search"""
+    if kind == SearchEntry.KIND_DATASET:
+        resources = Resource.objects.only('dataset', 'title', 'description')
+        return Dataset.objects.filter(is_published=True).select_related('organisation').prefetch_related(
+            'topics', Prefetch('resources', queryset=resources)
+        )
+    if kind == SearchEntry.KIND_ORGANISATION:
+        return Organisation.objects.filter(is_active=True, status=Organisation.STATUS_APPROVED)
+    return Topic.objects.all()
+
+
+def document(obj):
+    """Searchable text of an object, normalised"""
+    parts = [obj.title, getattr(obj, 'description', '')]
+    if isinstance(obj, Dataset):
+        parts.append(obj.notes)
+        parts.append(obj.organisation.title)
+        parts.extend(topic.title for topic in obj.topics.all())
+        for resource in obj.resources.all():
+            parts.extend([resource.title, resource.description])
+    return normalise(' '.join(part for part in parts if part))
+
+
+def build_entries(kind, ids):
+    """Fresh index entries for the given objects; missing or unlisted ones become inactive"""
+    now = timezone.now()
+    entries = {
+        pk: SearchEntry(kind=kind, object_id=pk, title='', slug='', text='', is_active=False, updated=now)
+        for pk in ids
+    }
+    for obj in listed(kind).filter(pk__in=ids):
+        entries[obj.pk] = SearchEntry(
+            kind=kind, object_id=obj.pk, title=obj.title, slug=obj.slug,
+            text=document(obj), is_active=True, updated=now,
+        )
+    return list(entries.values())
+
+
+def write_entries(entries):
+    SearchEntry.objects.bulk_create(
+        entries, batch_size=500, update_conflicts=True,
+        unique_fields=['kind', 'object_id'],
+        update_fields=['title', 'slug', 'text', 'is_active', 'updated'],
+    )
+
+
+def process_queue(batch_size=500):
+    """Apply one batch of queued changes; returns the number of queue rows consumed"""
+    with transaction.atomic():
+        changes = SearchIndexChange.objects.order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            # Let several workers drain the queue without picking the same rows
+            changes = changes.select_for_update(skip_locked=True)
+        changes = list(changes[:batch_size])
+        if not changes:
+            return 0
+
+        pending = defaultdict(set)
+        for change in changes:
+            pending[change.kind].add(change.object_id)
+        # Organisation and topic titles are part of their datasets' text
+        pending[SearchEntry.KIND_DATASET].update(
+            Dataset.objects.filter(organisation__in=pending[SearchEntry.KIND_ORGANISATION])
+            .values_list('pk', flat=True)
+        )
+        pending[SearchEntry.KIND_DATASET].update(
+            Dataset.topics.through.objects.filter(topic__in=pending[SearchEntry.KIND_TOPIC])
+            .values_list('dataset_id', flat=True)
+        )
+
+        entries = []
+        for kind, ids in pending.items():
+            if ids:
+                entries.extend(build_entries(kind, ids))
+        write_entries(entries)
+        SearchIndexChange.objects.filter(pk__in=[change.pk for change in changes]).delete()
+    return len(changes)
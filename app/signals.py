@@ -0,0 +1,153 @@
+from django.contrib.auth.models import User
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Dataset, Format, License, Organisation, OrganisationMember, Resource, SearchEntry, Topic
+from . import cache, counters, search_index, slow_queries
+
+
+@receiver(post_save, sender=Dataset)
+@receiver(post_save, sender=Organisation)
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Dataset)
+@receiver(post_delete, sender=Organisation)
+@receiver(post_delete, sender=Topic)
+def queue_search_update(sender, instance, **kwargs):
+    """Queue catalog objects for reindexing when they change"""
+    search_index.enqueue(search_index.KINDS[sender], [instance.pk])
+
+
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+def queue_resource_dataset(sender, instance, update_fields=None, **kwargs):
+    """Resource titles and descriptions are part of their dataset's search text"""
+    if update_fields and set(update_fields) <= {'download_count', 'is_preview_available'}:
+        return
+    search_index.enqueue(SearchEntry.KIND_DATASET, [instance.dataset_id])
+
+
+@receiver(m2m_changed, sender=Dataset.topics.through)
+def queue_topic_datasets(sender, instance, action, reverse, pk_set, **kwargs):
+    """Topic titles are part of the search text of the datasets tagged with them"""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            search_index.enqueue(SearchEntry.KIND_DATASET, [instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        search_index.enqueue(SearchEntry.KIND_DATASET, pk_set)
+    elif action == 'pre_clear':
+        search_index.enqueue(SearchEntry.KIND_DATASET, instance.datasets.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Topic)
+def queue_deleted_topic_datasets(sender, instance, **kwargs):
+    # Deleting a topic removes its dataset links without sending m2m_changed
+    search_index.enqueue(SearchEntry.KIND_DATASET, instance.datasets.values_list('pk', flat=True))
+
+
+# Denormalised counters. Dataset and Resource saves run in a transaction
+# (see their save methods), as do deletes and m2m changes, so counters
+# always commit together with the change that moved them.
+
+@receiver(post_init, sender=Dataset)
+@receiver(post_init, sender=Resource)
+def track_counted_fields(sender, instance, **kwargs):
+    counters.track(instance)
+
+
+@receiver(post_save, sender=Dataset)
+def count_dataset(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        counters.dataset_saved(instance, created)
+
+
+@receiver(pre_delete, sender=Dataset)
+def uncount_dataset(sender, instance, **kwargs):
+    counters.dataset_deleted(instance)
+
+
+@receiver(post_save, sender=Resource)
+def count_resource(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        counters.resource_saved(instance, created)
+
+
+@receiver(post_delete, sender=Resource)
+def uncount_resource(sender, instance, **kwargs):
+    counters.resource_moved(instance.dataset_id, -1)
+
+
+@receiver(m2m_changed, sender=Dataset.topics.through)
+def count_topic_datasets(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        delta = 1 if action == 'post_add' else -1
+        if reverse:
+            counters.topics_changed(pk_set, [instance.pk], delta)
+        else:
+            counters.topics_changed([instance.pk], pk_set, delta)
+    elif action == 'pre_clear':
+        if reverse:
+            counters.topics_changed(list(instance.datasets.values_list('pk', flat=True)), [instance.pk], -1)
+        else:
+            counters.topics_changed([instance.pk], list(instance.topics.values_list('pk', flat=True)), -1)
+
+
+# Catalog version: anything cached with cache.get_catalog is recomputed after a change
+
+@receiver(post_save, sender=Dataset)
+@receiver(post_save, sender=Organisation)
+@receiver(post_save, sender=Topic)
+@receiver(post_save, sender=License)
+@receiver(post_save, sender=Format)
+@receiver(post_delete, sender=Dataset)
+@receiver(post_delete, sender=Organisation)
+@receiver(post_delete, sender=Topic)
+@receiver(post_delete, sender=License)
+@receiver(post_delete, sender=Format)
+@receiver(post_delete, sender=Resource)
+@receiver(post_delete, sender=User)
+def bump_catalog_version(sender, **kwargs):
+    cache.bump_catalog_version()
+
+
+@receiver(post_save, sender=Resource)
+def bump_catalog_version_for_resource(sender, instance, update_fields=None, **kwargs):
+    # Downloads and preview checks do not change what pages show about a resource
+    if update_fields and set(update_fields) <= {'download_count', 'is_preview_available'}:
+        return
+    cache.bump_catalog_version()
+
+
+@receiver(post_save, sender=User)
+def bump_catalog_version_for_user(sender, instance, created, **kwargs):
+    # Only the user count is cached; logins update last_login on every sign-in
+    if created:
+        cache.bump_catalog_version()
+
+
+@receiver(m2m_changed, sender=Dataset.topics.through)
+def bump_catalog_version_for_topics(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        cache.bump_catalog_version()
+
+
+# Organisation pages list their members; touching the organisation changes the page's validators
+
+@receiver(post_save, sender=OrganisationMember)
+@receiver(post_delete, sender=OrganisationMember)
+def touch_member_organisation(sender, instance, **kwargs):
+    Organisation.objects.filter(pk=instance.organisation_id).update(updated=timezone.now())
+
+
+# Slow query log: buffer slow statements on every connection, write them once the response is sent
+# (the search index commands write theirs after each batch)
+
+@receiver(connection_created)
+def install_slow_query_log(sender, connection, **kwargs):
+    slow_queries.install(connection)
+
+
+@receiver(request_finished)
+def flush_slow_query_log(sender, **kwargs):
+    slow_queries.flush()
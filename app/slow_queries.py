@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+from .instrumentation import call_site, fingerprint, skip_call_sites_in
+from .models import SlowQuery
+
+
+logger = logging.getLogger(__name__)
+
+# Per-thread buffer of slow runs, and a guard so writing the log is not logged
+_local = threading.local()
+
+# Runs kept per thread between flushes; requests flush when they finish and
+# long-running commands after each batch, so this only bounds stray threads
+MAX_BUFFERED = 1000
+
+skip_call_sites_in(__file__)
+
+
+def threshold_ms():
+    return getattr(settings, 'EKAN_SLOW_QUERY_MS', 0)
+
+
+def record_slow_queries(execute, sql, params, many, context):
+    """Database execute wrapper that buffers statements slower than EKAN_SLOW_QUERY_MS"""
+    if getattr(_local, 'flushing', False):
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        if elapsed >= threshold_ms() and not many:
+            extend([{
+                'sql': sql,
+                'params': params,
+                'ms': elapsed,
+                'alias': context['connection'].alias,
+                'site': call_site(sys._getframe(1)),
+            }])
+
+
+def extend(runs):
+    """Buffer runs on this thread, dropping any beyond MAX_BUFFERED"""
+    if not hasattr(_local, 'runs'):
+        _local.runs = []
+    _local.runs.extend(runs[:MAX_BUFFERED - len(_local.runs)])
+
+
+def take():
+    """Remove and return this thread's buffered runs, e.g. to hand them to the thread that writes them"""
+    runs = getattr(_local, 'runs', None) or []
+    _local.runs = []
+    return runs
+
+
+def install(connection):
+    if threshold_ms() > 0 and record_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_slow_queries)
+
+
+def explain(run):
+    """Plan of a SELECT, or an empty string if it cannot be explained"""
+    if not run['sql'].lstrip().upper().startswith('SELECT'):
+        return ''
+    connection = connections[run['alias']]
+    try:
+        with transaction.atomic(using=run['alias']), connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {run['sql']}", run['params'])
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except DatabaseError as error:
+        return f'EXPLAIN failed: {error}'
+
+
+def save(shape, runs):
+    """Add runs of one fingerprint to its SlowQuery row, explaining a new slowest run"""
+    digest = hashlib.md5(shape.encode('utf-8')).hexdigest()
+    slowest = max(runs, key=lambda run: run['ms'])
+    previous_max = SlowQuery.objects.filter(digest=digest).values_list('max_ms', flat=True).first()
+    plan = explain(slowest) if previous_max is None or slowest['ms'] > previous_max else None
+
+    with transaction.atomic():
+        entry, created = SlowQuery.objects.select_for_update().get_or_create(
+            digest=digest, defaults={'fingerprint': shape, 'sql': slowest['sql']},
+        )
+        entry.count += len(runs)
+        entry.total_ms += sum(run['ms'] for run in runs)
+        entry.samples = (entry.samples + [round(run['ms'], 3) for run in runs])[-SlowQuery.MAX_SAMPLES:]
+        entry.last_seen = timezone.now()
+        if slowest['ms'] > entry.max_ms:
+            entry.max_ms = slowest['ms']
+            entry.sql = slowest['sql']
+            entry.site = slowest['site'][:255]
+            if plan is not None:
+                entry.explain = plan
+        entry.save()
+
+
+def flush():
+    """Write this thread's buffered slow runs, aggregated by fingerprint"""
+    runs = take()
+    if not runs:
+        return
+    groups = {}
+    for run in runs:
+        groups.setdefault(fingerprint(run['sql']), []).append(run)
+
+    _local.flushing = True
+    try:
+        for shape, group in groups.items():
+            try:
+                save(shape, group)
+            except DatabaseError:
+                logger.exception('Could not save slow query log entry')
+    finally:
+        _local.flushing = False
@@ -0,0 +1,146 @@
+import bisect
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.urls import reverse
+
+from .fuzzy import TrigramIndex, normalise
+
+
+# Order in which suggestion types are listed for equally good matches
+KIND_ORDER = {'topic': 0, 'organisation': 1, 'dataset': 2}
+
+# Re-read recently updated entries so rows committed slightly out of
+# timestamp order are not missed
+SYNC_OVERLAP = timedelta(seconds=30)
+
+
+def make_entry(kind, title, slug):
+    if kind == 'topic':
+        url = reverse('app:datasets') + f'?topic={slug}'
+    else:
+        url = reverse(f'app:{kind}', kwargs={'slug': slug})
+    return {'type': kind, 'title': title, 'slug': slug, 'url': url}
+
+
+class PrefixIndex:
+    """
+    In-process typeahead index over catalog titles.
+
+    Every word of a title starts a key ("ministry of health", "of health",
+    "health"), and the keys live in one sorted list, so a lookup is a binary
+    search followed by a short scan. A trigram index over the same entries
+    backs fuzzy matching (see fuzzy.py). Entries come from the SearchEntry
+    table (see search_index.py); each process loads it once and then
+    re-reads only the rows updated since its last sync.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.entries = {}
+        self.trigrams = TrigramIndex()
+        self.loaded = False
+        self.synced = None
+        self.checked = 0
+        self.lock = threading.RLock()
+
+    def rows(self, since=None):
+        from .models import SearchEntry
+
+        rows = SearchEntry.objects.values_list('kind', 'object_id', 'title', 'slug', 'text', 'is_active', 'updated')
+        if since is None:
+            return rows.filter(is_active=True)
+        return rows.filter(updated__gte=since - SYNC_OVERLAP)
+
+    def load(self):
+        with self.lock:
+            self.keys = []
+            self.entries = {}
+            self.trigrams.clear()
+            self.synced = None
+            keys = []
+            for kind, object_id, title, slug, text, is_active, updated in self.rows():
+                key = (kind, object_id)
+                entry = make_entry(kind, title, slug)
+                self.entries[key] = entry
+                self.trigrams.add(key, entry, text)
+                keys.extend((token, key) for token in self.tokens(title))
+                self.synced = max(self.synced or updated, updated)
+            keys.sort()
+            self.keys = keys
+            self.loaded = True
+            self.checked = time.monotonic()
+
+    def tokens(self, title):
+        words = normalise(title).split(' ')
+        return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            self.trigrams.remove(key)
+            for token in self.tokens(entry['title']):
+                index = bisect.bisect_left(self.keys, (token, key))
+                if index < len(self.keys) and self.keys[index] == (token, key):
+                    del self.keys[index]
+
+    def add(self, key, entry, text=''):
+        with self.lock:
+            self.remove(key)
+            if entry is None:
+                return
+            self.entries[key] = entry
+            self.trigrams.add(key, entry, text)
+            for token in self.tokens(entry['title']):
+                bisect.insort(self.keys, (token, key))
+
+    def sync(self):
+        """Load on first use, then apply entries changed since the last sync"""
+        if not self.loaded:
+            self.load()
+            return
+        interval = getattr(settings, 'EKAN_SUGGEST_SYNC_INTERVAL', 5)
+        now = time.monotonic()
+        if now - self.checked < interval:
+            return
+        self.checked = now
+        if self.synced is None:
+            # The index was empty when loaded
+            self.load()
+            return
+        with self.lock:
+            for kind, object_id, title, slug, text, is_active, updated in self.rows(self.synced):
+                key = (kind, object_id)
+                entry = make_entry(kind, title, slug) if is_active else None
+                if entry != self.entries.get(key) or text != self.trigrams.text(key):
+                    self.add(key, entry, text)
+                self.synced = max(self.synced, updated)
+
+    def search(self, query, limit=10):
+        self.sync()
+        prefix = normalise(query)
+        if not prefix:
+            return []
+        matches = {}
+        # add() and remove() change the list in place (a sync may be running in another thread)
+        with self.lock:
+            index = bisect.bisect_left(self.keys, (prefix,))
+            keys = self.keys
+            while index < len(keys) and len(matches) < limit * 5:
+                token, key = keys[index]
+                if not token.startswith(prefix):
+                    break
+                entry = self.entries.get(key)
+                if entry is not None and key not in matches:
+                    starts_title = normalise(entry['title']).startswith(prefix)
+                    matches[key] = (not starts_title, KIND_ORDER[entry['type']], len(entry['title']), entry)
+                index += 1
+        ranked = sorted(matches.values(), key=lambda match: match[:3])
+        return [match[3] for match in ranked[:limit]]
+
+
+index = PrefixIndex()
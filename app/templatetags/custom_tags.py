@@ -2,12 +2,69 @@ from django.conf import settings
 from django import template
 from django.urls import reverse
 from django.shortcuts import get_object_or_404
+from django.db.models import Prefetch, prefetch_related_objects
 from app.models import Dataset, Organisation, Topic, Format, License, Resource
+from app.cache import catalog_version, fragment_key, get_catalog, get_fragments
+from app import identity
 from django.contrib.auth.models import User
 
 register = template.Library()
 
 
+def shared_object(request, queryset, slug):
+    """The object the view already loaded for this slug, or a fresh lookup"""
+    return identity.get_or_load(
+        request, queryset.model, lambda: get_object_or_404(queryset, slug=slug), slug=slug
+    )
+
+
+# Card partials, and the values besides pk each card's content depends on
+CARDS = {
+    'dataset': (
+        'partials/dataset_card.html',
+        lambda dataset: (dataset.updated, dataset.resource_count, dataset.organisation.updated),
+    ),
+    'topic': ('partials/topic_card.html', lambda topic: (topic.updated, topic.dataset_count)),
+    'organisation': ('partials/organisation_card.html', lambda organisation: (organisation.updated, organisation.dataset_count)),
+}
+
+
+@register.simple_tag(takes_context=True)
+def cards(context, objects, kind):
+    """
+    Render the cards of a listing, taking those already rendered from the cache.
+
+    All cards on the page are fetched with one `get_many`; only the misses
+    are rendered (and, for datasets, have their resources prefetched).
+    Usage: {% cards datasets 'dataset' as rendered %}
+    """
+    objects = list(objects)
+    template_name, depends_on = CARDS[kind]
+    request = context.get('request')
+    # Dataset cards highlight search terms, and leave out the organisation on organisation pages.
+    # They also link to their resources, whose slugs and formats can change without touching the
+    # dataset, so they are rendered again after any catalog change.
+    variant = ''
+    if kind == 'dataset':
+        variant = (catalog_version(),)
+        if request is not None:
+            variant += (request.GET.get('q', ''), 'organisations' in request.path)
+    keys = [fragment_key(kind, obj.pk, *depends_on(obj), variant) for obj in objects]
+
+    def render(indexes):
+        misses = [objects[index] for index in indexes]
+        if kind == 'dataset':
+            prefetch_related_objects(misses, Prefetch('resources', queryset=Resource.objects.select_related('format')))
+        card = context.template.engine.get_template(template_name)
+        rendered = []
+        for obj in misses:
+            with context.push(**{kind: obj}):
+                rendered.append(card.render(context))
+        return rendered
+
+    return get_fragments(keys, render, name='cards')
+
+
 @register.inclusion_tag('partials/breadcrumbs.html', takes_context=True)
 def smart_breadcrumbs(context):
     """Generate breadcrumbs automatically based on URL pattern and context"""
@@ -31,14 +88,16 @@ def smart_breadcrumbs(context):
         elif url_name == 'dataset':
             dataset_slug = kwargs.get('slug')
             if dataset_slug:
-                dataset = get_object_or_404(Dataset, slug=dataset_slug, is_published=True)
+                dataset = shared_object(request, Dataset.objects.filter(is_published=True), dataset_slug)
                 breadcrumbs.append({'title': 'Datasets', 'url': reverse('app:datasets')})
                 breadcrumbs.append({'title': dataset.title, 'url': None})
                 
         elif url_name == 'resource':
             resource_slug = kwargs.get('slug')
             if resource_slug:
-                resource = get_object_or_404(Resource, slug=resource_slug, dataset__is_published=True)
+                resource = shared_object(
+                    request, Resource.objects.select_related('dataset').filter(dataset__is_published=True), resource_slug
+                )
                 dataset = resource.dataset
                 breadcrumbs.append({'title': 'Datasets', 'url': reverse('app:datasets')})
                 breadcrumbs.append({'title': dataset.title, 'url': reverse('app:dataset', kwargs={'slug': dataset.slug})})
@@ -47,7 +106,9 @@ def smart_breadcrumbs(context):
         elif url_name == 'resource_preview':
             resource_slug = kwargs.get('slug')
             if resource_slug:
-                resource = get_object_or_404(Resource, slug=resource_slug, dataset__is_published=True)
+                resource = shared_object(
+                    request, Resource.objects.select_related('dataset').filter(dataset__is_published=True), resource_slug
+                )
                 dataset = resource.dataset
                 breadcrumbs.append({'title': 'Datasets', 'url': reverse('app:datasets')})
                 breadcrumbs.append({'title': dataset.title, 'url': reverse('app:dataset', kwargs={'slug': dataset.slug})})
@@ -60,7 +121,7 @@ def smart_breadcrumbs(context):
         elif url_name == 'organisation':
             org_slug = kwargs.get('slug')
             if org_slug:
-                org = get_object_or_404(Organisation, slug=org_slug, is_active=True)
+                org = shared_object(request, Organisation.objects.filter(is_active=True), org_slug)
                 breadcrumbs.append({'title': 'Organisations', 'url': reverse('app:organisations')})
                 breadcrumbs.append({'title': org.title, 'url': None})
                 
@@ -70,7 +131,7 @@ def smart_breadcrumbs(context):
         elif url_name == 'topic':
             topic_slug = kwargs.get('slug')
             if topic_slug:
-                topic = get_object_or_404(Topic, slug=topic_slug)
+                topic = shared_object(request, Topic.objects.all(), topic_slug)
                 breadcrumbs.append({'title': 'Topics', 'url': reverse('app:topics')})
                 breadcrumbs.append({'title': topic.title, 'url': None})
                 
@@ -108,34 +169,52 @@ def smart_breadcrumbs(context):
     return {'breadcrumbs': breadcrumbs}
 
 
-@register.simple_tag(name="stats")
-def get_stats():
-    """ Returns top-level stats """
-    stats = {
+def count_stats():
+    return {
         'datasets': Dataset.objects.count(),
         'organisations': Organisation.objects.count(),
         'topics': Topic.objects.count(),
         'users': User.objects.count()
     }
-    return stats
 
 
-@register.simple_tag(name="filters")
-def get_filters():
-    """ Returns sidebar filters """
-    filters = {
-        'organisations': Organisation.objects.all(),
-        'topics': Topic.objects.all(),
-        'licenses': License.objects.all(),
-        'formats': Format.objects.all()
+def load_filters():
+    return {
+        'organisations': list(Organisation.objects.all()),
+        'topics': list(Topic.objects.all()),
+        'licenses': list(License.objects.all()),
+        'formats': list(Format.objects.all())
     }
+
+
+@register.simple_tag(name="stats")
+def get_stats():
+    """ Returns top-level stats, cached until the catalog changes """
+    return get_catalog('stats', count_stats)
+
+
+@register.simple_tag(name="filters", takes_context=True)
+def get_filters(context):
+    """ Returns sidebar filters, with dataset counts when the view provides facets """
+    # Each cache read unpickles fresh objects, so setting facet_count below is safe
+    filters = get_catalog('filters', load_filters)
+    facets = context.get('facets')
+    if facets:
+        for name, objects in filters.items():
+            counts = facets.get(name, {})
+            for obj in objects:
+                obj.facet_count = counts.get(obj.slug, 0)
     return filters
 
 @register.simple_tag(name='query_add')
 def query_add(request, **kwargs):
     updated = request.GET.copy()
     for k, v in kwargs.items():
-        updated[k] = v
+        if v in (None, ''):
+            # Empty values drop the parameter, e.g. cursor='' to go back to the first page
+            updated.pop(k, None)
+        else:
+            updated[k] = v
     return updated.urlencode()
 
 @register.simple_tag(name='query_del')
@@ -144,6 +223,26 @@ def query_del(request, key):
     updated.pop(key, None)
     return updated.urlencode()
 
+@register.simple_tag(name='query_toggle')
+def query_toggle(request, key, value):
+    """Add a value to a multi-valued parameter, or remove it if it is already selected"""
+    updated = request.GET.copy()
+    values = updated.getlist(key)
+    value = str(value)
+    if value in values:
+        values.remove(value)
+    else:
+        values.append(value)
+    updated.setlist(key, values)
+    updated.pop('page', None)
+    updated.pop('cursor', None)
+    return updated.urlencode()
+
+@register.filter
+def getlist(querydict, key):
+    """Return every value of a query parameter"""
+    return querydict.getlist(key)
+
 @register.simple_tag(name='query_replace')
 def query_replace(request, **kwargs):
     """Replace specific query parameters and ensure mutual exclusivity between topics and organizations"""
@@ -210,12 +309,10 @@ def search_results_summary(context):
     filters = []
     
     # Check for active filters
-    if request.GET.get('organisation'):
-        filters.append(f"organisation: {request.GET.get('organisation')}")
-    if request.GET.get('topic'):
-        filters.append(f"topic: {request.GET.get('topic')}")
-    if request.GET.get('license'):
-        filters.append(f"license: {request.GET.get('license')}")
+    for key in ['organisation', 'topic', 'license', 'format']:
+        values = request.GET.getlist(key)
+        if values:
+            filters.append(f"{key}: {', '.join(values)}")
     
     # Build summary message
     parts = []
@@ -1,3 +1,948 @@
-from django.test import TestCase
+import importlib
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse, QueryDict
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from faker import Faker
+
+from . import metrics, search_index, slow_queries, suggest
+from .cache import (
+    CATALOG_VERSION_KEY, bump_catalog_version, cache, catalog_version, get_or_compute, get_or_refresh,
+)
+from .cache_backend import TieredCache
+from .counters import recount
+from .facets import get_facet_counts, normalise_query
+from .factories import create_datasets, create_organisations, create_resources, create_topics, create_users
+from .filters import split_identifiers
+from .fuzzy import closest_word, corrected_query, did_you_mean, normalise, similar_titles
+from .instrumentation import QueryRecorder, fingerprint, suggest_fix
+from .middleware import NPlusOneMiddleware
+from .models import (
+    Dataset, Format, License, Organisation, Resource, SearchEntry, SearchIndexChange, SlowQuery, Topic,
+)
+from .pagination import KeysetPaginator, decode_cursor, encode_cursor
+from .search_index import process_queue
+from .suggest import PrefixIndex, make_entry
+
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='ekan-tests-')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class QueryBudgetTestCase(TestCase):
+    """
+    Base class for query-budget tests.
+
+    A small catalog is seeded with the factories, and `assertQueryBudget`
+    requests a URL once per scale in `scales`, growing the catalog in
+    between. The query count must stay within the budget and must be the
+    same at every scale, so a query per row fails the test with the SQL
+    that ran.
+    """
+    fixtures = ['formats', 'licenses']
+    scales = [1, 4]
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(0)
+        Faker.seed(0)
+        cls.users = create_users(count=4)
+        cls.topics = create_topics()
+        cls.organisations = create_organisations(cls.users, count=4)
+        cls.licenses = list(License.objects.all())
+        cls.formats = list(Format.objects.all())
+
+        # Known published objects for detail pages, grown alongside the catalog
+        cls.organisation = cls.organisations[0]
+        cls.topic = cls.topics[0]
+        cls.dataset = create_datasets([cls.organisation], cls.licenses, cls.users, [cls.topic], count=1)[0]
+        Dataset.objects.filter(pk=cls.dataset.pk).update(is_published=True)
+        cls.dataset.refresh_from_db()
+        cls.resource = Resource.objects.create(
+            title='Sample CSV', dataset=cls.dataset,
+            format=Format.objects.get(slug='csv'),
+            file=ContentFile(b'year,value\n2023,1\n2024,2\n', name='sample.csv'),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def grow(self, scale):
+        """Add rows everywhere, including to the objects detail pages show"""
+        datasets = create_datasets(self.organisations, self.licenses, self.users, self.topics, count=3 * scale)
+        datasets += create_datasets([self.organisation], self.licenses, self.users, [self.topic], count=2 * scale)
+        Dataset.objects.filter(pk__in=[dataset.pk for dataset in datasets]).update(is_published=True)
+        create_resources(datasets, self.formats, count=6 * scale)
+        create_resources([self.dataset], self.formats, count=2 * scale)
+
+    def count_queries(self, path, client):
+        # Start cold so cached lookups do not hide queries
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(path)
+        self.assertLess(response.status_code, 400, f'{path} returned {response.status_code}')
+        return context.captured_queries
+
+    def assertQueryBudget(self, budget, path, client=None):
+        client = client or self.client
+        counts = []
+        for scale in self.scales:
+            self.grow(scale)
+            queries = self.count_queries(path, client)
+            counts.append(len(queries))
+            if len(queries) > budget or counts[0] != len(queries):
+                sql = '\n'.join(f'{i}. {query["sql"]}' for i, query in enumerate(queries, start=1))
+                self.fail(
+                    f'{path} ran {len(queries)} queries at scale {scale} '
+                    f'(budget {budget}, counts so far {counts}):\n{sql}'
+                )
+
+
+class PageQueryBudgetTests(QueryBudgetTestCase):
+
+    def test_home(self):
+        self.assertQueryBudget(5, '/')
+
+    def test_dataset_list(self):
+        self.assertQueryBudget(12, '/datasets/')
+
+    def test_dataset_list_filtered(self):
+        self.assertQueryBudget(12, f'/datasets/?q=data&topic={self.topic.slug}&sort=title')
+
+    def test_dataset_detail(self):
+        self.assertQueryBudget(8, self.dataset.get_absolute_url())
+
+    def test_resource_detail(self):
+        self.assertQueryBudget(6, self.resource.get_absolute_url())
+
+    def test_resource_preview(self):
+        self.assertQueryBudget(5, f'/resources/{self.resource.slug}/preview/')
+
+    def test_organisation_list(self):
+        self.assertQueryBudget(6, '/organisations/')
+
+    def test_organisation_detail(self):
+        self.assertQueryBudget(13, self.organisation.get_absolute_url())
+
+    def test_topic_list(self):
+        self.assertQueryBudget(6, '/topics/')
+
+    def test_topic_detail(self):
+        self.assertQueryBudget(11, self.topic.get_absolute_url())
+
+    def test_about(self):
+        self.assertQueryBudget(8, '/about/')
+
+
+@override_settings(EKAN_PAGE_CACHE=True)
+class PageCacheTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_hit_runs_no_queries(self):
+        path = self.dataset.get_absolute_url()
+        self.assertEqual(self.client.get(path)['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertContains(response, self.dataset.title)
+
+    def test_catalog_change_invalidates(self):
+        path = self.dataset.get_absolute_url()
+        self.client.get(path)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dataset.title = 'Renamed dataset'
+            self.dataset.save()
+        response = self.client.get(path)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Renamed dataset')
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'data.example.org'])
+    def test_hosts_and_schemes_are_cached_apart(self):
+        path = self.dataset.get_absolute_url()
+        self.assertEqual(self.client.get(path)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(path, secure=True)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(path, HTTP_HOST='data.example.org')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(path, secure=True)['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(path, HTTP_HOST='data.example.org')['X-Cache'], 'HIT')
+
+    def test_signed_in_users_bypass(self):
+        self.client.force_login(self.users[0])
+        self.client.get('/')
+        self.assertNotIn('X-Cache', self.client.get('/'))
+
+
+class CardCacheTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_cards_skip_resource_prefetch(self):
+        self.grow(1)
+        with CaptureQueriesContext(connection) as cold:
+            self.client.get('/datasets/')
+        with CaptureQueriesContext(connection) as warm:
+            response = self.client.get('/datasets/')
+        self.assertIn('app_resource', ' '.join(query['sql'] for query in cold.captured_queries))
+        self.assertNotIn('app_resource', ' '.join(query['sql'] for query in warm.captured_queries))
+        self.assertContains(response, self.dataset.title)
+
+    def test_changed_dataset_is_rendered_again(self):
+        self.client.get('/datasets/')
+        self.dataset.title = 'Renamed dataset'
+        self.dataset.save()
+        self.assertContains(self.client.get('/datasets/'), 'Renamed dataset')
+
+    def test_changed_resource_is_rendered_again(self):
+        self.client.get('/datasets/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.resource.slug = 'renamed-sample'
+            self.resource.format = Format.objects.get(slug='json')
+            self.resource.save()
+        response = self.client.get('/datasets/')
+        self.assertContains(response, '/resources/renamed-sample/')
+        self.assertContains(response, 'bi-filetype-json')
+
+
+class TieredCacheTests(SimpleTestCase):
+
+    def make_cache(self, **options):
+        options = {'SHARED': 'default', 'SHARED_ONLY': ['version'], **options}
+        return TieredCache('', {'OPTIONS': options})
+
+    def setUp(self):
+        cache.clear()
+
+    def test_only_app_caches_are_tiered(self):
+        # Read-modify-write users of `default`, like allauth's rate limits, must see other processes' writes
+        self.assertNotIsInstance(caches['default'], TieredCache)
+        self.assertIsInstance(caches['tiered'], TieredCache)
+        cache.set('page:test', 'cached')
+        self.assertEqual(caches['default'].get('page:test'), 'cached')
+
+    def test_local_tier_is_bounded(self):
+        tiered = self.make_cache(MAX_ENTRIES=2)
+        for key in ('a', 'b', 'c'):
+            tiered.set(key, key)
+        tiered.get('b')
+        tiered.set('d', 'd')
+        self.assertEqual(list(tiered._local), [':1:b', ':1:d'])
+        # Evicted values are still found in the shared tier
+        self.assertEqual(tiered.get('a'), 'a')
+
+    def test_processes_see_version_changes_at_once(self):
+        first, second = self.make_cache(), self.make_cache()
+        first.set('version', 1)
+        first.set('stats:v1', 'old')
+        self.assertEqual(second.get('stats:v1'), 'old')
+        first.incr('version')
+        first.set('stats:v2', 'new')
+        self.assertEqual(second.get(f"stats:v{second.get('version')}"), 'new')
+
+    def test_in_place_changes_wait_for_local_timeout(self):
+        first, second = self.make_cache(), self.make_cache(LOCAL_TIMEOUT=0)
+        first.set('key', 'old')
+        self.assertEqual(second.get('key'), 'old')
+        first.set('key', 'new')
+        self.assertEqual(second.get('key'), 'new')
+
+
+class CacheHelperTests(TestCase):
+    key = 'helper:test'
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_catalog_version_is_bumped_on_commit(self):
+        version = catalog_version()
+        self.assertEqual(catalog_version(), version)
+        with self.captureOnCommitCallbacks() as callbacks:
+            bump_catalog_version()
+            self.assertEqual(catalog_version(), version)
+        self.assertEqual(catalog_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(catalog_version(), version + 1)
+
+        # An evicted version starts again from the clock
+        cache.delete(CATALOG_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_catalog_version()
+        self.assertGreaterEqual(cache.get(CATALOG_VERSION_KEY), version)
+
+    def test_get_or_compute_caches_the_value(self):
+        self.assertEqual(get_or_compute(self.key, self.compute, 60), 1)
+        self.assertEqual(get_or_compute(self.key, self.compute, 60), 1)
+        self.assertEqual(self.calls, 1)
+        self.assertIsNone(cache.get(f'{self.key}:lock'))
+        cache.delete(self.key)
+        self.assertEqual(get_or_compute(self.key, self.compute, 60), 2)
+
+    def test_threads_share_one_computation(self):
+        def compute():
+            time.sleep(0.05)
+            return self.compute()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_or_compute(self.key, compute, 60)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_waits_for_the_process_holding_the_lock(self):
+        cache.add(f'{self.key}:lock', 'other process', 10)
+        polls = []
+
+        def sleep(seconds):
+            # The other process finishes while this one waits
+            polls.append(seconds)
+            if len(polls) == 3:
+                cache.set(self.key, 'theirs', 60)
+
+        with mock.patch('app.cache.time.sleep', sleep):
+            self.assertEqual(get_or_compute(self.key, self.compute, 60), 'theirs')
+        self.assertEqual(len(polls), 3)
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(cache.get(f'{self.key}:lock'), 'other process')
+
+    @override_settings(EKAN_CACHE_LOCK_TIMEOUT=0.2)
+    def test_computes_itself_after_the_lock_timeout(self):
+        cache.add(f'{self.key}:lock', 'other process', 10)
+        started = time.monotonic()
+        self.assertEqual(get_or_compute(self.key, self.compute, 60), 1)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(cache.get(self.key), 1)
+        # Only the holder releases its lock
+        self.assertEqual(cache.get(f'{self.key}:lock'), 'other process')
+
+    def test_lock_is_released_when_computing_fails(self):
+        def fail():
+            raise RuntimeError('broken')
+
+        with self.assertRaises(RuntimeError):
+            get_or_compute(self.key, fail, 60)
+        self.assertIsNone(cache.get(f'{self.key}:lock'))
+        self.assertEqual(get_or_compute(self.key, self.compute, 60), 1)
+
+
+@override_settings(EKAN_CACHE_BACKGROUND_REFRESH=False)
+class StaleWhileRevalidateTests(SimpleTestCase):
+    key = 'aggregate:test'
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def expire(self):
+        entry = cache.get(self.key)
+        cache.set(self.key, {**entry, 'expires': time.time() - 1}, 60)
+
+    def test_expired_value_is_served_while_one_caller_refreshes(self):
+        self.assertEqual(get_or_refresh(self.key, self.compute, 60), 1)
+        self.expire()
+        self.assertEqual(get_or_refresh(self.key, self.compute, 60), 1)
+        self.assertEqual(get_or_refresh(self.key, self.compute, 60), 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_no_refresh_while_another_caller_holds_the_lock(self):
+        get_or_refresh(self.key, self.compute, 60)
+        self.expire()
+        cache.add(f'{self.key}:lock', 'other', 10)
+        for _ in range(3):
+            self.assertEqual(get_or_refresh(self.key, self.compute, 60), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_refreshes_early_as_expiry_nears(self):
+        get_or_refresh(self.key, self.compute, 60)
+        # A value that took far longer to compute than it has left to live is (all but certainly) refreshed early
+        cache.set(self.key, {**cache.get(self.key), 'delta': 10 ** 9}, 60)
+        get_or_refresh(self.key, self.compute, 60)
+        self.assertEqual(self.calls, 2)
+
+
+class ConditionalPageTests(QueryBudgetTestCase):
+
+    def test_unchanged_page_is_not_modified(self):
+        path = self.dataset.get_absolute_url()
+        response = self.client.get(path)
+        with self.assertNumQueries(1):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_resource_changes_etag(self):
+        path = self.dataset.get_absolute_url()
+        etag = self.client.get(path)['ETag']
+        Resource.objects.create(title='Another file', dataset=self.dataset, url='https://example.com/data.csv',
+                                format=Format.objects.get(slug='csv'))
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_differs_per_user(self):
+        path = self.dataset.get_absolute_url()
+        etag = self.client.get(path)['ETag']
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_signing_in_again_changes_etag(self):
+        # The cached page would keep the old session's CSRF token, so signing out would fail
+        path = self.dataset.get_absolute_url()
+        self.client.force_login(self.users[0])
+        etag = self.client.get(path)['ETag']
+        self.client.logout()
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_catalog_change_changes_etag(self):
+        # The footer shows catalog stats
+        path = self.dataset.get_absolute_url()
+        etag = self.client.get(path)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            create_users(count=1)
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class FacetTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def published(self):
+        return Dataset.objects.filter(is_published=True)
+
+    def test_normalise_query_ignores_order_case_and_paging(self):
+        first = QueryDict('topic=Health&q=Water++Supply&page=2&topic=education')
+        second = QueryDict('q=water supply&topic=education&topic=health&sort=title&cursor=abc')
+        self.assertEqual(normalise_query(first), normalise_query(second))
+        self.assertEqual(normalise_query(first), 'q=water supply&topic=education&topic=health')
+        self.assertNotEqual(normalise_query(first), normalise_query(QueryDict('q=water')))
+
+    def test_counts(self):
+        counts = get_facet_counts(self.published())
+        self.assertEqual(counts['organisations'], {self.organisation.slug: 1})
+        self.assertEqual(counts['topics'], {self.topic.slug: 1})
+        self.assertEqual(counts['formats'], {'csv': 1})
+        if self.dataset.license:
+            self.assertEqual(counts['licenses'], {self.dataset.license.slug: 1})
+
+    def test_catalog_change_updates_cached_counts(self):
+        params = QueryDict('')
+        self.assertEqual(get_facet_counts(self.published(), params)['organisations'], {self.organisation.slug: 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            create_datasets([self.organisation], self.licenses, self.users, [self.topic], count=1)
+            Dataset.objects.update(is_published=True)
+        self.assertEqual(get_facet_counts(self.published(), params)['organisations'], {self.organisation.slug: 2})
+
+
+class FilterTests(QueryBudgetTestCase):
+
+    def titles(self, query):
+        response = self.client.get(f'/api/v1/datasets/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [dataset['title'] for dataset in response.json()['results']]
+
+    def test_ids_and_slugs(self):
+        self.assertEqual(split_identifiers(['3', 'health', '²', '٣', str(2 ** 63)]),
+                         ([3], ['health', '²', '٣', str(2 ** 63)]))
+        self.assertEqual(self.titles(f'topic={self.topic.pk}'), [self.dataset.title])
+        self.assertEqual(self.titles(f'topic={self.topic.slug}'), [self.dataset.title])
+
+    def test_values_that_are_not_ids_match_nothing(self):
+        for query in ('topic=%C2%B2', 'organisation=99999999999999999999', f'organisation={2 ** 63 - 1}'):
+            self.assertEqual(self.titles(query), [])
+            self.assertEqual(self.client.get(f'/datasets/?{query}').status_code, 200)
+
+
+class PaginationTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.grow(1)
+        self.datasets = Dataset.objects.filter(is_published=True)
+
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor(['2024-01-01T00:00:00+00:00', 7], reverse=True)
+        self.assertEqual(decode_cursor(cursor), (['2024-01-01T00:00:00+00:00', 7], True))
+
+    def test_pages_cover_every_row_once(self):
+        for ordering in (('-updated', '-id'), ('title', 'id')):
+            paginator = KeysetPaginator(self.datasets, 2, ordering=ordering)
+            page, seen = paginator.page(), []
+            while True:
+                seen += [dataset.pk for dataset in page]
+                if not page.has_next():
+                    break
+                page = paginator.page(page.next_cursor)
+            self.assertEqual(seen, list(self.datasets.order_by(*ordering).values_list('pk', flat=True)))
+            # And back again from the last page
+            previous = paginator.page(page.previous_cursor)
+            self.assertEqual([dataset.pk for dataset in previous], seen[-len(page) - 2:-len(page)])
+
+    def test_tampered_cursors_are_not_found(self):
+        malformed = [
+            'not-base64!', encode_cursor(['2020-01-01', 'abc']), encode_cursor([None, 1]), encode_cursor([{}, 1]),
+            encode_cursor(['2020-01-01T00:00:00', True]), encode_cursor(['2020-01-01T00:00:00', 2 ** 70]),
+        ]
+        not_dates = [encode_cursor(['not a date', 1]), encode_cursor(['2020-13-45T00:00:00', 1])]
+        checks = [(path, cursor) for path in ('/datasets/?', '/api/v1/datasets/?') for cursor in malformed + not_dates]
+        checks += [(path, cursor) for path in ('/datasets/?sort=title&', '/api/v1/datasets/?ordering=title&')
+                   for cursor in malformed]
+        for path, cursor in checks:
+            response = self.client.get(f'{path}cursor={cursor}')
+            self.assertEqual(response.status_code, 404, f'{path}cursor={cursor}')
+
+    def test_count_modes(self):
+        total = self.datasets.count()
+        for mode in ('exact', 'cached', 'estimated'):
+            self.assertEqual(KeysetPaginator(self.datasets, 2, count_mode=mode).count, total)
+        self.assertIsNone(KeysetPaginator(self.datasets, 2, count_mode='none').count)
+
+    def test_cached_count_is_reused(self):
+        KeysetPaginator(self.datasets, 2, count_mode='cached').count
+        with self.assertNumQueries(0):
+            KeysetPaginator(self.datasets, 2, count_mode='cached').count
+
+    def test_listing_without_count(self):
+        with override_settings(EKAN_PAGINATION_COUNT='none'):
+            response = self.client.get('/datasets/')
+        self.assertNotContains(response, 'None datasets')
+        self.assertContains(response, self.dataset.title)
+
+
+
+class PrefixIndexTests(SimpleTestCase):
+
+    def make_index(self, titles):
+        index = PrefixIndex()
+        # Served from memory only: no load from, or sync with, the database
+        index.loaded, index.checked = True, time.monotonic()
+        for pk, (kind, title) in enumerate(titles, start=1):
+            index.add((kind, pk), make_entry(kind, title, f'{kind}-{pk}'))
+        return index
+
+    def titles(self, index, query):
+        return [entry['title'] for entry in index.search(query)]
+
+    def test_matches_any_word_ranking_title_starts_first(self):
+        index = self.make_index([
+            ('dataset', 'Ministry of Health Budget'), ('topic', 'Health'), ('organisation', 'Health Department'),
+            ('dataset', 'Wealth Survey'),
+        ])
+        self.assertEqual(self.titles(index, 'hea'), ['Health', 'Health Department', 'Ministry of Health Budget'])
+        self.assertEqual(self.titles(index, 'of health'), ['Ministry of Health Budget'])
+        self.assertEqual(self.titles(index, '  '), [])
+
+    def test_remove_and_replace(self):
+        index = self.make_index([('dataset', 'Water Quality')])
+        index.add(('dataset', 1), make_entry('dataset', 'Air Quality', 'dataset-1'))
+        self.assertEqual(self.titles(index, 'water'), [])
+        self.assertEqual(self.titles(index, 'air'), ['Air Quality'])
+        index.remove(('dataset', 1))
+        self.assertEqual(self.titles(index, 'quality'), [])
+
+    def test_search_during_updates(self):
+        # Exactly a page of matches: a search seeing an entry half-replaced returns fewer
+        index = self.make_index([('dataset', f'Health Report {i}') for i in range(10)])
+        errors = []
+
+        def churn():
+            for i in range(2000):
+                # As a sync does: add() replaces an entry's keys under the lock
+                index.add(('dataset', i % 10 + 1), make_entry('dataset', f'Health Report {i % 10}', 'slug'))
+
+        thread = threading.Thread(target=churn)
+        thread.start()
+        try:
+            while thread.is_alive():
+                results = index.search('health', limit=10)
+                if len(results) != 10:
+                    errors.append(len(results))
+        finally:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+@override_settings(EKAN_SUGGEST_SYNC_INTERVAL=0)
+class DidYouMeanTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        process_queue()
+        patcher = mock.patch.object(suggest, 'index', suggest.PrefixIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_closest_word(self):
+        vocabulary = Counter({'health': 3, 'wealth': 1, 'education': 2})
+        self.assertEqual(closest_word('helth', vocabulary), 'health')
+        self.assertEqual(closest_word('education', vocabulary), 'education')
+        self.assertIsNone(closest_word('xyzzy', vocabulary))
+
+    def test_corrects_unknown_words(self):
+        self.assertEqual(corrected_query('helth'), 'health')
+        self.assertEqual(corrected_query('Educaton  helth'), 'education health')
+        self.assertIsNone(corrected_query('health'))
+        self.assertIsNone(corrected_query('!!'))
+
+    def test_similar_titles(self):
+        self.assertIn('Health', [match['title'] for match in similar_titles('helth')])
+        self.assertEqual(similar_titles('qqqqzz'), [])
+
+    def test_postgresql_corrects_from_title_words(self):
+        # Words come from the trigram-indexed titles, not the in-process index
+        with mock.patch('app.fuzzy.connection', mock.Mock(vendor='postgresql')), \
+                mock.patch('app.fuzzy.similar_title_words', return_value=Counter({'health': 2})) as title_words, \
+                mock.patch.object(suggest.index, 'sync') as sync:
+            self.assertEqual(corrected_query('helth data'), 'health data')
+        title_words.assert_called_once_with(['helth', 'data'])
+        sync.assert_not_called()
+
+    def test_search_without_results_suggests(self):
+        response = self.client.get('/datasets/?q=helth')
+        self.assertEqual(response.context['did_you_mean']['query'], 'health')
+        self.assertContains(response, 'q=health')
+        self.assertIsNone(did_you_mean('qqqqzz'))
+
+
+class SearchIndexTests(QueryBudgetTestCase):
+
+    def entry(self, obj):
+        return SearchEntry.objects.get(kind=search_index.KINDS[type(obj)], object_id=obj.pk)
+
+    def run_command(self, *args, **options):
+        out = StringIO()
+        call_command(*args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_queue_worker_applies_changes(self):
+        self.assertTrue(SearchIndexChange.objects.exists())
+        output = self.run_command('process_search_queue', batch_size=2)
+        self.assertFalse(SearchIndexChange.objects.exists())
+        self.assertIn('Search index up to date', output)
+        entry = self.entry(self.dataset)
+        self.assertTrue(entry.is_active)
+        self.assertIn(normalise(self.organisation.title), entry.text)
+        self.assertIn(normalise(self.resource.title), entry.text)
+
+        # Topic titles are part of dataset text, and unpublished datasets leave search
+        self.topic.title = 'Public Wellbeing'
+        self.topic.save()
+        self.run_command('process_search_queue')
+        self.assertIn('public wellbeing', self.entry(self.dataset).text)
+        self.dataset.is_published = False
+        self.dataset.save()
+        self.run_command('process_search_queue')
+        self.assertFalse(self.entry(self.dataset).is_active)
+
+    def test_reindex_rebuilds_everything(self):
+        SearchEntry.objects.all().delete()
+        SearchEntry.objects.create(kind=SearchEntry.KIND_DATASET, object_id=10 ** 6, title='Gone', slug='gone')
+        self.run_command('reindex', workers=1, chunk_size=2)
+        self.assertFalse(SearchIndexChange.objects.exists())
+        self.assertFalse(SearchEntry.objects.get(object_id=10 ** 6).is_active)
+        expected = {
+            (entry.kind, entry.object_id): entry.text
+            for kind in search_index.KINDS.values()
+            for entry in search_index.build_entries(kind, list(search_index.listed(kind).values_list('pk', flat=True)))
+        }
+        active = SearchEntry.objects.filter(is_active=True)
+        self.assertEqual({(entry.kind, entry.object_id): entry.text for entry in active}, expected)
+
+    def test_migration_backfills_existing_catalog(self):
+        SearchEntry.objects.all().delete()
+        migration = importlib.import_module('app.migrations.0006_search_index')
+        migration.backfill_search_entries(django_apps, None)
+        expected = {
+            (entry.kind, entry.object_id): (entry.title, entry.text)
+            for kind in search_index.KINDS.values()
+            for entry in search_index.build_entries(kind, list(search_index.listed(kind).values_list('pk', flat=True)))
+        }
+        self.assertEqual(
+            {(entry.kind, entry.object_id): (entry.title, entry.text) for entry in SearchEntry.objects.all()}, expected
+        )
+
+
+class CounterTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        # The shared catalog is published with update(), which bypasses the signals
+        recount()
+
+    def counts(self):
+        self.organisation.refresh_from_db()
+        self.topic.refresh_from_db()
+        self.dataset.refresh_from_db()
+        return self.organisation.dataset_count, self.organisation.resource_count, self.topic.dataset_count, \
+            self.dataset.resource_count
+
+    def assertNoDrift(self):
+        self.assertEqual(set(recount().values()), {0})
+
+    def test_signals_keep_counters_current(self):
+        self.assertEqual(self.counts(), (1, 1, 1, 1))
+        other = create_datasets([self.organisation], self.licenses, self.users, [self.topic], count=1)[0]
+        other.is_published = True
+        other.save()
+        Resource.objects.create(title='Extra', dataset=other, url='https://example.com/extra.csv')
+        self.assertEqual(self.counts(), (2, 2, 2, 1))
+
+        # Moving a resource, unlinking a topic, unpublishing and deleting
+        self.resource.dataset = other
+        self.resource.save()
+        self.assertEqual(self.counts(), (2, 2, 2, 0))
+        other.topics.remove(self.topic)
+        self.assertEqual(self.counts(), (2, 2, 1, 0))
+        other.is_published = False
+        other.save()
+        self.assertEqual(self.counts(), (1, 0, 1, 0))
+        self.dataset.topics.clear()
+        self.dataset.delete()
+        self.organisation.refresh_from_db()
+        self.topic.refresh_from_db()
+        self.assertEqual((self.organisation.dataset_count, self.topic.dataset_count), (0, 0))
+        self.assertNoDrift()
+
+    def test_saving_a_stale_instance_keeps_counters(self):
+        stale = Organisation.objects.get(pk=self.organisation.pk)
+        Resource.objects.create(title='Extra', dataset=self.dataset, url='https://example.com/extra.csv')
+        stale.title = 'Renamed organisation'
+        stale.save()
+        self.organisation.refresh_from_db()
+        self.assertEqual((self.organisation.title, self.organisation.resource_count), ('Renamed organisation', 2))
+
+    def test_saving_an_instance_without_a_row_inserts_it(self):
+        topic = Topic.objects.create(title='Fisheries', slug='fisheries')
+        Topic.objects.filter(pk=topic.pk).delete()
+        topic.save()
+        self.assertTrue(Topic.objects.filter(pk=topic.pk, title='Fisheries').exists())
+
+    def test_recount_command_repairs_drift(self):
+        Organisation.objects.filter(pk=self.organisation.pk).update(dataset_count=40, resource_count=7)
+        Dataset.objects.filter(pk=self.dataset.pk).update(resource_count=0)
+        out = StringIO()
+        call_command('recount', stdout=out)
+        self.assertIn('Organisation.dataset_count: ⚠️  1 repaired', out.getvalue())
+        self.assertEqual(self.counts(), (1, 1, 1, 1))
+        self.assertNoDrift()
+
+
+class InstrumentationTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        self.grow(1)
+
+    def queries(self, function, sites=False):
+        with QueryRecorder(sites=sites) as recorder:
+            function()
+        return recorder.queries
+
+    def per_row(self, function):
+        """The query run for each row: the last of those `function` runs"""
+        return self.queries(function)[-1]['sql']
+
+    def test_fingerprint(self):
+        first = fingerprint("SELECT * FROM t WHERE a = 'x''y' AND b = 12 AND c IN (%s, %s)")
+        second = fingerprint("SELECT  *  FROM t\nWHERE a = 'z' AND b = 3.5 AND c IN (%s)")
+        self.assertEqual(first, second)
+        self.assertEqual(first, 'SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...)')
+
+    def test_suggest_fix(self):
+        datasets = list(Dataset.objects.all()[:2])
+        self.assertEqual(
+            suggest_fix(self.per_row(lambda: datasets[1].license)),
+            "Dataset: select_related('license')",
+        )
+        self.assertEqual(
+            suggest_fix(self.per_row(lambda: list(datasets[0].resources.all()))),
+            "Dataset: prefetch_related('resources')",
+        )
+        self.assertEqual(
+            suggest_fix(self.per_row(lambda: list(datasets[0].topics.all()))),
+            "Dataset: prefetch_related('topics')",
+        )
+        self.assertIsNone(suggest_fix('SELECT 1'))
+
+    def test_call_site(self):
+        def load():
+            return list(Topic.objects.all())
+
+        site = self.queries(load, sites=True)[0]['site']
+        self.assertRegex(site, r'^app/tests\.py:\d+ in load$')
+
+        template = Template('{% for dataset in datasets %}\n{{ dataset.license.title }}\n{% endfor %}')
+        datasets = list(Dataset.objects.filter(license__isnull=False))
+        queries = self.queries(lambda: template.render(Context({'datasets': datasets})), sites=True)
+        self.assertEqual({query['site'] for query in queries}, {'<unknown source>:2'})
+
+    def test_middleware_logs_repeats_over_threshold(self):
+        datasets = list(Dataset.objects.all()[:4])
+
+        def view(request):
+            for dataset in datasets:
+                dataset.refresh_from_db(fields=['title'])
+            return HttpResponse()
+
+        request = RequestFactory().get('/datasets/')
+        with override_settings(EKAN_NPLUSONE_DETECTION=True, EKAN_NPLUSONE_THRESHOLD=3):
+            with self.assertLogs('app.middleware', 'WARNING') as logs:
+                NPlusOneMiddleware(view)(request)
+        self.assertIn('Possible N+1 on GET /datasets/: 4 queries from app/tests.py', logs.output[0])
+        with override_settings(EKAN_NPLUSONE_DETECTION=True, EKAN_NPLUSONE_THRESHOLD=4):
+            with self.assertNoLogs('app.middleware', 'WARNING'):
+                NPlusOneMiddleware(view)(request)
+        with override_settings(EKAN_NPLUSONE_DETECTION=False), self.assertRaises(MiddlewareNotUsed):
+            NPlusOneMiddleware(view)
+
+
+class MetricsTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='ekan-metrics-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_endpoint_requires_token_or_staff(self):
+        with override_settings(EKAN_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, '# TYPE ekan_requests_total counter')
+
+        # Without a token only staff get in
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 401)
+        user = self.users[0]
+        type(user).objects.filter(pk=user.pk).update(is_staff=False)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        type(user).objects.filter(pk=user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with override_settings(EKAN_METRICS=False):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_totals_cover_every_process(self):
+        first, second = metrics.Registry(), metrics.Registry()
+        second.filename = f'other-{second.filename}'
+        first.inc('ekan_downloads_total', format='csv')
+        second.inc('ekan_downloads_total', 2, format='csv')
+        second.inc('ekan_downloads_total', format='json')
+        first.observe('ekan_request_duration_seconds', 0.02, view='home')
+        second.observe('ekan_request_duration_seconds', 20, view='home')
+
+        with override_settings(EKAN_METRICS_DIR=self.directory), mock.patch.object(metrics, 'registry', first):
+            second.flush(force=True)
+            # Partly written files are skipped rather than failing the scrape
+            with open(f'{self.directory}/broken.json', 'w') as f:
+                f.write('[')
+            totals = metrics.collect()
+            text = metrics.render()
+
+        self.assertEqual(totals[('ekan_downloads_total', (('format', 'csv'),))], 3)
+        self.assertEqual(totals[('ekan_downloads_total', (('format', 'json'),))], 1)
+        self.assertIn('ekan_downloads_total{format="csv"} 3\n', text)
+        self.assertIn('ekan_request_duration_seconds_bucket{view="home",le="0.01"} 0\n', text)
+        self.assertIn('ekan_request_duration_seconds_bucket{view="home",le="0.025"} 1\n', text)
+        self.assertIn('ekan_request_duration_seconds_bucket{view="home",le="10"} 1\n', text)
+        self.assertIn('ekan_request_duration_seconds_bucket{view="home",le="+Inf"} 2\n', text)
+        self.assertIn('ekan_request_duration_seconds_sum{view="home"} 20.02\n', text)
+        self.assertIn('ekan_request_duration_seconds_count{view="home"} 2\n', text)
+        self.assertIn('ekan_search_queue_depth ', text)
+
+    def test_flush_is_rate_limited(self):
+        registry = metrics.Registry()
+        registry.inc('ekan_downloads_total', format='csv')
+        with override_settings(EKAN_METRICS_DIR=self.directory, EKAN_METRICS_FLUSH_INTERVAL=60):
+            registry.flush()
+            registry.inc('ekan_downloads_total', format='csv')
+            registry.flush()
+        with open(f'{self.directory}/{registry.filename}') as f:
+            self.assertEqual(json.load(f), [['ekan_downloads_total', [['format', 'csv']], 1]])
+
+
+@override_settings(EKAN_SLOW_QUERY_MS=0)
+class SlowQueryLogTests(QueryBudgetTestCase):
+
+    def setUp(self):
+        slow_queries.take()
+        # Installed when the connection opens, unless the log was disabled then
+        with override_settings(EKAN_SLOW_QUERY_MS=1):
+            slow_queries.install(connection)
+
+    def test_wrapper_buffers_runs_with_their_call_site(self):
+        Topic.objects.get(pk=self.topic.pk)
+        runs = slow_queries.take()
+        self.assertEqual(len(runs), 1)
+        self.assertIn('"app_topic"', runs[0]['sql'])
+        self.assertEqual(runs[0]['params'], (self.topic.pk,))
+        self.assertRegex(runs[0]['site'], r'^app/tests\.py:\d+ in test_wrapper_buffers_runs_with_their_call_site$')
+        with override_settings(EKAN_SLOW_QUERY_MS=60000):
+            Topic.objects.get(pk=self.topic.pk)
+        self.assertEqual(slow_queries.take(), [])
+
+    def test_buffer_is_bounded(self):
+        with mock.patch.object(slow_queries, 'MAX_BUFFERED', 3):
+            for topic in self.topics[:5]:
+                Topic.objects.filter(pk=topic.pk).exists()
+            self.assertEqual(len(slow_queries.take()), 3)
+
+    def test_flush_aggregates_by_fingerprint(self):
+        def load_topics():
+            for topic in self.topics[:3]:
+                Topic.objects.get(pk=topic.pk)
+
+        load_topics()
+        Organisation.objects.count()
+        slow_queries.flush()
+        self.assertEqual(slow_queries.take(), [])
+        # Writing the log is not logged itself
+        self.assertEqual(SlowQuery.objects.count(), 2)
+
+        entry = SlowQuery.objects.get(fingerprint__contains='"app_topic"')
+        self.assertEqual(entry.count, 3)
+        self.assertEqual(len(entry.samples), 3)
+        self.assertAlmostEqual(entry.total_ms, sum(entry.samples), places=2)
+        self.assertAlmostEqual(entry.max_ms, max(entry.samples), places=2)
+        self.assertRegex(entry.site, r'^app/tests\.py:\d+ in load_topics$')
+        self.assertTrue(entry.explain)
+
+        Topic.objects.get(pk=self.topic.pk)
+        slow_queries.flush()
+        entry.refresh_from_db()
+        self.assertEqual(entry.count, 4)
+        self.assertEqual(len(entry.samples), 4)
+
+    def test_queue_worker_writes_its_slow_queries(self):
+        Topic.objects.filter(pk=self.topic.pk).update(title='Queued topic')
+        SearchIndexChange.objects.create(kind='topic', object_id=self.topic.pk)
+        call_command('process_search_queue', stdout=StringIO())
+        self.assertEqual(slow_queries.take(), [])
+        self.assertTrue(SlowQuery.objects.filter(fingerprint__contains='search').exists())
@@ -47,5 +47,8 @@ urlpatterns = [
     
     # Debug endpoint (only in DEBUG mode)
     path('debug/', views.DebugView.as_view(), name='debug'),
+
+    # Monitoring
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) \
   + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
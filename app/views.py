@@ -1,21 +1,38 @@
-from django.shortcuts import get_object_or_404, render
-from django.views.generic import ListView, DetailView, TemplateView, CreateView
+from django.shortcuts import render
+from django.views.generic import ListView, DetailView, TemplateView, CreateView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.admin.views.decorators import staff_member_required
 from django.utils.decorators import method_decorator
+from django.utils.crypto import constant_time_compare
 from django.contrib import messages
 from django.urls import reverse
 from django.http import HttpResponse, Http404
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from django.conf import settings
 from .models import Dataset, Organisation, Topic, Resource
 from .forms import OrganisationRegistrationForm
+from .facets import get_facet_counts
+from .fuzzy import did_you_mean
+from .filters import DatasetFilterSet
+from .pagination import KeysetPaginator, InvalidCursor, ORDERINGS
+from .profiling import timed
+from .cache import get_or_refresh
+from .conditional import DATASET_VALIDATORS, ORGANISATION_VALIDATORS
+from . import metrics
 from .mixins import (
     EKANMetaMixin, DatasetMetaMixin, OrganisationMetaMixin, 
-    ResourceMetaMixin, TopicMetaMixin
+    ResourceMetaMixin, TopicMetaMixin, SharedObjectMixin, ConditionalDetailMixin
 )
 
 
+def with_card_relations(datasets):
+    """
+    Fetch the organisation dataset cards show. Resource formats are
+    prefetched by the `cards` tag, only for cards not already cached.
+    """
+    return datasets.select_related('organisation')
+
+
 class HomeView(EKANMetaMixin, TemplateView):
     """Homepage displaying featured datasets and topics"""
     template_name = 'home.html'
@@ -44,62 +61,58 @@ class DatasetListView(DatasetMetaMixin, ListView):
     meta_description = 'Browse and download open government datasets across various categories and organizations.'
     
     def get_queryset(self):
-        queryset = Dataset.objects.filter(is_published=True).order_by('-updated')
-        
-        # Search functionality - search across multiple fields
-        query = self.request.GET.get('q')
-        if query:
-            queryset = queryset.filter(
-                Q(title__icontains=query) | 
-                Q(description__icontains=query) |
-                Q(notes__icontains=query) |
-                Q(organisation__title__icontains=query) |
-                Q(topics__title__icontains=query) |
-                Q(resources__title__icontains=query) |
-                Q(resources__description__icontains=query)
-            )
+        queryset = with_card_relations(Dataset.objects.filter(is_published=True).order_by('-updated'))
         
-        # Filter by organisation
-        org_slug = self.request.GET.get('organisation')
-        if org_slug:
-            queryset = queryset.filter(organisation__slug=org_slug)
-        
-        # Filter by topic
-        topic_slug = self.request.GET.get('topic')
-        if topic_slug:
-            queryset = queryset.filter(topics__slug=topic_slug)
-        
-        # Filter by license
-        license_slug = self.request.GET.get('license')
-        if license_slug:
-            queryset = queryset.filter(license__slug=license_slug)
-        
-        return queryset.distinct()
+        # Search and multi-value filters (topic, organisation, license, format)
+        self.filterset = DatasetFilterSet(self.request.GET, queryset=queryset, request=self.request)
+        return self.filterset.qs
+    
+    def get_ordering(self):
+        return ORDERINGS.get(self.request.GET.get('sort'), ORDERINGS['-updated'])
+    
+    def paginate_queryset(self, queryset, page_size):
+        """Keyset pagination on (updated, id) or (title, id) instead of OFFSET"""
+        paginator = KeysetPaginator(queryset, page_size, ordering=self.get_ordering())
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        return (paginator, page, page.object_list, page.has_other_pages())
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Facet counts for the sidebar under the current search and filters
+        context['facets'] = get_facet_counts(self.object_list, self.request.GET)
+        # Suggest spelling corrections and close title matches when a search finds nothing
+        query = self.request.GET.get('q', '').strip()
+        if query and not context['datasets'] and not self.request.GET.get('cursor'):
+            context['did_you_mean'] = did_you_mean(query)
+        return context
 
 
-class DatasetDetailView(DatasetMetaMixin, DetailView):
+class DatasetDetailView(ConditionalDetailMixin, SharedObjectMixin, DatasetMetaMixin, DetailView):
     """Display a single dataset with its resources"""
     model = Dataset
     template_name = 'datasets/show.html'
     context_object_name = 'dataset'
+    validators = DATASET_VALIDATORS
     
     def get_queryset(self):
-        return Dataset.objects.filter(is_published=True)
+        return Dataset.objects.filter(is_published=True).select_related(
+            'organisation__manager', 'license'
+        ).prefetch_related(
+            'topics', Prefetch('resources', queryset=Resource.objects.select_related('format'))
+        )
 
 
-class ResourceDetailView(ResourceMetaMixin, DetailView):
+class ResourceDetailView(SharedObjectMixin, ResourceMetaMixin, DetailView):
     """Display a single resource"""
     model = Resource
     template_name = 'resources/show.html'
     context_object_name = 'resource'
     
-    def get_object(self):
-        resource_slug = self.kwargs.get('slug')
-        return get_object_or_404(
-            Resource,
-            slug=resource_slug,
-            dataset__is_published=True
-        )
+    def get_queryset(self):
+        return Resource.objects.select_related('dataset__organisation', 'format').filter(dataset__is_published=True)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -113,24 +126,19 @@ class ResourceDetailView(ResourceMetaMixin, DetailView):
         # Add related resources (other resources from the same dataset)
         context['related_resources'] = self.object.dataset.resources.exclude(
             id=self.object.id
-        ).order_by('-updated')[:5]
+        ).select_related('format').order_by('-updated')[:5]
         
         return context
 
 
-class ResourcePreviewView(DetailView):
+class ResourcePreviewView(SharedObjectMixin, DetailView):
     """Display resource preview in a modal or separate view"""
     model = Resource
     template_name = 'resources/preview.html'
     context_object_name = 'resource'
     
-    def get_object(self):
-        resource_slug = self.kwargs.get('slug')
-        return get_object_or_404(
-            Resource,
-            slug=resource_slug,
-            dataset__is_published=True
-        )
+    def get_queryset(self):
+        return Resource.objects.select_related('dataset', 'format').filter(dataset__is_published=True)
     
     def dispatch(self, request, *args, **kwargs):
         """Redirect URL-based resources to detail page since they can't be previewed"""
@@ -161,7 +169,12 @@ class ResourceDownloadView(DetailView):
         
         if resource.file:
             # Serve uploaded file
-            response = HttpResponse(resource.file.read(), content_type=resource.mimetype or 'application/octet-stream')
+            with timed('storage'):
+                content = resource.file.read()
+            format_name = resource.format.title.upper() if resource.format else 'none'
+            metrics.inc('ekan_downloads_total', format=format_name)
+            metrics.inc('ekan_download_bytes_total', len(content), format=format_name)
+            response = HttpResponse(content, content_type=resource.mimetype or 'application/octet-stream')
             response['Content-Disposition'] = f'attachment; filename="{resource.file.name}"'
             return response
         elif resource.url:
@@ -199,11 +212,12 @@ class OrganisationListView(OrganisationMetaMixin, ListView):
         return queryset.distinct()
 
 
-class OrganisationDetailView(OrganisationMetaMixin, DetailView):
+class OrganisationDetailView(ConditionalDetailMixin, SharedObjectMixin, OrganisationMetaMixin, DetailView):
     """Display an organisation with its datasets"""
     model = Organisation
     template_name = 'organisations/show.html'
     context_object_name = 'organisation'
+    validators = ORGANISATION_VALIDATORS
     
     def get_queryset(self):
         return Organisation.objects.filter(
@@ -254,7 +268,7 @@ class TopicListView(TopicMetaMixin, ListView):
         return queryset.distinct()
 
 
-class TopicDetailView(TopicMetaMixin, DetailView):
+class TopicDetailView(SharedObjectMixin, TopicMetaMixin, DetailView):
     """Display a topic with its datasets"""
     model = Topic
     template_name = 'topics/show.html'
@@ -262,7 +276,9 @@ class TopicDetailView(TopicMetaMixin, DetailView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['datasets'] = self.object.datasets.filter(is_published=True).order_by('-updated')
+        context['datasets'] = with_card_relations(
+            self.object.datasets.filter(is_published=True).order_by('-updated')
+        )
         return context
 
 
@@ -275,11 +291,18 @@ class AboutView(EKANMetaMixin, TemplateView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['total_datasets'] = Dataset.objects.filter(is_published=True).count()
-        context['total_organisations'] = Organisation.objects.filter(status='approved').count()
-        context['total_resources'] = Resource.objects.filter(dataset__is_published=True).count()
-        context['total_topics'] = Topic.objects.count()
+        context.update(get_or_refresh(
+            'aggregate:about', self.get_totals, getattr(settings, 'EKAN_AGGREGATE_CACHE_TIMEOUT', 300)
+        ))
         return context
+    
+    def get_totals(self):
+        return {
+            'total_datasets': Dataset.objects.filter(is_published=True).count(),
+            'total_organisations': Organisation.objects.filter(status='approved').count(),
+            'total_resources': Resource.objects.filter(dataset__is_published=True).count(),
+            'total_topics': Topic.objects.count(),
+        }
 
 
 class ContactView(EKANMetaMixin, TemplateView):
@@ -328,6 +351,20 @@ class AccountView(LoginRequiredMixin, TemplateView):
         return context
 
 
+class MetricsView(View):
+    """Prometheus metrics, summed across worker processes (see metrics.py)"""
+
+    def get(self, request, *args, **kwargs):
+        if not getattr(settings, 'EKAN_METRICS', False):
+            raise Http404("Metrics are disabled")
+        # Scrapers send the token; staff can look in a browser
+        token = getattr(settings, 'EKAN_METRICS_TOKEN', '')
+        authorised = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+        if not (authorised or request.user.is_staff):
+            return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class DebugView(TemplateView):
     """Debug view to test static file serving"""
     template_name = 'debug.html'
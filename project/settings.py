@@ -60,6 +60,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,7 +69,10 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'app.middleware.PageCacheMiddleware',
     'django_browser_reload.middleware.BrowserReloadMiddleware',
+    'app.middleware.ProfilingMiddleware',
+    'app.middleware.NPlusOneMiddleware',
 ]
 
 ROOT_URLCONF = 'project.urls'
@@ -129,6 +133,45 @@ DATABASES = {
     )
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    # Trigram lookups for fuzzy search (pg_trgm)
+    INSTALLED_APPS.append('django.contrib.postgres')
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# `default` is a cache all workers share. CACHE_URL picks it: redis://host:6379/0 (needs the redis
+# package), or a directory for file-based caching; when empty, a per-process memory cache stands in
+# (development and tests). `tiered` puts a bounded in-process LRU (app.cache_backend.TieredCache) in
+# front of it for the catalog, page, fragment and API caches (app/cache.py); everything else, like
+# allauth's rate limits, reads and writes `default` directly so changes are seen by every worker.
+
+CACHE_URL = config('CACHE_URL', default='')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    SHARED_CACHE = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}
+elif CACHE_URL:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': CACHE_URL,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+else:
+    SHARED_CACHE = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'ekan-shared'}
+
+CACHES = {
+    'default': SHARED_CACHE,
+    'tiered': {
+        'BACKEND': 'app.cache_backend.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'default',
+            'LOCAL_TIMEOUT': 30,  # seconds a value may be served from process memory
+            'MAX_ENTRIES': 1000,
+            'MAX_BYTES': 32 * 1024 * 1024,
+            # Changed in place and read by every process: always fetched from the shared tier
+            'SHARED_ONLY': ['catalog:version', '*:lock', 'aggregate:*'],
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -176,7 +219,7 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 # Django REST Framework
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -193,6 +236,61 @@ EKAN_SITE_TITLE = "EKAN"
 EKAN_SITE_DESCRIPTION = "Open Data Portal for Government Organizations"
 EKAN_ITEMS_PER_PAGE = 10
 EKAN_ALLOW_PUBLIC_REGISTRATION = True
+EKAN_FACET_CACHE_TIMEOUT = 60  # seconds to cache sidebar facet counts per query
+# Total row count on paginated listings: 'exact', 'cached', 'estimated' (PostgreSQL planner) or 'none'
+EKAN_PAGINATION_COUNT = config('EKAN_PAGINATION_COUNT', default='cached')
+EKAN_PAGINATION_COUNT_TIMEOUT = 60
+EKAN_FUZZY_THRESHOLD = 0.4  # minimum trigram similarity for "did you mean" suggestions
+# Apply queued search index changes right after commit instead of in the process_search_queue worker
+EKAN_SEARCH_INDEX_EAGER = config('EKAN_SEARCH_INDEX_EAGER', default=DEBUG, cast=bool)
+EKAN_SUGGEST_SYNC_INTERVAL = 5  # seconds between checks for suggestion index changes from other processes
+# Log queries repeated more than EKAN_NPLUSONE_THRESHOLD times per call site in a request (development and staging)
+EKAN_NPLUSONE_DETECTION = config('EKAN_NPLUSONE_DETECTION', default=DEBUG, cast=bool)
+EKAN_NPLUSONE_THRESHOLD = config('EKAN_NPLUSONE_THRESHOLD', default=5, cast=int)
+# Server-Timing headers and per-request timing logs; staff can request cProfile dumps with X-Profile: 1
+EKAN_PROFILING = config('EKAN_PROFILING', default=DEBUG, cast=bool)
+EKAN_PROFILE_DIR = config('EKAN_PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+# Prometheus metrics at /metrics. With several worker processes, set EKAN_METRICS_DIR to a directory
+# they share (emptied on deploy); each process writes its totals there every EKAN_METRICS_FLUSH_INTERVAL seconds.
+EKAN_METRICS = config('EKAN_METRICS', default=True, cast=bool)
+EKAN_METRICS_DIR = config('EKAN_METRICS_DIR', default='')
+EKAN_METRICS_FLUSH_INTERVAL = 5
+EKAN_METRICS_TOKEN = config('EKAN_METRICS_TOKEN', default='')  # scrapers send "Authorization: Bearer <token>"; otherwise staff only
+# Log statements slower than this many milliseconds, aggregated by fingerprint (0 disables); see `manage.py slow_queries`
+EKAN_SLOW_QUERY_MS = config('EKAN_SLOW_QUERY_MS', default=200, cast=int)
+# Catalog-derived values (footer stats, sidebar filters) are cached until the catalog changes, or this many seconds
+EKAN_CATALOG_CACHE_TIMEOUT = 300
+EKAN_CACHE_LOCK_TIMEOUT = 10  # seconds other processes wait for one process to fill a missing cache entry
+# Whole pages for anonymous visitors, cached until the catalog changes (off in development so template edits show)
+EKAN_PAGE_CACHE = config('EKAN_PAGE_CACHE', default=not DEBUG, cast=bool)
+EKAN_PAGE_CACHE_TIMEOUT = 300
+EKAN_PAGE_CACHE_VIEWS = [
+    'app:home', 'app:datasets', 'app:dataset', 'app:topics', 'app:topic', 'app:organisations', 'app:organisation',
+]
+# Expensive aggregates (cache.get_or_refresh) are recomputed after this many seconds; until then, for up to
+# EKAN_CACHE_STALE_TIMEOUT more seconds, the old value is served while one worker refreshes it in the background
+EKAN_AGGREGATE_CACHE_TIMEOUT = 300
+EKAN_CACHE_STALE_TIMEOUT = 300
+EKAN_CACHE_BACKGROUND_REFRESH = True
+# Rendered API list and detail responses, cached until the catalog changes (or this many seconds)
+EKAN_API_CACHE = config('EKAN_API_CACHE', default=True, cast=bool)
+EKAN_API_CACHE_TIMEOUT = 300
+# Build API list responses for datasets and resources from .values() rows instead of ModelSerializers
+EKAN_FAST_SERIALIZERS = config('EKAN_FAST_SERIALIZERS', default=True, cast=bool)
+EKAN_EXPORT_CHUNK_SIZE = 500  # datasets fetched (with their topics and resources) per batch in streamed exports
+# Rendered dataset, topic and organisation cards, keyed by what they show; entries expire after this many seconds
+EKAN_FRAGMENT_CACHE_TIMEOUT = 3600
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'app': {'handlers': ['console'], 'level': config('EKAN_LOG_LEVEL', default='INFO')},
+    },
+}
 
 # Email Configuration
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
@@ -19,10 +19,14 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from api.views import CatalogExportView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('allauth.urls')),
     path('api/', include('api.urls')),
+    # Where catalog harvesters look for a DCAT-US catalog
+    path('data.json', CatalogExportView.as_view(), {'export_format': 'dcat'}, name='data_json'),
     path('', include('app.urls')),
 ]
 